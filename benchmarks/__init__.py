@@ -0,0 +1,7 @@
+'''Benchmarks: a deterministic synthetic library, stage microbenchmarks, and end-to-end runs
+    recorded to a JSON baseline. Run with `python -m benchmarks --help`.
+'''
+from .synthetic import generate_library, texture_image, library_path
+from .baseline import BenchResult, Comparison, save_baseline, load_baseline, compare, peak_rss_mb
+from .micro import run_micro, timed
+from .endtoend import run_end_to_end, run_end_to_end_isolated
@@ -0,0 +1,42 @@
+from __future__ import annotations
+import argparse
+import pathlib
+
+from .synthetic import generate_library
+from .baseline import save_baseline, load_baseline, compare
+from .micro import run_micro
+from .endtoend import run_end_to_end_isolated
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark the mosaic pipeline on a synthetic library.')
+    parser.add_argument('--library', type=pathlib.Path, default=pathlib.Path('data/benchmark_library'), help='folder for the generated library (reused between runs)')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000], help='candidate counts for end-to-end runs')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[480, 640], metavar=('H', 'W'))
+    parser.add_argument('--micro-count', type=int, default=500, help='library images used by the microbenchmarks')
+    parser.add_argument('--baseline', type=pathlib.Path, default=pathlib.Path('benchmarks/baseline.json'))
+    parser.add_argument('--tolerance', type=float, default=0.1, help='throughput drop reported as a regression')
+    parser.add_argument('--update-baseline', action='store_true', help='overwrite the baseline with this run')
+    args = parser.parse_args()
+
+    num_images = max(args.sizes + [args.micro_count])
+    print(f'generating {num_images} images in {args.library}')
+    paths = generate_library(args.library, num_images, size=tuple(args.image_size))
+
+    results = run_micro(paths[:args.micro_count])
+    for r in results:
+        print(r)
+    for n in args.sizes:
+        result = run_end_to_end_isolated(args.library, n)
+        print(result, {stage: round(s, 3) for stage, s in result.stages.items()})
+        results.append(result)
+
+    if args.baseline.exists():
+        print(f'\ncompared with {args.baseline}:')
+        for comparison in compare(results, load_baseline(args.baseline), tolerance=args.tolerance):
+            print(comparison)
+    if args.update_baseline or not args.baseline.exists():
+        save_baseline(args.baseline, results)
+        print(f'saved baseline to {args.baseline}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+from __future__ import annotations
+import pathlib
+import dataclasses
+import typing
+import json
+import os
+import time
+import platform
+import resource
+import numpy as np
+
+@dataclasses.dataclass
+class BenchResult:
+    '''Wall time for processing a number of items, with the process's peak RSS when it was measured.'''
+    name: str
+    seconds: float
+    items: int
+    peak_rss_mb: float | None = None
+    stages: typing.Dict[str, float] = dataclasses.field(default_factory=dict) # seconds per stage, for end-to-end runs
+
+    @property
+    def throughput(self) -> float:
+        '''Items per second.'''
+        return self.items / self.seconds if self.seconds > 0 else float('inf')
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {**dataclasses.asdict(self), 'throughput': self.throughput}
+
+    @classmethod
+    def from_dict(cls, data: typing.Dict[str, typing.Any]) -> BenchResult:
+        return cls(**{f.name: data[f.name] for f in dataclasses.fields(cls) if f.name in data})
+
+    def __str__(self) -> str:
+        rss = f', peak rss {self.peak_rss_mb:.0f} MB' if self.peak_rss_mb is not None else ''
+        return f'{self.name:<28} {self.items:>8} items in {self.seconds:8.3f}s = {self.throughput:10.1f}/s{rss}'
+
+@dataclasses.dataclass
+class Comparison:
+    name: str
+    baseline: BenchResult
+    current: BenchResult
+    tolerance: float
+
+    @property
+    def ratio(self) -> float:
+        '''Current throughput relative to the baseline (above 1 is faster).'''
+        return self.current.throughput / self.baseline.throughput
+
+    @property
+    def regressed(self) -> bool:
+        return self.ratio < 1 - self.tolerance
+
+    def __str__(self) -> str:
+        flag = 'REGRESSED' if self.regressed else ('faster' if self.ratio > 1 + self.tolerance else 'ok')
+        rss = ''
+        if self.current.peak_rss_mb is not None and self.baseline.peak_rss_mb is not None:
+            rss = f', rss {self.baseline.peak_rss_mb:.0f} -> {self.current.peak_rss_mb:.0f} MB'
+        return f'{self.name:<28} {self.baseline.throughput:10.1f}/s -> {self.current.throughput:10.1f}/s ({self.ratio:5.2f}x) {flag}{rss}'
+
+def peak_rss_mb() -> float:
+    '''Peak resident set size of this process and its waited-for children (ru_maxrss is KB on Linux, bytes on macOS).'''
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss * scale / 2**20
+
+def environment() -> typing.Dict[str, typing.Any]:
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def save_baseline(path: pathlib.Path, results: typing.List[BenchResult]) -> None:
+    path = pathlib.Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with path.open('w') as f:
+        json.dump({'environment': environment(), 'results': [r.to_dict() for r in results]}, f, indent=2)
+
+def load_baseline(path: pathlib.Path) -> typing.Dict[str, BenchResult]:
+    with pathlib.Path(path).open('r') as f:
+        return {r['name']: BenchResult.from_dict(r) for r in json.load(f)['results']}
+
+def compare(results: typing.List[BenchResult], baseline: typing.Dict[str, BenchResult], tolerance: float = 0.1) -> typing.List[Comparison]:
+    '''Compare each result with the baseline result of the same name (results without one are skipped).'''
+    return [Comparison(r.name, baseline[r.name], r, tolerance) for r in results if r.name in baseline]
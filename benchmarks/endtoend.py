@@ -0,0 +1,72 @@
+from __future__ import annotations
+import pathlib
+import typing
+import time
+import itertools
+import functools
+import tempfile
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+import canvas
+import photomosaic
+
+from .baseline import BenchResult, peak_rss_mb
+from .micro import target_tiles
+
+def run_end_to_end(
+    library: pathlib.Path,
+    n: int,
+    thumb_size: typing.Tuple[int, int] = (32, 32),
+    grid: typing.Tuple[int, int] = (20, 30),
+    batch_size: int = 256,
+    k: int = 10,
+    dtype: np.dtype = np.float32,
+) -> BenchResult:
+    '''Discover, decode, score, assign and render n candidates from library, timing each stage.'''
+    stages = dict()
+    start = time.perf_counter()
+
+    paths = [found.path for found in itertools.islice(canvas.scan_images(library), n)]
+    stages['discover'] = time.perf_counter() - start
+
+    # decode in read-ahead threads while distances are computed in batches
+    tiles = target_tiles(grid, thumb_size)
+    engine = photomosaic.DistanceMatrixEngine.from_tiles(tiles, dtype=dtype)
+    topk = photomosaic.TopKAccumulator.empty(engine.num_positions, k)
+    read_ahead = photomosaic.ReadAhead(items=range(len(paths)), load_func=lambda i: photomosaic.read_thumbnail(paths[i], thumb_size), depth=4*batch_size)
+    loaded = iter(read_ahead)
+    score_seconds = 0.0
+    while True:
+        batch = list(itertools.islice(loaded, batch_size))
+        if not len(batch):
+            break
+        score_start = time.perf_counter()
+        topk.push(np.array([i for i, _ in batch]), engine.calc_block(photomosaic.stack_images(thumb for _, thumb in batch)))
+        score_seconds += time.perf_counter() - score_start
+    stages['decode_wait'] = read_ahead.stats.wait_seconds
+    stages['score'] = score_seconds
+
+    stage_start = time.perf_counter()
+    assignment = topk.assign(method='sparse')
+    stages['assign'] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    chosen = [paths[i] if i >= 0 else None for i in assignment.cand_ids.tolist()]
+    with tempfile.TemporaryDirectory() as tmp:
+        photomosaic.render_tiles_to_file(pathlib.Path(tmp) / 'mosaic.tif', chosen, grid[1], grid[0], thumb_size, processes=1)
+    stages['render'] = time.perf_counter() - stage_start
+
+    return BenchResult(
+        name=f'end_to_end_{n}',
+        seconds=time.perf_counter() - start,
+        items=len(paths),
+        peak_rss_mb=peak_rss_mb(),
+        stages=stages,
+    )
+
+def run_end_to_end_isolated(library: pathlib.Path, n: int, **kwargs) -> BenchResult:
+    '''Run in a fresh process so the peak RSS belongs to this run alone.'''
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(functools.partial(run_end_to_end, library, n, **kwargs)).result()
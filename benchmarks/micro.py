@@ -0,0 +1,90 @@
+from __future__ import annotations
+import pathlib
+import typing
+import time
+import tempfile
+import numpy as np
+import skimage
+
+import mediatools
+import canvas
+import photomosaic
+
+from .baseline import BenchResult
+from .synthetic import texture_image
+
+def timed(name: str, items: int, func: typing.Callable[[], typing.Any], repeat: int = 3) -> BenchResult:
+    '''Best wall time of repeat calls (the first call also warms caches).'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return BenchResult(name=name, seconds=best, items=items)
+
+def target_tiles(grid: typing.Tuple[int, int], thumb_size: typing.Tuple[int, int], seed: int = 0) -> np.ndarray:
+    '''(P, h, w, 3) float tiles cut from a synthetic target image, row-major.'''
+    (y_slices, x_slices), (h, w) = grid, thumb_size
+    target = skimage.img_as_float(texture_image(0, (y_slices*h, x_slices*w), seed=seed + 1)) # a seed the library does not use
+    return np.stack([target[y*h:(y+1)*h, x*w:(x+1)*w] for y in range(y_slices) for x in range(x_slices)])
+
+def run_micro(
+    paths: typing.Sequence[pathlib.Path],
+    thumb_size: typing.Tuple[int, int] = (32, 32),
+    grid: typing.Tuple[int, int] = (20, 30),
+) -> typing.List[BenchResult]:
+    '''Microbenchmarks of the individual pipeline stages on the given library images.'''
+    n = len(paths)
+    results = list()
+
+    # thumbnails from originals, and the stacked uint8 thumbs they become
+    results.append(timed('thumbnail_build', n, lambda: [photomosaic.read_thumbnail(p, thumb_size) for p in paths], repeat=1))
+    thumbs = np.stack([photomosaic.read_thumbnail(p, thumb_size) for p in paths])
+    cands = skimage.img_as_float(thumbs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = canvas.ThumbStore.open(pathlib.Path(tmp), thumb_size)
+        for p, thumb in zip(paths, thumbs):
+            store.add(p, thumb)
+        store.flush()
+        results.append(timed('thumb_load', n, lambda: np.stack([store.get(p) for p in paths])))
+
+    # distances from candidates to every target tile
+    tiles = target_tiles(grid, thumb_size)
+    tile_gradients = photomosaic.gradient_stack(tiles)
+    cand_gradients = photomosaic.gradient_stack(cands)
+    def single_distances():
+        for i in range(n):
+            photomosaic.composit_distances(tiles, tile_gradients, cands[i], cand_gradients[i])
+    results.append(timed('single_distance', n, single_distances))
+    for dtype in (np.float64, np.float32, np.uint8):
+        engine = photomosaic.DistanceMatrixEngine.from_tiles(tiles, tile_gradients=tile_gradients, dtype=dtype)
+        results.append(timed(f'batch_distance_{np.dtype(dtype).name}', n, lambda: engine.calc(cands)))
+
+    # greedy insertion of precomputed distances
+    dists = photomosaic.DistanceMatrixEngine.from_tiles(tiles, tile_gradients=tile_gradients).calc(cands)
+    positions = range(len(tiles))
+    cand_imgs = [mediatools.Image(c) for c in cands]
+    def greedy_insert():
+        scores = photomosaic.GridScores.from_grid_size(x_slices=grid[1], y_slices=grid[0])
+        for i in range(n):
+            scores.insert_any_if_best(cand_imgs[i], list(zip(dists[i].tolist(), positions)), cand_id=i)
+        return scores
+    results.append(timed('greedy_insert', n, greedy_insert))
+
+    # recombining a full grid, in memory and streamed to disk
+    image_grid = photomosaic.ImageGrid(subimages=[cand_imgs[i % n] for i in positions], x_slices=grid[1], y_slices=grid[0])
+    results.append(timed('recombine', len(positions), image_grid.recombine))
+    with tempfile.TemporaryDirectory() as tmp:
+        results.append(timed('recombine_tiled', len(positions), lambda: image_grid.write_tiled(pathlib.Path(tmp) / 'mosaic.tif')))
+
+    # distance database: blocks of candidates inserted, then the top-k table read back
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canvas.DistanceDB.open(pathlib.Path(tmp) / 'distances.db')
+        block = 100
+        def db_insert():
+            for start in range(0, n, block):
+                db.insert_matrix('target', [str(p) for p in paths[start:start+block]], dists[start:start+block])
+        results.append(timed('db_insert', n, db_insert, repeat=1))
+        results.append(timed('db_query_top', len(positions), lambda: db.load_top_distances('target')))
+    return results
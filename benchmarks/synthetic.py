@@ -0,0 +1,55 @@
+from __future__ import annotations
+import pathlib
+import typing
+import json
+import os
+import multiprocessing
+import functools
+import numpy as np
+from PIL import Image
+
+# sidecar marking an image as a phone-camera photo, so generated libraries pass filter_usable_photo
+PHOTO_SIDECAR = {'googlePhotosOrigin': {'mobileUpload': {'deviceFolder': {'localFolderName': ''}, 'deviceType': 'ANDROID_PHONE'}}}
+
+def texture_image(index: int, size: typing.Tuple[int, int], seed: int = 0) -> np.ndarray:
+    '''Deterministic smooth random texture (uint8 rgb). Image i depends only on (seed, i),
+        so a larger library always starts with the images of a smaller one.
+    '''
+    rng = np.random.default_rng([seed, index])
+    h, w = size
+    grid_h, grid_w = rng.integers(2, 17, size=2)
+    low = rng.random((grid_h, grid_w, 3)) * rng.uniform(0.3, 1.0) + rng.uniform(0, 0.4, size=3)
+    im = Image.fromarray(np.clip(low * 255, 0, 255).astype(np.uint8)).resize((w, h), resample=Image.Resampling.BICUBIC)
+    grain = rng.normal(0, rng.uniform(0, 12), size=(h, w, 3))
+    return np.clip(np.asarray(im) + grain, 0, 255).astype(np.uint8)
+
+def library_path(folder: pathlib.Path, index: int, ext: str = 'jpg') -> pathlib.Path:
+    '''Images are spread over subfolders of 1000, like a photo export.'''
+    return pathlib.Path(folder) / f'{index // 1000:04d}' / f'img_{index:07d}.{ext}'
+
+def write_library_image(index: int, folder: pathlib.Path, size: typing.Tuple[int, int], seed: int, ext: str, sidecars: bool) -> pathlib.Path:
+    path = library_path(folder, index, ext)
+    if not path.exists():
+        path.parent.mkdir(exist_ok=True, parents=True)
+        Image.fromarray(texture_image(index, size, seed)).save(path, quality=90)
+    if sidecars and not path.with_suffix(path.suffix + '.json').exists():
+        path.with_suffix(path.suffix + '.json').write_text(json.dumps(PHOTO_SIDECAR))
+    return path
+
+def generate_library(
+    folder: pathlib.Path,
+    n: int,
+    size: typing.Tuple[int, int] = (480, 640),
+    seed: int = 0,
+    ext: str = 'jpg',
+    sidecars: bool = True,
+    processes: int = os.cpu_count(),
+) -> typing.List[pathlib.Path]:
+    '''Write n synthetic images (and Takeout-style sidecars) under folder, skipping files that exist.
+        Returns the image paths in index order.
+    '''
+    write_func = functools.partial(write_library_image, folder=pathlib.Path(folder), size=size, seed=seed, ext=ext, sidecars=sidecars)
+    if processes == 1:
+        return list(map(write_func, range(n)))
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(write_func, range(n), chunksize=64)
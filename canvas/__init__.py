@@ -2,4 +2,9 @@ from .canvas import *
 from .imagemanager import *
 from .image import *
 from .distancedb import *
+from .thumbstore import *
+from .thumbcache import *
+from .metadataindex import *
+from .discovery import *
+from .gaconfig import *
 #from .imagefilemanager import ImageFileManager, SourceImage
\ No newline at end of file
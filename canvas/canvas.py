@@ -7,7 +7,8 @@ import skimage
 import numpy as np
 import random
 
-from .util import imread_transform, imread_transform_resize, write_as_uint
+from photomosaic.writer import write_tile_rows
+from .util import imread_transform, imread_transform_resize, write_as_uint, calc_gradient
 
 @dataclasses.dataclass(frozen=True)
 class CanvasBase:
@@ -29,7 +30,14 @@ class CanvasBase:
         return Image.fromarray(self.im)
     
     def transform_sobel(self) -> np.ndarray:
-        return skimage.filters.sobel(self.im)
+        return self.gradient('volume')
+    
+    def gradient(self, mode: str = 'volume') -> np.ndarray:
+        '''Gradient feature plane, computed once per mode and cached on the canvas.'''
+        cache = self.__dict__.setdefault('_gradients', dict())
+        if mode not in cache:
+            cache[mode] = calc_gradient(self.im, mode)
+        return cache[mode]
     
     def new_subcanvasscore(self, dist: float) -> SubCanvasScore:
         return SubCanvasScore(
@@ -40,14 +48,15 @@ class CanvasBase:
 @dataclasses.dataclass
 class Distances:
     canvas: CanvasBase
-    def composit(self, other: CanvasBase) -> float:
-        return self.euclid(other) + self.sobel(other)
+
+    def composit(self, other: CanvasBase, gradient_mode: str = 'volume') -> float:
+        return self.euclid(other) + self.sobel(other, gradient_mode)
 
     def euclid(self, other: CanvasBase) -> float:
         return np.linalg.norm(self.canvas.im - other.im)
             
-    def sobel(self, other: CanvasBase) -> float:
-        return np.linalg.norm(self.canvas.transform_sobel() - other.transform_sobel())
+    def sobel(self, other: CanvasBase, gradient_mode: str = 'volume') -> float:
+        return np.linalg.norm(self.canvas.gradient(gradient_mode) - other.gradient(gradient_mode))
 
 @dataclasses.dataclass(frozen=True)
 class Canvas(CanvasBase):
@@ -87,6 +96,17 @@ class Canvas(CanvasBase):
             im=im,
         )
     
+    @staticmethod
+    def write_subcanvases(scanvases: typing.Sequence[CanvasBase], width: int, fpath: pathlib.Path) -> None:
+        '''Like from_subcanvases, but stream the result to a striped tiff one row at a time.'''
+        ch,cw = scanvases[0].size
+        def rows():
+            for grid_y in range(len(scanvases) // width):
+                row = np.zeros((ch,width*cw,3), dtype=np.uint8)
+                for grid_x, sc in enumerate(scanvases[grid_y*width:(grid_y+1)*width]):
+                    row[:, grid_x*cw:(grid_x+1)*cw, :] = skimage.img_as_ubyte(sc.im)
+                yield row
+        write_tile_rows(fpath, rows(), shape=((len(scanvases) // width) * ch, width * cw), row_height=ch)
     
 @dataclasses.dataclass(frozen=True)
 class SubCanvas(CanvasBase):
@@ -0,0 +1,50 @@
+from __future__ import annotations
+import pathlib
+import dataclasses
+import typing
+import os
+import collections
+import concurrent.futures
+
+@dataclasses.dataclass(frozen=True)
+class FoundImage:
+    '''An image file found by scan_images and whether its Takeout sidecar (<name>.json) exists.'''
+    path: pathlib.Path
+    has_json: bool
+
+    @property
+    def json_path(self) -> pathlib.Path:
+        return self.path.with_suffix(self.path.suffix + '.json')
+
+def scan_images(
+    root: pathlib.Path,
+    extensions: typing.Iterable[str] = ('png', 'jpg', 'jpeg'),
+    threads: int = 16,
+) -> typing.Iterator[FoundImage]:
+    '''Find image files under root in a single walk, yielding them as directories are listed.
+        Extensions match case-insensitively, and sidecar presence is read from the same
+        directory listing, so no file is stat-ed. Directories are listed in a thread pool
+        but results come out in a fixed order (breadth-first, names sorted).
+    '''
+    exts = {e.lower().lstrip('.') for e in extensions}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque([executor.submit(list_dir, str(root))])
+        while len(pending):
+            files, subdirs = pending.popleft().result()
+            pending.extend(executor.submit(list_dir, d) for d in subdirs)
+            names = set(files)
+            for name in files:
+                if name.rpartition('.')[2].lower() in exts:
+                    yield FoundImage(path=pathlib.Path(name), has_json=name + '.json' in names)
+
+def list_dir(path: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    '''(file paths, subdirectory paths) of one directory, each sorted; unreadable directories are empty.'''
+    files, subdirs = list(), list()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # d_type from the listing answers is_dir without a stat on most filesystems
+                (subdirs if entry.is_dir(follow_symlinks=False) else files).append(entry.path)
+    except OSError:
+        pass
+    return sorted(files), sorted(subdirs)
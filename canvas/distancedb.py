@@ -5,23 +5,211 @@ import doctable
 import dataclasses
 import pathlib
 import sqlalchemy
+import numpy as np
+import uuid
+
+from imagecore import instrument
+from photomosaic.topk import select_topk
 
 @dataclasses.dataclass
 class DistanceDB:
     core: doctable.ConnectCore
     tab: doctable.DBTable
+    targets: doctable.DBTable
+    thumbs: doctable.DBTable
+    shards: doctable.DBTable
+    top: doctable.DBTable
+    shard_folder: pathlib.Path
+    top_k: int = 10
+    top_cache: typing.Dict[int, typing.Tuple[np.ndarray, np.ndarray]] = dataclasses.field(default_factory=dict, repr=False)
+    max_sql_vars: typing.ClassVar[int] = 500 # paths per IN (...) clause
     
     @classmethod
-    def open(cls, dbpath: pathlib.Path) -> DistanceDB:
+    def open(cls, dbpath: pathlib.Path, top_k: int = 10) -> DistanceDB:
+        dbpath = pathlib.Path(dbpath)
         core = doctable.ConnectCore.open(dbpath, dialect='sqlite')
         with core.begin_ddl() as ddl:
             tab = ddl.create_table_if_not_exists(Distance)
-        return cls(core=core, tab=tab)
+            targets = ddl.create_table_if_not_exists(Target)
+            thumbs = ddl.create_table_if_not_exists(Thumb)
+            shards = ddl.create_table_if_not_exists(DistanceShard)
+            top = ddl.create_table_if_not_exists(TopDistance)
+        shard_folder = dbpath.parent / f'{dbpath.stem}_shards'
+        shard_folder.mkdir(exist_ok=True, parents=True)
+        return cls(core=core, tab=tab, targets=targets, thumbs=thumbs, shards=shards, top=top, shard_folder=shard_folder, top_k=top_k)
     
     @property
     def q(self):
         return Query(db=self)
 
+    ############# Columnar storage #############
+    def insert_matrix(self, target_path: pathlib.Path, thumb_paths: typing.List[pathlib.Path], distances: np.ndarray) -> int:
+        '''Store a (thumbs x positions) distance block as one float32 shard file, indexed in SQLite.
+            Targets and thumbs are interned as integer ids, so no path is repeated per distance.
+            Returns the target id.
+        '''
+        with instrument.stage('db.insert_matrix', nbytes=distances.shape[0]*distances.shape[1]*4):
+            target_id = self.intern_target(target_path)
+            thumb_ids = self.intern_thumbs(thumb_paths)
+            shard_path = self.shard_folder / f'{target_id}_{uuid.uuid4().hex}.npz'
+            np.savez(shard_path, thumb_ids=thumb_ids, distances=distances.astype(np.float32, copy=False))
+            with self.shards.query() as q:
+                q.insert_single(DistanceShard(
+                    target_id=target_id, 
+                    path=shard_path.name, 
+                    num_thumbs=distances.shape[0], 
+                    num_positions=distances.shape[1],
+                ))
+            with instrument.stage('db.update_top_distances'):
+                self.update_top_distances(target_id, thumb_ids, distances)
+            return target_id
+
+    def update_top_distances(self, target_id: int, thumb_ids: np.ndarray, distances: np.ndarray) -> None:
+        '''Merge a new distance block into the target's stored top-k per position.
+            The top-k arrays are read from SQLite once per target and then kept in top_cache,
+            and only the (position, rank) entries whose thumb or distance changed are written.
+            Once the lists settle, most blocks change few entries. A thumb stored again replaces
+            its old distances; if that makes one of its top-k entries worse, a thumb pushed out
+            of the lists earlier may belong back, so the target's top-k is re-selected from its
+            shards (which already hold this block).
+        '''
+        num_positions = distances.shape[1]
+        if target_id not in self.top_cache or self.top_cache[target_id][0].shape[0] < num_positions:
+            self.top_cache[target_id] = self.select_top_arrays(target_id, num_positions=num_positions)
+        old_ids, old_dists = self.top_cache[target_id]
+        block_dists = distances.T.astype(np.float32)
+        
+        stored_again = np.isin(old_ids, thumb_ids)
+        if stored_again.any() and self.got_worse(old_ids, old_dists, stored_again, thumb_ids, block_dists):
+            top_dists, top_ids = self.select_top_from_shards(target_id, num_positions)
+        else:
+            top_dists, top_ids = select_topk(
+                np.concatenate([np.where(stored_again, np.inf, old_dists), block_dists], axis=1),
+                np.concatenate([old_ids, np.broadcast_to(thumb_ids, (old_ids.shape[0], thumb_ids.shape[0]))], axis=1),
+                self.top_k,
+            )
+        filled = np.isfinite(top_dists)
+        top_ids, top_dists = np.where(filled, top_ids, -1), np.where(filled, top_dists, np.float32(np.inf))
+        
+        changed = (top_ids != old_ids) | (top_dists != old_dists)
+        rows = [
+            TopDistance(
+                target_id=target_id,
+                position=position,
+                rank=rank,
+                thumb_id=int(top_ids[position, rank]),
+                distance=float(top_dists[position, rank]),
+            )
+            for position, rank in np.argwhere(changed & filled).tolist()
+        ]
+        with self.top.query() as q:
+            for position, rank in np.argwhere(changed & ~filled).tolist():
+                q.delete(where=(self.top['target_id']==target_id) & (self.top['position']==position) & (self.top['rank']==rank))
+            if len(rows):
+                q.insert_multi(rows, ifnotunique='REPLACE')
+        self.top_cache[target_id] = (top_ids, top_dists)
+
+    @staticmethod
+    def got_worse(old_ids: np.ndarray, old_dists: np.ndarray, stored_again: np.ndarray, thumb_ids: np.ndarray, block_dists: np.ndarray) -> bool:
+        '''Whether any top-k entry of a thumb stored again has a larger distance in the new (P x n) block.'''
+        positions, ranks = np.nonzero(stored_again)
+        column = {t: i for i, t in enumerate(thumb_ids.tolist())}
+        new = block_dists[positions, [column[t] for t in old_ids[positions, ranks].tolist()]]
+        return bool((new > old_dists[positions, ranks]).any())
+
+    def select_top_from_shards(self, target_id: int, num_positions: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+        '''Exact top-k (distances, thumb ids) per position from every stored shard, padded with inf / -1.'''
+        thumb_ids, matrix = self.select_matrix(target_id)
+        top_dists = np.full((num_positions, self.top_k), np.inf, dtype=np.float32)
+        top_ids = np.full((num_positions, self.top_k), -1, dtype=np.int64)
+        k = min(self.top_k, thumb_ids.shape[0])
+        top_dists[:, :k], top_ids[:, :k] = select_topk(matrix.T, np.broadcast_to(thumb_ids, (num_positions, thumb_ids.shape[0])), k)
+        return top_dists, top_ids
+
+    def load_top_distances(self, target_path: pathlib.Path) -> typing.Tuple[np.ndarray, np.ndarray]:
+        '''Top-k (thumb ids, distances) per position as (P, k) arrays, padded with -1 / inf.
+            An unknown target has no positions.
+        '''
+        target_id = self.lookup_target(target_path)
+        if target_id is None:
+            return np.empty((0, self.top_k), dtype=np.int64), np.empty((0, self.top_k), dtype=np.float32)
+        return self.select_top_arrays(target_id)
+
+    def select_top_arrays(self, target_id: int, num_positions: int = 0) -> typing.Tuple[np.ndarray, np.ndarray]:
+        with self.top.query() as q:
+            rows = q.select(where=self.top['target_id']==target_id)
+        num_positions = max([num_positions] + [r.position + 1 for r in rows])
+        top_ids = np.full((num_positions, self.top_k), -1, dtype=np.int64)
+        top_dists = np.full((num_positions, self.top_k), np.inf, dtype=np.float32)
+        for r in rows:
+            if r.rank < self.top_k:
+                top_ids[r.position, r.rank] = r.thumb_id
+                top_dists[r.position, r.rank] = r.distance
+        return top_ids, top_dists
+
+    def load_matrix(self, target_path: pathlib.Path) -> typing.Tuple[np.ndarray, np.ndarray]:
+        '''Load every stored distance for a target as (thumb ids, (N thumbs x P positions) float32 matrix).
+            If a thumb was stored more than once, its most recent block wins. An unknown target
+            has no distances.
+        '''
+        target_id = self.lookup_target(target_path)
+        if target_id is None:
+            return np.empty(0, dtype=np.int64), np.empty((0,0), dtype=np.float32)
+        return self.select_matrix(target_id)
+
+    def select_matrix(self, target_id: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+        with self.shards.query() as q:
+            shards = q.select(where=self.shards['target_id']==target_id, order_by=[self.shards['id']])
+        if not len(shards):
+            return np.empty(0, dtype=np.int64), np.empty((0,0), dtype=np.float32)
+        
+        thumb_ids, blocks = list(), list()
+        for shard in shards:
+            with np.load(self.shard_folder / shard.path) as data:
+                thumb_ids.append(data['thumb_ids'])
+                blocks.append(data['distances'])
+        thumb_ids, matrix = np.concatenate(thumb_ids), np.concatenate(blocks)
+        
+        # keep the last occurrence of each thumb id
+        last = thumb_ids.shape[0] - 1 - np.unique(thumb_ids[::-1], return_index=True)[1]
+        last = np.sort(last)
+        return thumb_ids[last], matrix[last]
+
+    def thumb_paths(self, thumb_ids: np.ndarray) -> typing.List[str]:
+        '''Paths for an array of thumb ids, in the same order.'''
+        lookup = dict()
+        id_list = np.unique(thumb_ids).tolist()
+        for i in range(0, len(id_list), self.max_sql_vars):
+            with self.thumbs.query() as q:
+                for t in q.select(where=self.thumbs['id'].in_(id_list[i:i+self.max_sql_vars])):
+                    lookup[t.id] = t.path
+        return [lookup[i] for i in thumb_ids.tolist()]
+
+    def intern_target(self, target_path: pathlib.Path) -> int:
+        '''Integer id for a target path, adding it if it is new.'''
+        return int(self.intern(self.targets, Target, [str(target_path)])[0])
+
+    def lookup_target(self, target_path: pathlib.Path) -> typing.Optional[int]:
+        '''Integer id for a stored target path, or None if it was never inserted. Never writes.'''
+        with self.targets.query() as q:
+            rows = q.select(where=self.targets['path']==str(target_path))
+        return rows[0].id if len(rows) else None
+
+    def intern_thumbs(self, thumb_paths: typing.List[pathlib.Path]) -> np.ndarray:
+        '''Integer ids for thumb paths, adding any that are new.'''
+        return self.intern(self.thumbs, Thumb, [str(p) for p in thumb_paths])
+
+    def intern(self, tab: doctable.DBTable, container: typing.Type, paths: typing.List[str]) -> np.ndarray:
+        ids = dict()
+        unique_paths = list(dict.fromkeys(paths))
+        for i in range(0, len(unique_paths), self.max_sql_vars):
+            chunk = unique_paths[i:i+self.max_sql_vars]
+            with tab.query() as q:
+                q.insert_multi([container(path=p) for p in chunk], ifnotunique='IGNORE')
+                for row in q.select(where=tab['path'].in_(chunk)):
+                    ids[row.path] = row.id
+        return np.array([ids[p] for p in paths], dtype=np.int64)
+
 @dataclasses.dataclass
 class Query:
     db: DistanceDB
@@ -74,3 +262,76 @@ class Distance:
     )
 
 
+
+@doctable.table_schema(
+    indices = {
+        'target_path': doctable.Index('path', unique=True),
+    },
+)
+class Target:
+    path: str
+    
+    id: int = doctable.Column(
+        column_args=doctable.ColumnArgs(
+            order=0,
+            primary_key=True,
+            autoincrement=True,
+        )
+    )
+
+@doctable.table_schema(
+    indices = {
+        'thumb_path': doctable.Index('path', unique=True),
+    },
+)
+class Thumb:
+    path: str
+    
+    id: int = doctable.Column(
+        column_args=doctable.ColumnArgs(
+            order=0,
+            primary_key=True,
+            autoincrement=True,
+        )
+    )
+
+@doctable.table_schema(
+    indices = {
+        'shard_target': doctable.Index('target_id'),
+    },
+)
+class DistanceShard:
+    '''One float32 (num_thumbs x num_positions) block of distances stored in an .npz file.'''
+    target_id: int
+    path: str
+    num_thumbs: int
+    num_positions: int
+    
+    id: int = doctable.Column(
+        column_args=doctable.ColumnArgs(
+            order=0,
+            primary_key=True,
+            autoincrement=True,
+        )
+    )
+
+@doctable.table_schema(
+    indices = {
+        'top_target_position_rank': doctable.Index('target_id', 'position', 'rank', unique=True),
+    },
+)
+class TopDistance:
+    '''Rank-th best thumb for one target position, maintained as distance blocks are inserted.'''
+    target_id: int
+    position: int
+    rank: int
+    thumb_id: int
+    distance: float
+    
+    id: int = doctable.Column(
+        column_args=doctable.ColumnArgs(
+            order=0,
+            primary_key=True,
+            autoincrement=True,
+        )
+    )
@@ -1,71 +1,170 @@
 from __future__ import annotations
 import typing
 import dataclasses
-import random
-import itertools
-#import numpy as np
+import functools
+import multiprocessing
+import time
+import os
 import math
+import numpy as np
+import scipy.optimize
 
-class Genome:
-    pass
+from photomosaic.topk import select_topk
+from photomosaic.assignment import greedy_match
+
+Genome = np.ndarray # (P,) int64 candidate id for each grid position, no id repeated
+Population = np.ndarray # (N, P) genomes, one per row
+
+@dataclasses.dataclass
+class AssignmentProblem:
+    '''Assign a distinct candidate to every position, minimizing the summed distance.
+        dists is a dense (candidates x positions) matrix, e.g. DistanceMatrixEngine.calc
+        output or DistanceDB.load_matrix; shortlist holds each position's nearest candidates.
+    '''
+    dists: np.ndarray
+    shortlist: np.ndarray
+
+    @classmethod
+    def from_distances(cls, dists: np.ndarray, k: int = 10) -> AssignmentProblem:
+        if dists.shape[0] < dists.shape[1]:
+            raise ValueError(f'Need at least as many candidates as positions, got {dists.shape[0]} for {dists.shape[1]}.')
+        ids = np.broadcast_to(np.arange(dists.shape[0], dtype=np.int64), (dists.shape[1], dists.shape[0]))
+        _, shortlist = select_topk(dists.T, ids, min(k, dists.shape[0]))
+        return cls(dists=dists, shortlist=shortlist)
+
+    @property
+    def num_candidates(self) -> int:
+        return self.dists.shape[0]
+
+    @property
+    def num_positions(self) -> int:
+        return self.dists.shape[1]
+
+    def cost(self, population: Population) -> np.ndarray:
+        '''Total distance of every genome, gathered for the whole population at once.'''
+        return self.dists[population, np.arange(self.num_positions)].sum(axis=1, dtype=np.float64)
+
+    def greedy_genome(self, noise: float = 0.0, rng: np.random.Generator | None = None) -> Genome:
+        '''Greedy matching over the shortlists, with any position left empty filled by complete.
+            With noise, shortlist distances are scaled by 1 + noise * N(0, 1) first, which gives
+            different greedy genomes of similar quality.
+        '''
+        dists = np.take_along_axis(self.dists.T, self.shortlist, axis=1)
+        if noise > 0:
+            dists = dists * (1 + noise * rng.standard_normal(dists.shape))
+        genome, _ = greedy_match(self.shortlist, dists)
+        return self.complete(genome)
+
+    def complete(self, genome: Genome) -> Genome:
+        '''Fill empty (-1) positions, e.g. from GridScores.to_arrays, with their nearest unused candidates.'''
+        genome = np.array(genome, dtype=np.int64)
+        used = np.zeros(self.num_candidates, dtype=bool)
+        used[genome[genome >= 0]] = True
+        for pos in np.nonzero(genome < 0)[0].tolist():
+            genome[pos] = np.argmin(np.where(used, np.inf, self.dists[:, pos]))
+            used[genome[pos]] = True
+        return genome
+
+@dataclasses.dataclass
+class IterationStats:
+    generation: int
+    best_cost: float
+    mean_cost: float
+
+@dataclasses.dataclass
+class GAResult:
+    genome: Genome
+    cost: float
+    history: typing.List[IterationStats]
 
 @dataclasses.dataclass
 class GAConfig:
-    fitness: typing.Callable[[Genome], float]
-    population_size: int
-    parent_percentile: int # percentile of pop to use as parents
-
-    crossover_func: typing.Callable[[Genome, Genome, float], Genome]
-    crossover_rate: float
-    #crossover_prob: float
-
-    mutate_func: typing.Callable[[Genome, float], Genome]
-    mutation_rate: float
-    #mutation_prob: float
-    
-    
-    
-    def iterate_population(self, population: typing.List[Genome]) -> typing.List[Genome]:
-        '''Perform one iteration of the population, returning a new population.'''
-        parent_fitness = self.get_parents(population)
-        
-        
-        children = self.make_children(parents)
-        new_pop = parents + children
-    
-    #def get_parents_randomized(self, population: typing.List[Genome]) -> typing.List[Genome]:
-    #    parents = self.get_parents(population)
-    #    random.shuffle(parents)
-    #    return parents
-    
-        
-    def get_parents(self, population: typing.List[Genome]) -> typing.List[Genome]:
-        fitnesses = ((self.fitness(g), g) for g in population)
-        return list(sorted(fitnesses, key=lambda x: x[0], reversed=True))[:self.num_parents]
+    population_size: int = 64
+    parent_percentile: int = 25 # percentile of pop to use as parents
+
+    crossover_rate: float = 0.5 # fraction of a child's genes taken from the second parent
+    mutation_rate: float = 0.003 # expected fraction of a child's positions that are mutated
+    seed_noise: float = 0.1 # relative distance noise for the greedy genomes that seed the population (0: copies of initial)
+    initial_mutation_rate: float = 0.0 # mutation applied to the seeds
+    climb_moves: int = 16 # moves tried per child by the vectorised hill climb (0 disables it)
+    improve_positions: int = 0 # opt-in memetic step: positions re-solved exactly per child (see improve)
+
+    def run(self,
+        problem: AssignmentProblem,
+        generations: int,
+        initial: Genome | None = None,
+        seed: int = 0,
+        time_budget: float | None = None,
+    ) -> GAResult:
+        '''Evolve one population seeded with initial (the greedy genome by default) and greedy
+            genomes of noisy distances. Stops after generations, or once time_budget seconds have passed.
+        '''
+        rng = np.random.default_rng(seed)
+        population = self.initial_population(problem, initial, rng)
+        costs = problem.cost(population)
+        history = list()
+        start = time.monotonic()
+        for generation in range(generations):
+            if time_budget is not None and time.monotonic() - start >= time_budget:
+                break
+            population, costs = self.iterate_population(problem, population, costs, rng)
+            history.append(IterationStats(generation, float(costs.min()), float(costs.mean())))
+        best = np.argmin(costs)
+        return GAResult(genome=population[best], cost=float(costs[best]), history=history)
+
+    def initial_population(self, problem: AssignmentProblem, initial: Genome | None, rng: np.random.Generator) -> Population:
+        initial = problem.greedy_genome() if initial is None else problem.complete(initial)
+        population = np.tile(initial, (self.population_size, 1))
+        if self.seed_noise > 0:
+            for row in population[1:]:
+                row[:] = problem.greedy_genome(self.seed_noise, rng)
+        mutate(population[1:], problem.shortlist, self.initial_mutation_rate, rng)
+        return population
+
+    def iterate_population(self,
+        problem: AssignmentProblem,
+        population: Population,
+        costs: np.ndarray,
+        rng: np.random.Generator,
+    ) -> typing.Tuple[Population, np.ndarray]:
+        '''Perform one iteration of the population, returning the new population and its costs.
+            Parents survive unchanged, so the best cost never increases.
+        '''
+        parents = self.get_parents(population, costs)
+        children = self.make_children(problem, population[parents], rng)
+        return np.concatenate([population[parents], children]), np.concatenate([costs[parents], problem.cost(children)])
+
+    def get_parents(self, population: Population, costs: np.ndarray) -> np.ndarray:
+        '''Indices of the num_parents lowest-cost distinct genomes, topped up with repeats if
+            there are too few. Without this, copies of one genome crowd out every other parent.
+        '''
+        order = np.argsort(costs, kind='stable')
+        _, first = np.unique(population[order], axis=0, return_index=True)
+        distinct = order[np.sort(first)]
+        return np.concatenate([distinct, order[~np.isin(order, distinct)]])[:self.num_parents]
 
     @property
     def num_children(self) -> int:
         return self.population_size - self.num_parents
-    
+
     @property
     def num_parents(self) -> int:
-        return math.ceil(self.parent_percentile * self.population_size / 100)
+        return max(2, math.ceil(self.parent_percentile * self.population_size / 100))
 
     ################## Population Transforms ##################
-    def make_children(self, population: typing.List[Genome]) -> typing.List[Genome]:
-        children = list()
-        for g1, g2 in self.random_pairs(population, self.num_children):
-            children.append(self.crossover(g1, g2))
+    def make_children(self, problem: AssignmentProblem, parents: Population, rng: np.random.Generator) -> Population:
+        first, second = self.random_pairs(parents.shape[0], self.num_children, rng)
+        children = crossover(parents[first], parents[second], self.crossover_rate, rng)
+        mutate(children, problem.shortlist, self.mutation_rate, rng)
+        climb(children, problem, self.climb_moves, rng)
+        improve(children, problem, self.improve_positions, rng)
         return children
-    
-    def crossover(self, g1: typing.List[Genome], g2: typing.List[Genome]) -> typing.List[Genome]:
-        new_genome = self.crossover_func(g1, g2, self.crossover_rate)
-        return self.mutate_func(new_genome, self.mutation_rate)
 
-    def random_pairs(self, population: typing.List[Genome], n: int) -> typing.List[typing.Tuple[Genome, Genome]]:
-        '''Return random pairs of genomes from the population.'''
-        pairs = list(itertools.combinations(population, 2))
-        return random.sample(pairs, n)
+    @staticmethod
+    def random_pairs(num_parents: int, n: int, rng: np.random.Generator) -> typing.Tuple[np.ndarray, np.ndarray]:
+        '''Index arrays of n random pairs of distinct parents.'''
+        first = rng.integers(num_parents, size=n)
+        return first, (first + rng.integers(1, num_parents, size=n)) % num_parents
 
     ################## Setting Parameters ##################
     def set_probabilities(self, crossover_rate: float = None, mutation_rate: float = None) -> GAConfig:
@@ -75,22 +174,186 @@ class GAConfig:
             clone_params['crossover_rate'] = crossover_rate
         if mutation_rate is not None:
             clone_params['mutation_rate'] = mutation_rate
-            
+
         return self.clone(**clone_params)
-    
+
     def clone(self, **new_params) -> GAConfig:
         '''Set new parameter values.'''
         return self.__class__(**{**dataclasses.asdict(self), **new_params})
 
+################## Genome Operators ##################
+def crossover(first: Population, second: Population, rate: float, rng: np.random.Generator) -> Population:
+    '''Uniform crossover of parent rows: each gene comes from second with probability rate.
+        Ids the child would repeat are replaced with parent ids it does not use yet (first's
+        before second's), so every child is still a valid assignment.
+    '''
+    take = rng.random(first.shape) < rate
+    children = np.where(take, second, first)
+    repeated = ~first_occurrence(children, priority=take) # first's genes win ties
+
+    # donors are parent ids in order of preference, each once per row, that the child lacks
+    donors = np.concatenate([first, second], axis=1)
+    valid = first_occurrence(donors) & ~row_isin(donors, children, ~repeated)
+
+    # the r-th repeated position of a row gets the row's r-th valid donor; a row always has
+    # enough, since the parents hold at least P distinct ids and the child uses P - repeats
+    rank = np.cumsum(valid, axis=1) - 1
+    children[repeated] = donors[valid & (rank < repeated.sum(axis=1, keepdims=True))]
+    return children
+
+def mutate(population: Population, shortlist: np.ndarray, rate: float, rng: np.random.Generator) -> None:
+    '''Mutate rows in place, about rate * P moves each, applied in rounds of one move per row.
+        A move draws a position and a candidate from its shortlist: the candidate is moved in,
+        swapping places with it if the row already uses it elsewhere, so ids stay unique.
+    '''
+    n, num_positions = population.shape
+    moves = rng.binomial(num_positions, rate, size=n)
+    for r in range(moves.max(initial=0)):
+        rows = np.nonzero(moves > r)[0]
+        pos = rng.integers(num_positions, size=rows.shape[0])
+        new = shortlist[pos, rng.integers(shortlist.shape[1], size=rows.shape[0])]
+        matches = population[rows] == new[:, np.newaxis]
+        found = matches.any(axis=1)
+        other = np.argmax(matches, axis=1)
+        swap_rows, swap_pos, swap_other = rows[found], pos[found], other[found]
+        population[swap_rows, swap_other] = population[swap_rows, swap_pos]
+        population[rows, pos] = new
+
+def climb(population: Population, problem: AssignmentProblem, moves: int, rng: np.random.Generator) -> None:
+    '''Hill climb every row in place, one random move per row per round, for all rows at once.
+        A move is drawn as in mutate, but only kept when it lowers the row's cost.
+    '''
+    n, num_positions = population.shape
+    rows = np.arange(n)
+    for _ in range(moves):
+        pos = rng.integers(num_positions, size=n)
+        new = problem.shortlist[pos, rng.integers(problem.shortlist.shape[1], size=n)]
+        old = population[rows, pos]
+        matches = population == new[:, np.newaxis]
+        found = matches.any(axis=1)
+        other = np.argmax(matches, axis=1)
+        delta = problem.dists[new, pos] - problem.dists[old, pos]
+        delta += np.where(found, problem.dists[old, other] - problem.dists[new, other], 0)
+        keep = delta < 0
+        swap = keep & found
+        population[rows[swap], other[swap]] = old[swap]
+        population[rows[keep], pos[keep]] = new[keep]
+
+def improve(population: Population, problem: AssignmentProblem, num_positions: int, rng: np.random.Generator) -> None:
+    '''Opt-in memetic step (GAConfig.improve_positions), a Python loop over rows rather than a
+        vectorised operator: the candidates of num_positions random positions of each row are
+        re-assigned optimally (linear_sum_assignment), choosing among the candidates those
+        positions hold and the unused candidates on their shortlists. The current assignment
+        is one of the choices, so no row gets worse.
+    '''
+    num_positions = min(num_positions, problem.num_positions)
+    if num_positions <= 0:
+        return
+    used = np.zeros(problem.num_candidates, dtype=bool)
+    for genome in population:
+        pos = rng.choice(problem.num_positions, size=num_positions, replace=False)
+        used[genome] = True
+        extra = problem.shortlist[pos].ravel()
+        pool = np.concatenate([genome[pos], np.unique(extra[~used[extra]])])
+        used[genome] = False
+        rows, cols = scipy.optimize.linear_sum_assignment(problem.dists[np.ix_(pool, pos)].T)
+        genome[pos[rows]] = pool[cols]
+
+def first_occurrence(values: np.ndarray, priority: np.ndarray | None = None) -> np.ndarray:
+    '''True for the first of each value in each row, ordering repeats by priority (False first), then column.'''
+    columns = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    keys = (columns, values) if priority is None else (columns, priority, values)
+    order = np.lexsort(keys, axis=-1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    first = np.ones(values.shape, dtype=bool)
+    first[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    out = np.empty(values.shape, dtype=bool)
+    np.put_along_axis(out, order, first, axis=1)
+    return out
+
+def row_isin(values: np.ndarray, members: np.ndarray, member_mask: np.ndarray) -> np.ndarray:
+    '''Whether each value is among its own row's masked members, for all rows at once.'''
+    width = max(values.max(initial=0), members.max(initial=0)) + 1
+    row_offsets = width * np.arange(values.shape[0])[:, np.newaxis]
+    return np.isin(values + row_offsets, (members + row_offsets)[member_mask])
+
+################## Island Populations ##################
 @dataclasses.dataclass
-class IterationStats:
-    old_pop_size: int
-    new_pop_size: int
-    num_crossover: int
-    num_mutate: int
-    
-    crossover_prob: float
-    mutation_prob: float
-    crossover_rate: float
-    mutation_rate: float
+class Island:
+    population: Population
+    costs: np.ndarray
+    rng: np.random.Generator
+    history: typing.List[IterationStats] = dataclasses.field(default_factory=list)
+
+island_state = dict() # problem and config, set once per worker process by init_island_worker
+
+def init_island_worker(problem: AssignmentProblem, config: GAConfig) -> None:
+    island_state['problem'] = problem
+    island_state['config'] = config
+
+def evolve_island(island: Island, generations: int) -> Island:
+    '''Run generations on one island in a worker (after init_island_worker).'''
+    problem: AssignmentProblem = island_state['problem']
+    config: GAConfig = island_state['config']
+    population, costs = island.population, island.costs
+    for _ in range(generations):
+        population, costs = config.iterate_population(problem, population, costs, island.rng)
+        island.history.append(IterationStats(len(island.history), float(costs.min()), float(costs.mean())))
+    return dataclasses.replace(island, population=population, costs=costs)
+
+def migrate(islands: typing.List[Island], migrants: int) -> None:
+    '''Ring migration: copies of each island's best genomes replace the next island's worst.'''
+    bests = [(isl.population[np.argsort(isl.costs, kind='stable')[:migrants]], np.sort(isl.costs)[:migrants]) for isl in islands]
+    for i, island in enumerate(islands):
+        genomes, costs = bests[i - 1]
+        worst = np.argsort(island.costs, kind='stable')[island.costs.shape[0] - genomes.shape[0]:]
+        island.population[worst], island.costs[worst] = genomes, costs
+
+def run_islands(
+    config: GAConfig,
+    problem: AssignmentProblem,
+    num_islands: int = os.cpu_count(),
+    epochs: int = 10,
+    generations_per_epoch: int = 20,
+    migrants: int = 2,
+    initial: Genome | None = None,
+    seed: int = 0,
+    time_budget: float | None = None,
+    processes: int = os.cpu_count(),
+) -> GAResult:
+    '''Evolve independent island populations in a process pool, migrating the best genomes
+        around a ring after every epoch. Each island has its own random stream, so the result
+        depends on seed and num_islands but not on the number of processes.
+    '''
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(num_islands)]
+    islands = list()
+    for rng in rngs:
+        population = config.initial_population(problem, initial, rng)
+        islands.append(Island(population=population, costs=problem.cost(population), rng=rng))
+
+    evolve = functools.partial(evolve_island, generations=generations_per_epoch)
+    start = time.monotonic()
+    def run_epochs(map_func: typing.Callable) -> typing.List[Island]:
+        current = islands
+        for _ in range(epochs):
+            if time_budget is not None and time.monotonic() - start >= time_budget:
+                break
+            current = list(map_func(evolve, current))
+            migrate(current, migrants)
+        return current
+
+    if processes == 1:
+        init_island_worker(problem, config)
+        islands = run_epochs(map)
+    else:
+        with multiprocessing.Pool(processes, initializer=init_island_worker, initargs=(problem, config)) as pool:
+            islands = run_epochs(pool.map)
 
+    # generation-by-generation best over all islands
+    history = [
+        IterationStats(g, min(s.best_cost for s in stats), float(np.mean([s.mean_cost for s in stats])))
+        for g, stats in enumerate(zip(*(isl.history for isl in islands)))
+    ]
+    best_island = min(islands, key=lambda isl: isl.costs.min())
+    best = np.argmin(best_island.costs)
+    return GAResult(genome=best_island.population[best], cost=float(best_island.costs[best]), history=history)
@@ -13,11 +13,12 @@ if typing.TYPE_CHECKING:
 @dataclasses.dataclass
 class Distances:
     image: Image
-    def composit(self, other: Image) -> float:
-        return self.euclid(other) + self.sobel(other)
+
+    def composit(self, other: Image, gradient_mode: str = 'volume') -> float:
+        return self.euclid(other) + self.sobel(other, gradient_mode)
 
     def euclid(self, other: Image) -> float:
         return np.linalg.norm(self.image.im - other.im)
             
-    def sobel(self, other: Image) -> float:
-        return np.linalg.norm(self.image.filter_sobel_image() - other.filter_sobel_image())
+    def sobel(self, other: Image, gradient_mode: str = 'volume') -> float:
+        return np.linalg.norm(self.image.gradient(gradient_mode) - other.gradient(gradient_mode))
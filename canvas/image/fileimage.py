@@ -5,7 +5,9 @@ import skimage # type: ignore
 import numpy as np
 import pathlib
 
-from .image import Image
+from photomosaic.decode import read_thumbnail
+
+from .image import Image, Height, Width
 
 @dataclasses.dataclass(frozen=True)
 class FileImage(Image):
@@ -17,3 +19,11 @@ class FileImage(Image):
             path=pathlib.Path(path),
             im=skimage.io.imread(str(path))
         )
+
+    @classmethod
+    def read_thumbnail(cls, path: pathlib.Path, shape: typing.Tuple[Height, Width]) -> FileImage:
+        '''Read directly at thumbnail size as uint8 rgb, using draft-mode decoding for JPEGs.'''
+        return cls(
+            path=pathlib.Path(path),
+            im=read_thumbnail(path, shape),
+        )
@@ -7,6 +7,7 @@ import pathlib
 
 #from .imagegrid import ImageGrid
 from .distances import Distances
+from ..util import calc_gradient
 
 class Height(int):
     pass
@@ -68,8 +69,16 @@ class Image:
     def filter_sobel(self) -> Image:
         return self.copy(im=skimage.filters.sobel(self.im))
     
-    def filter_sobel_image(self) -> Image:
-        return skimage.filters.sobel(self.im)
+    def filter_sobel_image(self) -> np.ndarray:
+        return self.gradient('volume')
+    
+    def gradient(self, mode: str = 'volume') -> np.ndarray:
+        '''Gradient feature plane, computed once per mode and cached on the image.'''
+        # stored outside the dataclass fields so that copy() never carries a stale cache
+        cache = self.__dict__.setdefault('_gradients', dict())
+        if mode not in cache:
+            cache[mode] = calc_gradient(self.im, mode)
+        return cache[mode]
     
     def resize(self, resize_shape: typing.Tuple[Height, Width], **kwargs) -> Image:
         return self.copy(im=skimage.transform.resize(self.im, resize_shape, **kwargs))
@@ -94,3 +103,4 @@ class Image:
 
 
 
+
@@ -5,6 +5,8 @@ import skimage
 import numpy as np
 import pathlib
 
+from photomosaic.writer import write_tile_rows
+
 #if typing.TYPE_CHECKING:
 from .image import Image, Height, Width
 from .subimage import SubImage
@@ -118,6 +120,10 @@ class ImageGrid:
             images.append((i, si))
         return images
 
+    def tile_array(self) -> np.ndarray:
+        '''Stack all subimages into one contiguous (P, h, w, c) array.'''
+        return np.ascontiguousarray(np.stack([si.im for si in self.subimages]))
+
     ################## Saving ##################
     def to_image(self) -> Image:
         '''Reconstruct a canvas from a list of subcanvases.'''
@@ -127,6 +133,18 @@ class ImageGrid:
             im[si.window.y:si.window.y+si.window.h, si.window.x:si.window.x+si.window.w, :] = si.im
         return Image(im=im)
 
+    def write_image(self, fpath: pathlib.Path) -> None:
+        '''Stream the reconstructed image to a striped tiff, one row of subimages in memory at a time.'''
+        sub_h, _ = self.sub_size
+        full_h, full_w = self.full_size
+        def rows():
+            for iy in range(full_h // sub_h):
+                row = np.zeros((sub_h, full_w, 3), dtype=np.uint8)
+                for si in self.subimages[iy*self.x_divisions:(iy+1)*self.x_divisions]:
+                    row[si.window.y-iy*sub_h:si.window.y-iy*sub_h+si.window.h, si.window.x:si.window.x+si.window.w, :] = skimage.img_as_ubyte(si.im)
+                yield row
+        write_tile_rows(fpath, rows(), shape=(full_h, full_w), row_height=sub_h)
+
 if __name__ == '__main__':
     ig = ImageGrid([])
     print(ig[0,0])
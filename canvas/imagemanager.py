@@ -11,36 +11,51 @@ import tqdm
 import multiprocessing
 import os
 
+from imagecore import instrument
+
 #from .imagefilemanager import SourceImage, ImageFileManager
 #from .canvas import Canvas, SubCanvas
 #from .util import imread_transform, imread_transform_resize, write_as_uint
 from .sourceimage import SourceImage
+from .thumbstore import ThumbStore
+from .thumbcache import ThumbCache
+from .metadataindex import MetadataIndex
+from .discovery import scan_images
 from .image import FileImage
 from .image import Height, Width
+from .util import as_image_dtype
 
 @dataclasses.dataclass
 class ImageManager:
     source_images: typing.List[SourceImage]
     thumb_folder: pathlib.Path
     scale_res: typing.Tuple[Height, Width]
+    thumb_store: typing.Optional[ThumbStore] = None
+    thumb_cache: typing.Optional[ThumbCache] = None
 
     @classmethod
     def from_rglob(cls, 
         source_folder: pathlib.Path, 
         thumb_folder: pathlib.Path, 
         scale_res: typing.Tuple[int,int],
-        extensions=('png','PNG', 'jpg', 'JPG'),
+        extensions=('png', 'jpg'),
+        use_thumb_store: bool = False,
+        use_thumb_cache: bool = False,
+        scan_threads: int = 16,
     ) -> ImageManager:
-        source_images = list()
-        for ext in extensions:
-            source_images += source_folder.rglob(f"*.{ext}")
-        
-        source_images = [SourceImage.from_fpaths(fpath, thumb_folder, scale_res) for fpath in source_images]
-        return cls(
+        '''Find source images with one parallel walk of source_folder (extensions are case-insensitive).'''
+        source_images = [
+            SourceImage.from_fpaths(found.path, thumb_folder, scale_res, json_exists=found.has_json, check_exists=False)
+            for found in scan_images(source_folder, extensions=extensions, threads=scan_threads)
+        ]
+        manager = cls(
             source_images=source_images,
             thumb_folder=thumb_folder,
             scale_res=scale_res,
+            thumb_store=ThumbStore.open(thumb_folder, scale_res) if use_thumb_store else None,
+            thumb_cache=ThumbCache.open(thumb_folder, scale_res) if use_thumb_cache else None,
         )
+        return manager.apply_thumb_cache() if use_thumb_cache else manager
     
     ########## Dunder ##########
     def __len__(self) -> int:
@@ -53,22 +68,106 @@ class ImageManager:
         processes: int = os.cpu_count(), 
         limit: int = None
     ) -> typing.Generator[FileImage]:
-        '''Create, save, and return photos in multiple threads and return as generator.'''
+        '''Create, save, and return photos in multiple threads and return as generator.
+            With a thumb_store, thumbs are only read from it (see read_store_thumbs).
+        '''
+        if self.thumb_store is not None:
+            yield from self.read_store_thumbs(use_tqdm=use_tqdm, limit=limit)
+            return
         batches = self.batch_source_images(batch_size=batch_size)
         with multiprocessing.Pool(processes=processes) as pool:
             for thumb in self.map_unwrap_thumbs(pool.imap_unordered, batches, use_tqdm, limit):
                 yield thumb
+        self.update_thumb_cache()
                 
     def read_thumbs(self, 
         batch_size: int = 1, 
         use_tqdm: bool = False, 
         limit: int = None
     ) -> typing.Generator[FileImage]:
-        '''Create, save, and return photos in multiple threads and return as generator.'''
+        '''Create, save, and return photos in multiple threads and return as generator.
+            With a thumb_store, thumbs are only read from it (see read_store_thumbs).
+        '''
+        if self.thumb_store is not None:
+            yield from self.read_store_thumbs(use_tqdm=use_tqdm, limit=limit)
+            return
         batches = self.batch_source_images(batch_size=batch_size)
         for thumb in self.map_unwrap_thumbs(map, batches, use_tqdm, limit):
             yield thumb
+        self.update_thumb_cache()
     
+    def read_store_thumbs(self, use_tqdm: bool = False, limit: int = None, dtype: np.dtype = np.float64) -> typing.Generator[FileImage]:
+        '''Yield thumbs from the thumb store in dtype, skipping any it does not hold.
+            The default float64 in [0, 1] matches thumbs read without a store; uint8 yields
+            zero-copy views. Read-only, so it is safe in any process: missing thumbs are only
+            added by an explicit build_thumb_store call in the writing process.
+        '''
+        store = self.thumb_store
+        sis = self.source_images if limit is None else self.source_images[:limit]
+        sis = tqdm.tqdm(sis) if use_tqdm else sis
+        for si in sis:
+            if si.image_path in store:
+                yield FileImage(path=si.image_path, im=as_image_dtype(store.get(si.image_path), dtype))
+
+    def build_thumb_store(self, 
+        batch_size: int = 1, 
+        use_tqdm: bool = False, 
+        processes: int = os.cpu_count(),
+    ) -> ThumbStore:
+        '''Make thumbs that are missing from the store in parallel; only this process writes to the store.
+            Call this once, in the process that owns the store, before reading thumbs from it.
+        '''
+        store = self.thumb_store
+        missing = self.clone(source_images=[si for si in self.source_images if si.image_path not in store])
+        if not len(missing):
+            return store
+        batches = missing.batch_source_images(batch_size=batch_size)
+        def add_batches(map_func: typing.Callable) -> None:
+            it = map_func(self.thread_make_thumbs, batches)
+            if use_tqdm:
+                it = tqdm.tqdm(it, total=len(batches))
+            for batch in it:
+                for path, im in batch:
+                    store.add(path, im)
+
+        if processes == 1:
+            add_batches(map)
+        else:
+            with multiprocessing.Pool(processes=processes) as pool:
+                add_batches(pool.imap_unordered)
+        store.flush()
+        return store
+
+    def read_thumb_array(self, start: int, stop: int, dtype: np.dtype = np.float64) -> typing.Tuple[np.ndarray, np.ndarray]:
+        '''Read thumbs of source_images[start:stop] as one (n, h, w, 3) array of dtype (float64, float32 or uint8).
+            Returns the ids (indices into source_images) that were read and the array.
+        '''
+        ids, thumbs = list(), list()
+        for i in range(start, min(stop, len(self.source_images))):
+            si = self.source_images[i]
+            try:
+                if self.thumb_store is not None and si.image_path in self.thumb_store:
+                    thumbs.append(as_image_dtype(self.thumb_store.get(si.image_path), dtype))
+                else:
+                    thumbs.append(as_image_dtype(si.retrieve_thumb().im, dtype))
+                ids.append(i)
+            except OSError:
+                pass
+        h,w = self.scale_res
+        arr = np.stack(thumbs) if len(thumbs) else np.empty((0,h,w,3), dtype=dtype)
+        return np.array(ids, dtype=np.int64), arr
+
+    @staticmethod
+    def thread_make_thumbs(sis: typing.List[SourceImage]) -> typing.List[typing.Tuple[pathlib.Path, np.ndarray]]:
+        '''Make uint8 thumbs for a set of source images without saving them.'''
+        thumbs = list()
+        for si in sis:
+            try:
+                thumbs.append((si.image_path, si.make_thumb().as_ubyte().im))
+            except (OSError, ValueError):
+                pass
+        return thumbs
+
     @classmethod
     def map_unwrap_thumbs(cls, 
         map_func: typing.Callable[[typing.Iterable], FileImage], 
@@ -78,7 +177,7 @@ class ImageManager:
     ) -> typing.Generator[FileImage]:
         '''Map and unwrap batch thumbnail reads.'''
         i = 0
-        it = map_func(cls.thread_retrieve_thumbs, batches)
+        it = instrument.map_merged(map_func, cls.thread_retrieve_thumbs, batches)
         if use_tqdm:
             it = tqdm.tqdm(it, total=len(batches))
         for batch in it:
@@ -99,10 +198,48 @@ class ImageManager:
                 pass
         return thumbs
         
+    ########## Thumb cache ##########
+    def apply_thumb_cache(self, validate: bool = True) -> ImageManager:
+        '''Point every source image at its content-addressed thumb, checking the library against the manifest in one pass.
+            Stale entries (source size or mtime changed) are invalidated and their thumbs deleted.
+        '''
+        cache = self.thumb_cache
+        hits, stale = cache.lookup((si.image_path for si in self.source_images), validate=validate)
+        cache.invalidate(stale)
+        source_images = list()
+        for si in self.source_images:
+            hit = hits.get(str(si.image_path))
+            if hit is not None:
+                source_images.append(dataclasses.replace(si, thumb_path=hit, thumb_exists=True))
+            else:
+                thumb_path = cache.thumb_path(si.image_path, os.stat(si.image_path))
+                source_images.append(dataclasses.replace(si, thumb_path=thumb_path, thumb_exists=False))
+        if len(stale):
+            cache.save()
+        return self.clone(source_images=source_images)
+    
+    def update_thumb_cache(self) -> None:
+        '''Record thumbs written since the cache was applied and save the manifest.'''
+        cache = self.thumb_cache
+        if cache is None:
+            return
+        for si in self.source_images:
+            if str(si.image_path) not in cache.entries and si.thumb_path.exists():
+                si.thumb_exists = True
+                cache.record(si.image_path, os.stat(si.image_path), si.thumb_path)
+        cache.save()
+        
     ########## Filtering ##########
-    def filter_usable_photo(self, **kwargs) -> ImageManager:
-        '''Filters images, keeping only those SourceImages that are usable photos.'''
-        return self.filter(lambda si: si.is_usable_photo(), **kwargs)
+    def filter_usable_photo(self, metadata_index: typing.Optional[MetadataIndex] = None, **kwargs) -> ImageManager:
+        '''Filters images, keeping only those SourceImages that are usable photos.
+            With a metadata_index, only new or changed sidecars are parsed and the filter
+            is a single query against the index.
+        '''
+        if metadata_index is None:
+            return self.filter(lambda si: si.is_usable_photo(), **kwargs)
+        metadata_index.update([si.json_path for si in self.source_images if si.has_json()])
+        usable = metadata_index.usable_photo_paths()
+        return self.filter(lambda si: str(si.json_path) in usable, **kwargs)
         
     def filter(self, func: typing.Callable[[SourceImage], bool], use_tqdm: bool = False) -> ImageManager:
         '''Filters the ImageManager, keeping only those SourceImages for which func returns True.'''
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import typing
+import dataclasses
+import pathlib
+import os
+import multiprocessing
+import concurrent.futures
+import doctable
+
+from .sourceimage import Metadata
+
+@dataclasses.dataclass
+class MetadataIndex:
+    '''Extracted googlePhotosOrigin fields of Takeout sidecars, stored in SQLite.
+        Rows are keyed by sidecar path and mtime, so a sidecar is opened and parsed once and
+        again only after it changes. Missing sidecars are recorded too (mtime -1), so they
+        are not looked for again until they appear. Filters are queries on the stored fields.
+    '''
+    core: doctable.ConnectCore
+    tab: doctable.DBTable
+    max_sql_vars: typing.ClassVar[int] = 500 # paths per IN (...) clause
+
+    @classmethod
+    def open(cls, dbpath: pathlib.Path) -> MetadataIndex:
+        dbpath = pathlib.Path(dbpath)
+        dbpath.parent.mkdir(exist_ok=True, parents=True)
+        core = doctable.ConnectCore.open(dbpath, dialect='sqlite')
+        with core.begin_ddl() as ddl:
+            tab = ddl.create_table_if_not_exists(SidecarMetadata)
+        return cls(core=core, tab=tab)
+
+    ############# Updating #############
+    def update(self,
+        json_paths: typing.Iterable[pathlib.Path],
+        validate: bool = True,
+        processes: int = os.cpu_count(),
+        stat_threads: int = 16,
+    ) -> int:
+        '''Parse sidecars that are new or changed since they were indexed. Returns the number parsed.
+            With validate=False, sidecars already in the index are trusted and not stat-ed.
+        '''
+        paths = list(dict.fromkeys(str(p) for p in json_paths))
+        known = self.select_mtimes(paths)
+        if validate:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=stat_threads) as executor:
+                stale = [p for p, mtime in zip(paths, executor.map(sidecar_mtime, paths)) if known.get(p) != mtime]
+        else:
+            stale = [p for p in paths if p not in known]
+        if not len(stale):
+            return 0
+
+        if processes == 1 or len(stale) < 1000:
+            rows = list(map(read_sidecar, stale))
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                rows = pool.map(read_sidecar, stale, chunksize=256)
+
+        for i in range(0, len(rows), self.max_sql_vars):
+            chunk = rows[i:i+self.max_sql_vars]
+            with self.tab.query() as q:
+                q.delete(where=self.tab['json_path'].in_([r.json_path for r in chunk]))
+                q.insert_multi(chunk)
+        return len(rows)
+
+    ############# Queries #############
+    def select_mtimes(self, json_paths: typing.List[str]) -> typing.Dict[str, int]:
+        mtimes = dict()
+        for i in range(0, len(json_paths), self.max_sql_vars):
+            with self.tab.query() as q:
+                for row in q.select(cols=[self.tab['json_path'], self.tab['mtime_ns']], where=self.tab['json_path'].in_(json_paths[i:i+self.max_sql_vars])):
+                    mtimes[row.json_path] = row.mtime_ns
+        return mtimes
+
+    def select_paths(self, where) -> typing.Set[str]:
+        '''Sidecar paths of all rows matching a where clause on the table columns.'''
+        with self.tab.query() as q:
+            return {row.json_path for row in q.select(cols=[self.tab['json_path']], where=where)}
+
+    def usable_photo_paths(self) -> typing.Set[str]:
+        '''Sidecars of photos taken with the phone camera (same rule as Metadata.is_photo).'''
+        return self.select_paths(self.tab['local_folder_name'] == '')
+
+def sidecar_mtime(json_path: str) -> int:
+    try:
+        return os.stat(json_path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+def read_sidecar(json_path: str) -> SidecarMetadata:
+    '''Stat and parse one sidecar into an index row (unreadable or invalid sidecars get no fields).'''
+    mtime_ns = sidecar_mtime(json_path)
+    fields = dict()
+    if mtime_ns >= 0:
+        try:
+            fields = Metadata.read_json(pathlib.Path(json_path)).origin_fields()
+        except (OSError, ValueError):
+            pass
+    return SidecarMetadata(json_path=json_path, mtime_ns=mtime_ns, **fields)
+
+@doctable.table_schema(
+    indices = {
+        'sidecar_path': doctable.Index('json_path', unique=True),
+        'sidecar_folder': doctable.Index('local_folder_name'),
+    },
+)
+class SidecarMetadata:
+    json_path: str
+    mtime_ns: int # -1 if the sidecar does not exist
+    origin_type: str = None # keys of googlePhotosOrigin, e.g. 'mobileUpload'
+    device_type: str = None
+    local_folder_name: str = None
+
+    id: int = doctable.Column(
+        column_args=doctable.ColumnArgs(
+            order=0,
+            primary_key=True,
+            autoincrement=True,
+        )
+    )
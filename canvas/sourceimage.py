@@ -8,6 +8,9 @@ import random
 import skimage # type: ignore
 import math
 import json
+
+from imagecore import instrument
+
 #from .imagefilemanager import SourceImage, ImageFileManager
 #from .canvas import Canvas, SubCanvas
 #from .sourceimage import SourceImage
@@ -38,25 +41,45 @@ class Metadata:
         except KeyError as e:
             return False
 
+    def origin_fields(self) -> typing.Dict[str, typing.Optional[str]]:
+        '''Fields of googlePhotosOrigin kept in a MetadataIndex (None where absent).'''
+        origin = self.data.get('googlePhotosOrigin')
+        if not isinstance(origin, dict):
+            return dict(origin_type=None, device_type=None, local_folder_name=None)
+        mobile = origin.get('mobileUpload')
+        mobile = mobile if isinstance(mobile, dict) else dict()
+        folder = mobile.get('deviceFolder')
+        return dict(
+            origin_type=','.join(sorted(origin.keys())),
+            device_type=mobile.get('deviceType'),
+            local_folder_name=folder.get('localFolderName') if isinstance(folder, dict) else None,
+        )
+
 @dataclasses.dataclass
 class SourceImage:
     image_path: pathlib.Path
     thumb_path: pathlib.Path
     json_path: pathlib.Path
     shape: typing.Tuple[Height, Width]
+    thumb_exists: typing.Optional[bool] = None # known thumb state (e.g. from a ThumbCache manifest), saves a stat
+    json_exists: typing.Optional[bool] = None # known sidecar state (e.g. from scan_images), saves a stat
 
     @classmethod
     def from_fpaths(cls, 
         image_path: pathlib.Path, 
         thumb_folder: pathlib.Path, 
         shape: typing.Tuple[Height, Width],
+        json_exists: typing.Optional[bool] = None,
+        check_exists: bool = True,
     ) -> SourceImage:
-        assert image_path.exists()
+        if check_exists:
+            assert image_path.exists()
         return cls(
             image_path = image_path,
             thumb_path = img_to_thumb_path(image_path, thumb_folder, shape=shape),
             json_path = img_to_json_path(image_path),
             shape = shape,
+            json_exists = json_exists,
         )
 
     #################   Metadata   #################
@@ -69,19 +92,37 @@ class SourceImage:
         return Metadata.read_json(self.json_path)
 
     def has_json(self) -> bool:
+        if self.json_exists is not None:
+            return self.json_exists
         return self.json_path.exists()
 
     #################   Image   #################
     def retrieve_thumb(self) -> FileImage:
-        '''Read from thumb if exists or make thumb and return it.'''
-        if self.has_thumb():
-            return self.read_image(self.thumb_path)
-        else:
-            thumb_image = self.read_image(self.image_path).resize(self.shape)
+        '''Read from thumb if exists or make thumb and return it.
+            A thumb that cannot be read (e.g. deleted after a manifest recorded it) is rebuilt.
+        '''
+        with instrument.stage('retrieve_thumb') as stage:
+            if self.has_thumb():
+                try:
+                    if stage.enabled:
+                        stage.add_bytes(self.thumb_path.stat().st_size)
+                    return self.read_image(self.thumb_path)
+                except OSError:
+                    self.thumb_exists = False
+            if stage.enabled:
+                stage.add_bytes(self.image_path.stat().st_size)
+            thumb_image = self.make_thumb()
             thumb_image.as_ubyte().write(self.thumb_path)
+            self.thumb_exists = True
             return thumb_image # type: ignore
     
+    def make_thumb(self) -> FileImage:
+        '''Read the original image at thumb size without saving, converting to float only at the end.'''
+        return FileImage.read_thumbnail(self.image_path, self.shape).as_float() # type: ignore
+    
     def has_thumb(self) -> bool:
+        if self.thumb_exists is not None:
+            return self.thumb_exists
         return self.thumb_path.exists()
     
     @staticmethod
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import pathlib
+import dataclasses
+import typing
+import hashlib
+import json
+import os
+
+from .image import Height, Width
+
+@dataclasses.dataclass
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    thumb: str
+
+    def matches(self, st: os.stat_result) -> bool:
+        return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+
+@dataclasses.dataclass
+class ThumbCache:
+    '''Thumbnail files named by a hash of (source path, size, mtime), tracked in one manifest.
+        Sources with the same file name in different folders never share a thumb, and a
+        source that changes on disk gets a new key, so its old thumb is invalidated.
+    '''
+    folder: pathlib.Path
+    shape: typing.Tuple[Height, Width]
+    entries: typing.Dict[str, ManifestEntry]
+
+    @classmethod
+    def open(cls, folder: pathlib.Path, shape: typing.Tuple[Height, Width]) -> ThumbCache:
+        folder = pathlib.Path(folder)
+        folder.mkdir(exist_ok=True, parents=True)
+        cache = cls(folder=folder, shape=tuple(shape), entries=dict())
+        if cache.manifest_path.exists():
+            with cache.manifest_path.open('r') as f:
+                cache.entries = {src: ManifestEntry(**e) for src, e in json.load(f)['entries'].items()}
+        return cache
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        h,w = self.shape
+        return self.folder / f'manifest_{h}x{w}.json'
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    ########## Keys ##########
+    def thumb_path(self, source_path: pathlib.Path, st: os.stat_result) -> pathlib.Path:
+        '''Content-addressed thumb path for a source in its current state.'''
+        key = hashlib.sha1(f'{source_path}\0{st.st_size}\0{st.st_mtime_ns}'.encode()).hexdigest()[:20]
+        h,w = self.shape
+        return self.folder / f'{key}_{h}x{w}.png'
+
+    ########## Lookup ##########
+    def lookup(self,
+        source_paths: typing.Iterable[pathlib.Path],
+        validate: bool = True,
+    ) -> typing.Tuple[typing.Dict[str, pathlib.Path], typing.List[str]]:
+        '''Check a whole library against the manifest at once.
+            Returns (thumb paths of valid entries by source, sources whose entries are stale).
+            An entry is stale if its source changed or its thumb file is gone; thumbs are checked
+            against one listing of the cache folder rather than a stat each. With validate=False
+            the manifest is trusted and nothing is stat-ed or listed.
+        '''
+        thumbs = set(os.listdir(self.folder)) if validate else None
+        hits, stale = dict(), list()
+        for source_path in source_paths:
+            entry = self.entries.get(str(source_path))
+            if entry is None:
+                continue
+            if validate and (entry.thumb not in thumbs or not entry.matches(os.stat(source_path))):
+                stale.append(str(source_path))
+            else:
+                hits[str(source_path)] = self.folder / entry.thumb
+        return hits, stale
+
+    ########## Updating ##########
+    def record(self, source_path: pathlib.Path, st: os.stat_result, thumb_path: pathlib.Path) -> None:
+        self.entries[str(source_path)] = ManifestEntry(size=st.st_size, mtime_ns=st.st_mtime_ns, thumb=thumb_path.name)
+
+    def invalidate(self, source_paths: typing.Iterable[str]) -> None:
+        '''Drop manifest entries and delete their thumb files.'''
+        for source_path in source_paths:
+            entry = self.entries.pop(str(source_path), None)
+            if entry is not None:
+                self.folder.joinpath(entry.thumb).unlink(missing_ok=True)
+
+    def save(self) -> None:
+        '''Atomically replace the manifest file.'''
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with tmp_path.open('w') as f:
+            json.dump({'shape': list(self.shape), 'entries': {s: dataclasses.asdict(e) for s, e in self.entries.items()}}, f)
+        os.replace(tmp_path, self.manifest_path)
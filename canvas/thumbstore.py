@@ -0,0 +1,128 @@
+from __future__ import annotations
+import pathlib
+import dataclasses
+import typing
+import numpy as np
+import json
+import os
+
+from .image import Height, Width
+
+@dataclasses.dataclass
+class ThumbStore:
+    '''All thumbnails of one resolution packed into a single memory-mapped uint8 array.
+        Row i of the array is the thumb of paths[i]. The store has a single writer:
+        worker processes may read from it, but only one process should add thumbs.
+    '''
+    data_path: pathlib.Path
+    index_path: pathlib.Path
+    shape: typing.Tuple[Height, Width]
+    paths: typing.List[str]
+    ids: typing.Dict[str, int]
+    data: typing.Optional[np.memmap] = dataclasses.field(default=None, repr=False) # writable map, writer only
+    readonly_data: typing.Optional[np.memmap] = dataclasses.field(default=None, repr=False)
+
+    @classmethod
+    def open(cls, folder: pathlib.Path, shape: typing.Tuple[Height, Width]) -> ThumbStore:
+        '''Open (or create) the store for thumbs of the given shape in folder.'''
+        folder = pathlib.Path(folder)
+        folder.mkdir(exist_ok=True, parents=True)
+        h,w = shape
+        index_path = folder / f'thumbs_{h}x{w}.index.json'
+        paths = list()
+        if index_path.exists():
+            with index_path.open('r') as f:
+                paths = json.load(f)['paths']
+        return cls(
+            data_path = folder / f'thumbs_{h}x{w}.u8',
+            index_path = index_path,
+            shape = (h,w),
+            paths = paths,
+            ids = {p:i for i,p in enumerate(paths)},
+        )
+
+    ########## Dunder ##########
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path: pathlib.Path) -> bool:
+        return str(path) in self.ids
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        '''Never pickle the mapped array: each process maps the file itself.'''
+        return {**self.__dict__, 'data': None, 'readonly_data': None}
+
+    ########## Reading ##########
+    def get(self, path: pathlib.Path) -> np.ndarray:
+        '''Zero-copy view of the thumb for a source path.'''
+        return self.get_id(self.ids[str(path)])
+
+    def get_id(self, thumb_id: int) -> np.ndarray:
+        '''Zero-copy view of the thumb with the given id.'''
+        return self.array()[thumb_id]
+
+    def array(self) -> np.ndarray:
+        '''Zero-copy (N, h, w, 3) view of every stored thumb, in id order.'''
+        if not len(self):
+            return np.empty((0,) + self.item_shape, dtype=np.uint8)
+        return self.mapped_readonly()[:len(self)]
+
+    ########## Writing ##########
+    def add(self, path: pathlib.Path, im: np.ndarray) -> int:
+        '''Add a uint8 thumb and return its id. Existing paths are overwritten in place.'''
+        if im.shape != self.item_shape or im.dtype != np.uint8:
+            raise ValueError(f'expected uint8 thumb of shape {self.item_shape}, got {im.dtype} {im.shape}')
+        key = str(path)
+        if key in self.ids:
+            thumb_id = self.ids[key]
+        else:
+            thumb_id = len(self.paths)
+            self.paths.append(key)
+            self.ids[key] = thumb_id
+        self.mapped(thumb_id + 1)[thumb_id] = im
+        return thumb_id
+
+    def flush(self) -> None:
+        '''Flush pixel data, then atomically replace the index so it never points past written rows.'''
+        if self.data is not None:
+            self.data.flush()
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with tmp_path.open('w') as f:
+            json.dump({'shape': list(self.shape), 'paths': self.paths}, f)
+        os.replace(tmp_path, self.index_path)
+
+    ########## Memory map ##########
+    @property
+    def item_shape(self) -> typing.Tuple[int, int, int]:
+        return tuple(self.shape) + (3,)
+
+    @property
+    def item_bytes(self) -> int:
+        return int(np.prod(self.item_shape))
+
+    def capacity(self) -> int:
+        return self.data_path.stat().st_size // self.item_bytes if self.data_path.exists() else 0
+
+    def mapped_readonly(self) -> np.memmap:
+        '''Read-only (mode 'r') memory map of the indexed rows. Never grows or writes the file.'''
+        if self.readonly_data is None or self.readonly_data.shape[0] < len(self):
+            if self.capacity() < len(self):
+                raise ValueError(f'{self.data_path} holds fewer than the {len(self)} thumbs in its index.')
+            self.readonly_data = np.memmap(self.data_path, dtype=np.uint8, mode='r', shape=(len(self),) + self.item_shape)
+        return self.readonly_data
+
+    def mapped(self, min_rows: int) -> np.memmap:
+        '''Get the writable (mode 'r+') memory map for add, growing the backing file (by doubling)
+            to hold at least min_rows. Only the store's single writer should call this.
+        '''
+        if self.data is not None and self.data.shape[0] >= min_rows:
+            return self.data
+        capacity = self.capacity()
+        if capacity < min_rows:
+            if self.data is not None:
+                self.data.flush()
+            capacity = max(min_rows, 2 * capacity, 1024)
+            with self.data_path.open('ab') as f:
+                f.truncate(capacity * self.item_bytes)
+        self.data = np.memmap(self.data_path, dtype=np.uint8, mode='r+', shape=(capacity,) + self.item_shape)
+        return self.data
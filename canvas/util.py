@@ -8,6 +8,17 @@ def write_as_uint(im: np.ndarray, fpath: pathlib.Path) -> None:
     '''Writes image as float.'''
     skimage.io.imsave(str(fpath), skimage.img_as_ubyte(im))
 
+def as_image_dtype(im: np.ndarray, dtype: np.dtype = np.float64) -> np.ndarray:
+    '''Convert an image to uint8, float32 or float64 with skimage's range conventions.'''
+    dtype = np.dtype(dtype)
+    if dtype == np.uint8:
+        return skimage.img_as_ubyte(im)
+    elif dtype == np.float32:
+        return skimage.img_as_float32(im)
+    elif dtype == np.float64:
+        return skimage.img_as_float64(im)
+    raise ValueError(f'unsupported image dtype: {dtype}')
+
 def imread_transform_resize(fpath: pathlib.Path, resize_res: typing.Tuple[int,int]) -> np.ndarray:
     '''Read and transform image then scale it according to new resolution'''
     im = imread_transform(fpath)
@@ -26,3 +37,16 @@ def transform_color_rgb(im: np.ndarray) -> np.ndarray:
         im = skimage.color.rgba2rgb(im)
     return im
 
+
+def calc_gradient(im: np.ndarray, mode: str = 'volume') -> np.ndarray:
+    '''Gradient feature plane of an image.
+        'volume' is skimage's sobel over all axes (including colour), 'channel' is a 
+        2-D sobel of each colour plane, and 'luminance' a 2-D sobel of the grayscale image.
+    '''
+    if mode == 'volume' or len(im.shape) < 3:
+        return skimage.filters.sobel(im)
+    elif mode == 'channel':
+        return np.stack([skimage.filters.sobel(im[..., c]) for c in range(im.shape[2])], axis=-1)
+    elif mode == 'luminance':
+        return skimage.filters.sobel(skimage.color.rgb2gray(im))
+    raise ValueError(f'unknown gradient mode: {mode}')
@@ -0,0 +1,180 @@
+from __future__ import annotations
+import pathlib
+import dataclasses
+import typing
+import functools
+import threading
+import platform
+import resource
+import json
+import time
+import os
+
+@dataclasses.dataclass
+class StageStats:
+    '''Totals for one named stage.'''
+    calls: int = 0
+    seconds: float = 0.0
+    nbytes: int = 0
+    peak_rss: int = 0 # largest process peak RSS (bytes) seen when the stage finished
+
+    def merge(self, other: StageStats) -> None:
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.nbytes += other.nbytes
+        self.peak_rss = max(self.peak_rss, other.peak_rss)
+
+@dataclasses.dataclass
+class Recorder:
+    '''Stage totals, plus complete ('X') trace events when tracing is on.'''
+    stats: typing.Dict[str, StageStats] = dataclasses.field(default_factory=dict)
+    events: typing.List[typing.Dict[str, typing.Any]] = dataclasses.field(default_factory=list)
+    trace: bool = True
+    max_events: int = 1_000_000
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False)
+
+    def record(self, name: str, start_ns: int, end_ns: int, nbytes: int) -> None:
+        rss = peak_rss_bytes()
+        with self.lock:
+            stats = self.stats.setdefault(name, StageStats())
+            stats.calls += 1
+            stats.seconds += (end_ns - start_ns) / 1e9
+            stats.nbytes += nbytes
+            stats.peak_rss = max(stats.peak_rss, rss)
+            if self.trace and len(self.events) < self.max_events:
+                self.events.append({
+                    'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_native_id(),
+                    'ts': start_ns / 1000, 'dur': (end_ns - start_ns) / 1000, 'args': {'bytes': nbytes},
+                })
+
+    def merge(self, other: Recorder) -> None:
+        '''Fold in another recorder (e.g. one returned from a pool worker).'''
+        with self.lock:
+            for name, stats in other.stats.items():
+                self.stats.setdefault(name, StageStats()).merge(stats)
+            self.events.extend(other.events[:max(0, self.max_events - len(self.events))])
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        self.__dict__.update(state, lock=threading.Lock())
+
+    ########## Export ##########
+    def summary(self) -> str:
+        '''Table of stages, slowest first. Peak RSS is the maximum over all processes.'''
+        lines = [f'{"stage":<28} {"calls":>9} {"total s":>9} {"mean ms":>9} {"MB":>9} {"peak RSS MB":>12}']
+        for name, s in sorted(self.stats.items(), key=lambda item: -item[1].seconds):
+            mean_ms = 1000 * s.seconds / s.calls if s.calls else 0.0
+            lines.append(f'{name:<28} {s.calls:>9} {s.seconds:>9.3f} {mean_ms:>9.3f} {s.nbytes / 2**20:>9.1f} {s.peak_rss / 2**20:>12.0f}')
+        return '\n'.join(lines)
+
+    def write_trace(self, path: pathlib.Path) -> None:
+        '''Write events in Chrome trace format (open in chrome://tracing or Perfetto).'''
+        with pathlib.Path(path).open('w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+class Stage:
+    '''Times one block of work; add_bytes accumulates bytes read or processed in it.'''
+    __slots__ = ('name', 'nbytes', 'start_ns')
+    enabled = True
+
+    def __init__(self, name: str, nbytes: int = 0):
+        self.name = name
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes: int) -> None:
+        self.nbytes += nbytes
+
+    def __enter__(self) -> Stage:
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        recorder.record(self.name, self.start_ns, time.perf_counter_ns(), self.nbytes)
+
+class NullStage:
+    '''Shared do-nothing stage returned while instrumentation is off.'''
+    __slots__ = ()
+    enabled = False
+
+    def add_bytes(self, nbytes: int) -> None:
+        pass
+
+    def __enter__(self) -> NullStage:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+NULL_STAGE = NullStage()
+recorder = Recorder()
+is_enabled = False # checked on every stage; while False, instrumented code only pays for this lookup
+
+def enable(trace: bool = True, max_events: int = 1_000_000) -> None:
+    '''Start recording into a fresh recorder.'''
+    global is_enabled, recorder
+    recorder = Recorder(trace=trace, max_events=max_events)
+    is_enabled = True
+
+def disable() -> None:
+    global is_enabled
+    is_enabled = False
+
+def stage(name: str, nbytes: int = 0) -> Stage | NullStage:
+    '''Context manager timing a named stage: `with instrument.stage('decode') as st: ...`.'''
+    return Stage(name, nbytes) if is_enabled else NULL_STAGE
+
+def instrumented(name: str) -> typing.Callable:
+    '''Decorator recording every call of a function as a stage.'''
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled:
+                return func(*args, **kwargs)
+            with Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def peak_rss_bytes() -> int:
+    '''Peak RSS of this process so far (ru_maxrss is KB on Linux, bytes on macOS).'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if platform.system() == 'Darwin' else 1024)
+
+########## Pool workers ##########
+@dataclasses.dataclass
+class Collected:
+    '''Picklable wrapper that records func in a fresh recorder in the worker and returns
+        (result, recorder), so the parent can merge worker stages into its own.
+    '''
+    func: typing.Callable
+    trace: bool = True
+
+    def __call__(self, *args, **kwargs) -> typing.Tuple[typing.Any, Recorder]:
+        global is_enabled, recorder
+        outer_enabled, outer = is_enabled, recorder
+        is_enabled, recorder = True, Recorder(trace=self.trace)
+        try:
+            result = self.func(*args, **kwargs)
+            return result, recorder
+        finally:
+            is_enabled, recorder = outer_enabled, outer
+
+def map_merged(map_func: typing.Callable, func: typing.Callable, iterable: typing.Iterable) -> typing.Iterator[typing.Any]:
+    '''map_func(func, iterable) (e.g. pool.imap or pool.starmap) with worker stages merged into
+        this process's recorder. While instrumentation is off, func is mapped directly.
+    '''
+    if not is_enabled:
+        yield from map_func(func, iterable)
+        return
+    for result, worker_recorder in map_func(Collected(func, trace=recorder.trace), iterable):
+        recorder.merge(worker_recorder)
+        yield result
+
+def summary() -> str:
+    return recorder.summary()
+
+def write_trace(path: pathlib.Path) -> None:
+    recorder.write_trace(path)
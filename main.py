@@ -9,58 +9,288 @@ import numpy as np
 import random
 import tqdm
 import multiprocessing
+import functools
+import itertools
+import os
+import time
 
 import mediatools
 import photomosaic
+import canvas
+import imagecore
 
 
 def transform_img(img: mediatools.Image, size: tuple[int,int]) -> mediatools.Image:
     '''Transform an image to a comparable format.'''
     return img.as_float().to_rgb().transform.resize(size)
 
+def read_transform_img(cand_file: mediatools.ImageFile, size: tuple[int,int], dtype: np.dtype = np.float64) -> mediatools.Image:
+    '''Read an image file directly at comparable size (draft-mode decode) in the scoring dtype.'''
+    return mediatools.Image(photomosaic.as_feature_dtype(photomosaic.read_thumbnail(cand_file.path, size), dtype))
+
 def greedy_optimize_thread(
     thread_index: int, 
     cand_files: list[mediatools.ImageFile], 
     sgrid: photomosaic.ImageGrid, 
-    outfolder: Path
+    outfolder: Path,
+    batch_size: int = 32,
+    read_depth: int = 64,
+    read_threads: int = 4,
+    checkpoint_seconds: float | None = None,
+    resume: bool = False,
+    preview_seconds: float = 2.0,
+    topk: photomosaic.TopKAccumulator | None = None,
 ) -> photomosaic.GridScores:
-    best_scores = photomosaic.GridScores.from_grid_size(x_slices=sgrid.x_slices, y_slices=sgrid.y_slices)
-    for i, cand_file in tqdm.tqdm(enumerate(cand_files), ncols=100, total=len(cand_files)):
+    '''Greedily score cand_files against the grid.
+        If checkpoint_seconds is set, every checkpoint_seconds the per-position best scores and
+        the number of candidates consumed are saved atomically to checkpoint_{thread_index}.npz
+        in outfolder. With resume=True a run restarts from that checkpoint instead of from the
+        first candidate, provided it was made for the same candidate paths and target.
+        If topk is given, every candidate's distances are also pushed into it for refinement;
+        it is checkpointed with the scores, and restored from the checkpoint on resume.
+    '''
+    load_func = functools.partial(read_transform_img, size=sgrid.subimage_size, dtype=sgrid.dtype)
+    checkpoint_path = outfolder.joinpath(f'checkpoint_{thread_index}.npz')
+    fingerprint = photomosaic.run_fingerprint((cf.path for cf in cand_files), sgrid.get_tile_features()[0]) if resume or checkpoint_seconds is not None else ''
+    best_scores, start = restore_checkpoint(checkpoint_path, cand_files, sgrid, load_func, fingerprint, topk) if resume else (None, 0)
+    if best_scores is None:
+        best_scores = photomosaic.GridScores.from_grid_size(x_slices=sgrid.x_slices, y_slices=sgrid.y_slices)
+    engine = photomosaic.DistanceMatrixEngine.from_grid(sgrid)
+    positions = range(len(sgrid))
+    preview = photomosaic.PreviewRenderer.from_grid_size(
+        outfolder.joinpath(f'current_{thread_index}.png'),
+        tile_size=sgrid.subimage_size,
+        x_slices=sgrid.x_slices,
+        y_slices=sgrid.y_slices,
+        interval_seconds=preview_seconds,
+    )
 
-        # transform image to comparable format
-        cand_img = transform_img(cand_file.read(), size=sgrid.subimage_size)
+    # read and transform upcoming candidates in background threads while we score
+    read_ahead = photomosaic.ReadAhead(
+        items=range(start, len(cand_files)),
+        load_func=lambda i: load_func(cand_files[i]),
+        depth=read_depth,
+        threads=read_threads,
+    )
+    loaded = iter(read_ahead)
+    last_checkpoint = time.monotonic()
+    for i in tqdm.tqdm(range(start, len(cand_files), batch_size), ncols=100):
 
-        # compute distances between candidate and all subimages
-        dists = sgrid.calc_distances(cand_img)
+        # take the next batch of images in comparable format
+        batch = list(itertools.islice(loaded, batch_size))
+        if not len(batch):
+            break
+
+        # compute distances between every candidate in the batch and all subimages
+        dist_block = engine.calc_block(photomosaic.stack_images(ci.im for _, ci in batch))
         
-        # insert the candidate image if it is the best for any subimage
-        best_scores.insert_any_if_best(cand_img, dists)
+        for (j, cand_img), dists in zip(batch, dist_block):
+            # insert the candidate image if it is the best for any subimage
+            best_scores.insert_any_if_best(cand_img, list(zip(dists.tolist(), positions)), cand_id=j)
+        if topk is not None:
+            topk.push(np.array([j for j, _ in batch]), dist_block)
+
+        # blit changed tiles into the preview so we can see it happen; written every preview_seconds
+        preview.update(best_scores)
 
-        # save this every iteration so we can see it happen
-        if i % 5 == 0:
-            best_score_grid = best_scores.get_subimage_grid()
-            best_score_grid.recombine().as_ubyte().write(outfolder.joinpath(f'current_{thread_index}.png'))
+        # every candidate up to the end of this batch has been scored
+        if checkpoint_seconds is not None and time.monotonic() - last_checkpoint >= checkpoint_seconds:
+            photomosaic.Checkpoint.from_scores(best_scores, cursor=batch[-1][0] + 1, num_candidates=len(cand_files), fingerprint=fingerprint, topk=topk).save(checkpoint_path)
+            last_checkpoint = time.monotonic()
+
+    preview.update(best_scores, force=True)
+    if checkpoint_seconds is not None:
+        photomosaic.Checkpoint.from_scores(best_scores, cursor=len(cand_files), num_candidates=len(cand_files), fingerprint=fingerprint, topk=topk).save(checkpoint_path)
+    tqdm.tqdm.write(str(read_ahead.stats))
     return best_scores
 
+def restore_checkpoint(
+    checkpoint_path: Path,
+    cand_files: list[mediatools.ImageFile],
+    sgrid: photomosaic.ImageGrid,
+    load_func: typing.Callable[[mediatools.ImageFile], mediatools.Image],
+    fingerprint: str,
+    topk: photomosaic.TopKAccumulator | None = None,
+) -> tuple[photomosaic.GridScores | None, int]:
+    '''Rebuild scores from a checkpoint by re-reading only the chosen candidates, and restore
+        topk (if given) from it. Returns (None, 0) if there is no checkpoint, its fingerprint shows
+        it was made for different candidate paths or a different target, or topk is given but
+        the checkpoint holds no matching top-k lists (refinement would miss earlier candidates).
+    '''
+    checkpoint = photomosaic.Checkpoint.load(checkpoint_path)
+    if checkpoint is None:
+        return None, 0
+    if checkpoint.fingerprint != fingerprint or checkpoint.num_candidates != len(cand_files) or len(checkpoint.dists) != len(sgrid):
+        tqdm.tqdm.write(f'{checkpoint_path} was made for different candidates or target; starting over')
+        return None, 0
+    if topk is not None and not checkpoint.restore_topk(topk):
+        tqdm.tqdm.write(f'{checkpoint_path} has no top-{topk.k} lists for refinement; starting over')
+        return None, 0
+
+    best_scores = scores_from_arrays(checkpoint.dists, checkpoint.cand_ids, cand_files, sgrid, load_func)
+    tqdm.tqdm.write(f'resuming from candidate {checkpoint.cursor} of {len(cand_files)}')
+    return best_scores, checkpoint.cursor
+
+def scores_from_arrays(
+    dists: np.ndarray,
+    cand_ids: np.ndarray,
+    cand_files: list[mediatools.ImageFile],
+    sgrid: photomosaic.ImageGrid,
+    load_func: typing.Callable[[mediatools.ImageFile], mediatools.Image],
+    images: dict[int, mediatools.Image] | None = None,
+) -> photomosaic.GridScores:
+    '''Build GridScores from per-position (dists, cand_ids), reading each chosen candidate
+        once unless its image is already in images.
+    '''
+    images = dict() if images is None else images
+    best_scores = photomosaic.GridScores.from_grid_size(x_slices=sgrid.x_slices, y_slices=sgrid.y_slices)
+    for grid_index, (dist, j) in enumerate(zip(dists.tolist(), cand_ids.tolist())):
+        if j >= 0:
+            if j not in images:
+                images[j] = load_func(cand_files[j])
+            best_scores.insert_if_best(images[j], grid_index, dist, cand_id=j)
+    return best_scores
+
+
+def refine_greedy(
+    best_scores: photomosaic.GridScores,
+    topk: photomosaic.TopKAccumulator,
+    cand_files: list[mediatools.ImageFile],
+    sgrid: photomosaic.ImageGrid,
+    time_budget: float,
+) -> photomosaic.GridScores:
+    '''Anneal the greedy placement with swaps and replacements from the top-k lists,
+        then rebuild scores, reading only candidates the greedy pass did not place.
+    '''
+    lookup = photomosaic.DistanceLookup.from_topk(topk.cand_ids, topk.dists)
+    report = photomosaic.refine_scores(best_scores, lookup, time_budget=time_budget)
+    tqdm.tqdm.write(str(report))
+
+    load_func = functools.partial(read_transform_img, size=sgrid.subimage_size, dtype=sgrid.dtype)
+    placed = {s.cand_id: s.image for s in best_scores.scores if s.cand_id >= 0}
+    return scores_from_arrays(report.assignment.dists, report.assignment.cand_ids, cand_files, sgrid, load_func, images=placed)
+
+def greedy_optimize_parallel(
+    cand_files: list[mediatools.ImageFile], 
+    sgrid: photomosaic.ImageGrid, 
+    processes: int = os.cpu_count(),
+    num_shards: int | None = None,
+    k: int = 16,
+    topk: photomosaic.TopKAccumulator | None = None,
+) -> photomosaic.GridScores:
+    '''Score shards of cand_files across a process pool, then replay greedy insertion over all
+        candidates in order. The placement is the same as greedy_optimize_thread over cand_files.
+        If topk is given, each shard keeps its own top-k lists and they are merged into topk
+        for refinement, with the same result as greedy_optimize_thread's.
+    '''
+    load_func = functools.partial(read_transform_img, size=sgrid.subimage_size, dtype=sgrid.dtype)
+    engine = photomosaic.DistanceMatrixEngine.from_grid(sgrid)
+    def row_func(j: int) -> np.ndarray:
+        return engine.calc_block(photomosaic.stack_images([load_func(cand_files[j]).im]))[0]
+
+    shard_func = functools.partial(score_shard, sgrid=sgrid, k=k, topk_k=topk.k if topk is not None else None)
+    dists, cand_ids = photomosaic.greedy_optimize_sharded(shard_func, cand_files, len(sgrid), row_func=row_func, processes=processes, num_shards=num_shards, topk=topk)
+    return scores_from_arrays(dists, cand_ids, cand_files, sgrid, load_func)
+
+def score_shard(
+    shard_index: int,
+    cand_files: list[mediatools.ImageFile],
+    sgrid: photomosaic.ImageGrid,
+    k: int = 16,
+    batch_size: int = 32,
+    read_depth: int = 64,
+    read_threads: int = 4,
+    topk_k: int | None = None,
+) -> photomosaic.CandidateLists:
+    '''Each candidate's k nearest positions for one shard. Candidates that fail to load get
+        inf distances, so they are never placed, as in greedy_optimize_thread. With topk_k,
+        the shard's best topk_k candidates per position are kept too (CandidateLists.topk).
+    '''
+    load_func = functools.partial(read_transform_img, size=sgrid.subimage_size, dtype=sgrid.dtype)
+    engine = photomosaic.DistanceMatrixEngine.from_grid(sgrid)
+    k = min(k, len(sgrid))
+    lists = photomosaic.CandidateLists(
+        dists=np.full((len(cand_files), k), np.inf),
+        positions=np.zeros((len(cand_files), k), dtype=np.int64),
+        topk=photomosaic.TopKAccumulator.empty(len(sgrid), topk_k) if topk_k is not None else None,
+    )
+    read_ahead = photomosaic.ReadAhead(
+        items=range(len(cand_files)),
+        load_func=lambda i: load_func(cand_files[i]),
+        depth=read_depth,
+        threads=read_threads,
+    )
+    loaded = iter(read_ahead)
+    while True:
+        batch = list(itertools.islice(loaded, batch_size))
+        if not len(batch):
+            break
+        dist_block = engine.calc_block(photomosaic.stack_images(ci.im for _, ci in batch))
+        block = photomosaic.CandidateLists.from_block(dist_block, k)
+        ids = [j for j, _ in batch]
+        lists.dists[ids], lists.positions[ids] = block.dists, block.positions
+        if lists.topk is not None:
+            lists.topk.push(np.array(ids), dist_block)
+    return lists
 
-def main():
+def render_final(
+    best_scores: photomosaic.GridScores,
+    cand_files: list[mediatools.ImageFile],
+    tile_size: tuple[int,int],
+    path: Path,
+    processes: int = os.cpu_count(),
+) -> None:
+    '''Re-read each chosen original at tile_size (which can be much larger than the matching size)
+        and stream the mosaic to a tiff at path one row of tiles at a time.
+    '''
+    _, cand_ids = best_scores.to_arrays()
+    paths = [cand_files[j].path if j >= 0 else None for j in cand_ids.tolist()]
+    photomosaic.render_tiles_to_file(path, paths, best_scores.x_slices, best_scores.y_slices, tile_size, processes=processes)
+
+
+def main(
+    resume: bool = False, 
+    render_tile_size: tuple[int,int] | None = (512, 512), 
+    dtype: np.dtype = np.float32, 
+    profile: bool = False,
+    refine_seconds: float | None = 10.0,
+):
     
+    if profile:
+        imagecore.instrument.enable()
+
     output_fname = 'data/outputs/obama/obama_head_coco/best_score_grid_obama.png'
+    render_fname = 'data/outputs/obama/obama_head_coco/best_score_grid_obama_full.tif'
 
     base_file = mediatools.ImageFile.from_path("data/targets/obama.png")
     base_image = base_file.read().to_rgb()#.transform.resize((500, 500))
-    sgrid = photomosaic.ImageGrid.from_image(base_image, 36, 20)
+    sgrid = photomosaic.ImageGrid.from_image(base_image, 36, 20, dtype=dtype)
     print(base_image)
 
-    cand_files = mediatools.ImageFiles.from_rglob('data/dataset_coco/train/')
+    # one parallel directory walk for all extensions, instead of one rglob per extension
+    cand_files = [mediatools.ImageFile.from_path(found.path) for found in canvas.scan_images(Path('data/dataset_coco/train/'))]
     print(len(cand_files))
 
     # all the work happens here!
-    best_scores = greedy_optimize_thread(0, cand_files[:None], sgrid, Path('data/outputs/obama/obama_head_coco/'))
+    topk = photomosaic.TopKAccumulator.empty(len(sgrid), k=10) if refine_seconds is not None else None
+    best_scores = greedy_optimize_thread(0, cand_files[:None], sgrid, Path('data/outputs/obama/obama_head_coco/'), checkpoint_seconds=60.0, resume=resume, topk=topk)
+
+    # swap and replace placed images where that lowers the total distance
+    if refine_seconds is not None:
+        best_scores = refine_greedy(best_scores, topk, cand_files, sgrid, time_budget=refine_seconds)
     
     best_score_grid = best_scores.get_subimage_grid()
     best_score_grid.recombine().as_ubyte().write(output_fname)
 
+    # print-quality version from the original photos
+    if render_tile_size is not None:
+        render_final(best_scores, cand_files, render_tile_size, Path(render_fname))
+
+    if profile:
+        # per-stage totals, and a trace to open in chrome://tracing or Perfetto
+        imagecore.instrument.write_trace(Path('data/outputs/obama/obama_head_coco/trace.json'))
+        print(imagecore.instrument.summary())
+
 if __name__ == "__main__":
     main()
 
@@ -1,2 +1,17 @@
 from .grid_scores import GridScores, ImageScore
 from .image_grid import ImageGrid, GridIndex
+from .distances import composit_distances, gradient_stack, sobel_stack, stack_images, as_feature_dtype, GradientMode
+from .distance_matrix import DistanceMatrixEngine, FeatureMatrix, euclid_from_products
+from .ann import IVFIndex, PCAProjection, SearchReport, shortlist_search, exact_search, evaluate_recall, recall_at_k
+from .assignment import Assignment, AssignmentReport, solve_assignment, compare_with_greedy, greedy_assignment, greedy_match
+from .topk import TopKAccumulator, select_topk
+from .parallel import greedy_optimize_sharded, replay_greedy, CandidateLists, tree_reduce, shard_items
+from .shared import SharedArray, SharedGrid, init_worker, worker_state
+from .readahead import ReadAhead, ReadAheadStats
+from .decode import read_thumbnail
+from .writer import write_tile_rows
+from .checkpoint import Checkpoint, run_fingerprint
+from .preview import PreviewRenderer
+from .render import render_tiles, render_tiles_to_file, read_tile
+from .precision import PrecisionReport, evaluate_precision
+from .refine import DistanceLookup, RefineReport, TrajectoryPoint, refine_scores, anneal
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import time
+import numpy as np
+import scipy.cluster.vq
+
+from .distance_matrix import FeatureMatrix, DistanceMatrixEngine
+
+@dataclasses.dataclass
+class PCAProjection:
+    '''Linear projection of flattened features onto their top principal components.'''
+    mean: np.ndarray
+    components: np.ndarray
+
+    @classmethod
+    def fit(cls, features: np.ndarray, n_components: int, sample_size: int = 10_000, seed: int = 0) -> typing.Self:
+        '''Fit on (a random sample of) the rows of an (N, D) feature matrix.'''
+        rng = np.random.default_rng(seed)
+        if features.shape[0] > sample_size:
+            features = features[np.sort(rng.choice(features.shape[0], sample_size, replace=False))]
+        mean = features.mean(axis=0)
+        _, _, vt = np.linalg.svd(features - mean, full_matrices=False)
+        return cls(mean=mean, components=vt[:n_components])
+
+    def transform(self, features: np.ndarray) -> np.ndarray:
+        return ((features - self.mean) @ self.components.T).astype(np.float32)
+
+@dataclasses.dataclass
+class IVFIndex:
+    '''Inverted-file index over PCA-reduced candidate descriptors.
+        Descriptors are clustered with k-means; a query scans only the lists of its
+        nprobe nearest centroids and returns a top-k shortlist of candidate ids.
+    '''
+    projection: PCAProjection
+    centroids: np.ndarray
+    list_ids: typing.List[np.ndarray]
+    descriptors: np.ndarray
+
+    @classmethod
+    def build(cls,
+        lib: FeatureMatrix,
+        n_components: int = 32,
+        nlist: int | None = None,
+        seed: int = 0,
+    ) -> typing.Self:
+        '''Build from library features. nlist defaults to about sqrt(N) lists.'''
+        features = descriptor_features(lib)
+        projection = PCAProjection.fit(features, n_components=min(n_components, *features.shape), seed=seed)
+        descriptors = projection.transform(features)
+        nlist = nlist if nlist is not None else max(1, int(np.sqrt(len(lib))))
+        centroids, labels = scipy.cluster.vq.kmeans2(descriptors.astype(np.float64), nlist, minit='++', seed=seed)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        return cls(
+            projection=projection,
+            centroids=centroids.astype(np.float32),
+            list_ids=[order[bounds[i]:bounds[i+1]] for i in range(nlist)],
+            descriptors=descriptors,
+        )
+
+    def __len__(self) -> int:
+        return self.descriptors.shape[0]
+
+    def search(self, queries: FeatureMatrix, k: int, nprobe: int = 8) -> typing.Tuple[np.ndarray, np.ndarray]:
+        '''Approximate top-k candidates for each query (e.g. each grid tile).
+            Returns (ids, descriptor distances), both (Q, k) sorted ascending; rows are
+            padded with -1 / inf when the probed lists hold fewer than k candidates.
+        '''
+        q_desc = self.projection.transform(descriptor_features(queries))
+        nprobe = min(nprobe, len(self.list_ids))
+        probe = np.argsort(sqdists(q_desc, self.centroids), axis=1)[:, :nprobe]
+
+        ids = np.full((q_desc.shape[0], k), -1, dtype=np.int64)
+        dists = np.full((q_desc.shape[0], k), np.inf, dtype=np.float32)
+        for qi in range(q_desc.shape[0]):
+            cand = np.concatenate([self.list_ids[li] for li in probe[qi]])
+            d = sqdists(q_desc[qi:qi+1], self.descriptors[cand])[0]
+            top = topk_indices(d, k)
+            ids[qi, :len(top)] = cand[top]
+            dists[qi, :len(top)] = np.sqrt(d[top])
+        return ids, dists
+
+def descriptor_features(fm: FeatureMatrix) -> np.ndarray:
+    '''Rows used for indexing: pixel and gradient features side by side.'''
+    return np.concatenate([fm.pixels, fm.gradients], axis=1)
+
+def sqdists(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    '''Pairwise squared euclidean distances between rows of a and b.'''
+    sq = (a*a).sum(axis=1)[:, np.newaxis] + (b*b).sum(axis=1)[np.newaxis, :] - 2 * (a @ b.T)
+    return np.maximum(sq, 0)
+
+def topk_indices(values: np.ndarray, k: int) -> np.ndarray:
+    '''Indices of the k smallest values in ascending order.'''
+    if values.shape[0] > k:
+        part = np.argpartition(values, k)[:k]
+    else:
+        part = np.arange(values.shape[0])
+    return part[np.argsort(values[part], kind='stable')]
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    '''Mean fraction of each row's exact top-k ids that also appear in the approximate row.'''
+    hits = [np.intersect1d(a[a >= 0], e).shape[0] for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits) / exact_ids.shape[1])
+
+@dataclasses.dataclass
+class SearchReport:
+    '''Accuracy and speed of shortlist search compared with exact search.'''
+    k: int
+    nprobe: int
+    recall: float
+    ann_seconds: float
+    exact_seconds: float
+
+    @property
+    def speedup(self) -> float:
+        return self.exact_seconds / self.ann_seconds
+
+def shortlist_search(
+    index: IVFIndex,
+    engine: DistanceMatrixEngine,
+    lib: FeatureMatrix,
+    k: int,
+    shortlist_size: int | None = None,
+    nprobe: int = 8,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Top-k candidates per position: query the index for a shortlist, then rank it by exact composite distance.'''
+    shortlist_size = shortlist_size if shortlist_size is not None else 4 * k
+    ids, _ = index.search(engine.targets, shortlist_size, nprobe=nprobe)
+    dists = engine.calc_pairs(lib, ids)
+    order = np.argsort(dists, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(dists, order, axis=1)
+
+def exact_search(engine: DistanceMatrixEngine, lib: FeatureMatrix, k: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Top-k candidates per position from the full distance matrix.'''
+    dists = engine.calc_features(lib).T
+    ids = np.stack([topk_indices(row, k) for row in dists])
+    return ids, np.take_along_axis(dists, ids, axis=1)
+
+def evaluate_recall(
+    index: IVFIndex,
+    engine: DistanceMatrixEngine,
+    lib: FeatureMatrix,
+    k: int,
+    shortlist_size: int | None = None,
+    nprobe: int = 8,
+) -> SearchReport:
+    '''Time shortlist and exact search and report recall@k of the shortlist results.'''
+    start = time.perf_counter()
+    approx_ids, _ = shortlist_search(index, engine, lib, k, shortlist_size=shortlist_size, nprobe=nprobe)
+    ann_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact_ids, _ = exact_search(engine, lib, k)
+    exact_seconds = time.perf_counter() - start
+
+    return SearchReport(
+        k=k,
+        nprobe=nprobe,
+        recall=recall_at_k(approx_ids, exact_ids),
+        ann_seconds=ann_seconds,
+        exact_seconds=exact_seconds,
+    )
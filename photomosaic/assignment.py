@@ -0,0 +1,163 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.csgraph
+
+AssignmentMethod = typing.Literal['greedy', 'sparse', 'dense']
+
+@dataclasses.dataclass
+class Assignment:
+    '''One-to-one assignment of candidate ids to grid positions (-1 where a position is empty).'''
+    cand_ids: np.ndarray
+    dists: np.ndarray
+    method: str
+
+    @property
+    def total_cost(self) -> float:
+        return float(self.dists[self.cand_ids >= 0].sum())
+
+    @property
+    def num_unassigned(self) -> int:
+        return int((self.cand_ids < 0).sum())
+
+    @property
+    def num_assigned(self) -> int:
+        return int((self.cand_ids >= 0).sum())
+
+    @property
+    def mean_cost(self) -> float:
+        '''Mean distance per assigned position.'''
+        return self.total_cost / self.num_assigned if self.num_assigned > 0 else 0.0
+
+@dataclasses.dataclass
+class AssignmentReport:
+    '''Cost of an assignment compared with the greedy pass over the same top-k lists.
+        Total costs only compare when both assign the same number of positions, so the
+        comparison is per assigned position otherwise.
+    '''
+    greedy: Assignment
+    solved: Assignment
+
+    @property
+    def same_assigned(self) -> bool:
+        return self.greedy.num_assigned == self.solved.num_assigned
+
+    @property
+    def improvement(self) -> float:
+        '''Fraction of greedy cost removed by the solver: of the total cost if both assign the
+            same number of positions, of the mean cost per assigned position if not.
+        '''
+        if self.same_assigned:
+            greedy, solved = self.greedy.total_cost, self.solved.total_cost
+        else:
+            greedy, solved = self.greedy.mean_cost, self.solved.mean_cost
+        return 1 - solved / greedy if greedy > 0 else 0.0
+
+    def __str__(self) -> str:
+        basis = 'total' if self.same_assigned else 'mean per assigned position'
+        return (f'{self.solved.method} vs greedy: {100*self.improvement:.2f}% lower cost ({basis}), '
+            f'assigned {self.solved.num_assigned} vs {self.greedy.num_assigned} '
+            f'of {self.greedy.cand_ids.shape[0]} positions')
+
+
+def solve_assignment(cand_ids: np.ndarray, dists: np.ndarray, method: AssignmentMethod = 'sparse') -> Assignment:
+    '''Assign each position one of its top-k candidates, using every candidate at most once.
+        cand_ids and dists are (P, k) arrays; -1 ids mark padding. 'greedy' is the one-pass
+        heuristic, 'sparse' solves exactly on the sparse top-k graph (scales to 10k+ positions)
+        and 'dense' solves exactly with linear_sum_assignment on a padded cost matrix.
+    '''
+    if method == 'greedy':
+        return greedy_assignment(cand_ids, dists)
+    elif method == 'sparse':
+        return sparse_assignment(cand_ids, dists)
+    elif method == 'dense':
+        return dense_assignment(cand_ids, dists)
+    raise ValueError(f'unknown assignment method: {method}')
+
+def compare_with_greedy(cand_ids: np.ndarray, dists: np.ndarray, method: AssignmentMethod = 'sparse') -> AssignmentReport:
+    '''Solve and report total cost versus greedy.'''
+    return AssignmentReport(
+        greedy=greedy_assignment(cand_ids, dists),
+        solved=solve_assignment(cand_ids, dists, method=method),
+    )
+
+def greedy_assignment(cand_ids: np.ndarray, dists: np.ndarray) -> Assignment:
+    '''Take (position, candidate) pairs in order of distance, keeping each if both are still free.'''
+    assigned, assigned_dists = greedy_match(cand_ids, dists)
+    return Assignment(cand_ids=assigned, dists=assigned_dists, method='greedy')
+
+def greedy_match(cand_ids: np.ndarray, dists: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Take (position, candidate) pairs of (P, k) top-k lists in order of distance, keeping each
+        if both are still free. Returns (candidate id, distance) per position, -1 / inf where
+        every candidate of a position was taken; -1 ids in cand_ids mark padding.
+    '''
+    num_pos = cand_ids.shape[0]
+    positions = np.repeat(np.arange(num_pos), cand_ids.shape[1])
+    flat_ids, flat_dists = cand_ids.ravel(), dists.ravel()
+    order = np.argsort(flat_dists, kind='stable')
+
+    assigned = np.full(num_pos, -1, dtype=np.int64)
+    assigned_dists = np.full(num_pos, np.inf)
+    used = set()
+    for i in order:
+        pos, cid = positions[i], flat_ids[i]
+        if cid >= 0 and assigned[pos] < 0 and cid not in used:
+            assigned[pos] = cid
+            assigned_dists[pos] = flat_dists[i]
+            used.add(cid)
+    return assigned, assigned_dists
+
+def sparse_assignment(cand_ids: np.ndarray, dists: np.ndarray) -> Assignment:
+    '''Exact minimum-cost matching on the sparse position x candidate graph of top-k edges.'''
+    rows, cols, costs, cand_lookup, penalty = _edge_list(cand_ids, dists)
+    num_pos, num_cands = cand_ids.shape[0], cand_lookup.shape[0]
+
+    # one private "empty" column per position keeps a full matching feasible. Every position is
+    # matched exactly once, so shifting all costs by 1 leaves the optimum unchanged and keeps
+    # zero-distance edges from being dropped as missing entries of the sparse matrix.
+    all_rows = np.concatenate([rows, np.arange(num_pos)])
+    all_cols = np.concatenate([cols, num_cands + np.arange(num_pos)])
+    all_costs = np.concatenate([costs, np.full(num_pos, penalty)]) + 1
+    graph = scipy.sparse.csr_matrix((all_costs, (all_rows, all_cols)), shape=(num_pos, num_cands + num_pos))
+    row_ind, col_ind = scipy.sparse.csgraph.min_weight_full_bipartite_matching(graph)
+    return _to_assignment(row_ind, col_ind, cand_ids, dists, cand_lookup, method='sparse')
+
+def dense_assignment(cand_ids: np.ndarray, dists: np.ndarray) -> Assignment:
+    '''Exact assignment with linear_sum_assignment, missing edges padded with a penalty cost.'''
+    rows, cols, costs, cand_lookup, penalty = _edge_list(cand_ids, dists)
+    num_pos, num_cands = cand_ids.shape[0], cand_lookup.shape[0]
+    cost = np.full((num_pos, num_cands + num_pos), 2 * penalty)
+    cost[rows, cols] = costs
+    cost[np.arange(num_pos), num_cands + np.arange(num_pos)] = penalty
+    row_ind, col_ind = scipy.optimize.linear_sum_assignment(cost)
+    return _to_assignment(row_ind, col_ind, cand_ids, dists, cand_lookup, method='dense')
+
+def _edge_list(cand_ids: np.ndarray, dists: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, float]:
+    '''Valid (row, compact column, cost) edges, the column -> candidate id lookup, and the cost of leaving a position empty.'''
+    valid = cand_ids >= 0
+    rows = np.nonzero(valid)[0]
+    cand_lookup, cols = np.unique(cand_ids[valid], return_inverse=True)
+    costs = dists[valid].astype(np.float64)
+
+    # keep only the cheapest edge if a candidate is listed twice for one position
+    order = np.lexsort((costs, cols, rows))
+    rows, cols, costs = rows[order], cols[order], costs[order]
+    first = np.ones(rows.shape[0], dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, costs = rows[first], cols[first], costs[first]
+
+    penalty = float(costs.max() * (cand_ids.shape[0] + 1) + 1) if costs.shape[0] else 1.0
+    return rows, cols, costs, cand_lookup, penalty
+
+def _to_assignment(row_ind: np.ndarray, col_ind: np.ndarray, cand_ids: np.ndarray, dists: np.ndarray, cand_lookup: np.ndarray, method: str) -> Assignment:
+    '''Map solved compact columns back to candidate ids and their distances.'''
+    assigned = np.full(cand_ids.shape[0], -1, dtype=np.int64)
+    assigned_dists = np.full(cand_ids.shape[0], np.inf)
+    real = col_ind < cand_lookup.shape[0]
+    assigned[row_ind[real]] = cand_lookup[col_ind[real]]
+    for pos in row_ind[real]:
+        assigned_dists[pos] = dists[pos][cand_ids[pos] == assigned[pos]].min()
+    return Assignment(cand_ids=assigned, dists=assigned_dists, method=method)
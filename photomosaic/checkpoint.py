@@ -0,0 +1,90 @@
+from __future__ import annotations
+from pathlib import Path
+import dataclasses
+import typing
+import os
+import hashlib
+import numpy as np
+
+from .grid_scores import GridScores
+from .topk import TopKAccumulator
+
+@dataclasses.dataclass
+class Checkpoint:
+    '''Scoring state of a greedy run: best distance and candidate id per position,
+        plus a cursor such that every candidate before it has been scored. fingerprint
+        identifies the candidate list and target the run was made for (see run_fingerprint).
+        If the run keeps a TopKAccumulator for refinement, its arrays are saved too.
+    '''
+    dists: np.ndarray
+    cand_ids: np.ndarray
+    cursor: int
+    num_candidates: int
+    fingerprint: str = ''
+    topk_dists: np.ndarray | None = None
+    topk_cand_ids: np.ndarray | None = None
+
+    @classmethod
+    def from_scores(cls,
+        scores: GridScores,
+        cursor: int,
+        num_candidates: int,
+        fingerprint: str = '',
+        topk: TopKAccumulator | None = None,
+    ) -> typing.Self:
+        dists, cand_ids = scores.to_arrays()
+        return cls(
+            dists=dists,
+            cand_ids=cand_ids,
+            cursor=cursor,
+            num_candidates=num_candidates,
+            fingerprint=fingerprint,
+            topk_dists=topk.dists if topk is not None else None,
+            topk_cand_ids=topk.cand_ids if topk is not None else None,
+        )
+
+    def restore_topk(self, topk: TopKAccumulator) -> bool:
+        '''Copy the saved top-k arrays into topk; False if none were saved or their shape differs.'''
+        if self.topk_dists is None or self.topk_dists.shape != topk.dists.shape:
+            return False
+        topk.dists, topk.cand_ids = self.topk_dists.copy(), self.topk_cand_ids.copy()
+        return True
+
+    def save(self, path: Path) -> None:
+        '''Write to a temporary file and atomically rename, so a crash never leaves a partial checkpoint.'''
+        tmp_path = Path(path).with_suffix('.tmp')
+        with tmp_path.open('wb') as f:
+            topk = dict(topk_dists=self.topk_dists, topk_cand_ids=self.topk_cand_ids) if self.topk_dists is not None else dict()
+            np.savez(f, dists=self.dists, cand_ids=self.cand_ids, cursor=self.cursor, num_candidates=self.num_candidates, fingerprint=self.fingerprint, **topk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> typing.Self | None:
+        '''Load a checkpoint, or None if there is none at path.'''
+        if not Path(path).exists():
+            return None
+        with np.load(path) as data:
+            return cls(
+                dists=data['dists'],
+                cand_ids=data['cand_ids'],
+                cursor=int(data['cursor']),
+                num_candidates=int(data['num_candidates']),
+                fingerprint=str(data['fingerprint']) if 'fingerprint' in data else '',
+                topk_dists=data['topk_dists'] if 'topk_dists' in data else None,
+                topk_cand_ids=data['topk_cand_ids'] if 'topk_cand_ids' in data else None,
+            )
+
+def run_fingerprint(cand_paths: typing.Iterable[Path | str], target: np.ndarray) -> str:
+    '''Hash of the ordered candidate paths and the target tiles, so a checkpoint is only
+        resumed by the run it was made for (a reordered or edited candidate list would
+        otherwise map checkpointed candidate ids to the wrong files).
+    '''
+    h = hashlib.sha1()
+    for path in cand_paths:
+        h.update(str(path).encode())
+        h.update(b'\0')
+    h.update(str((target.shape, target.dtype.str)).encode())
+    h.update(np.ascontiguousarray(target).data)
+    return h.hexdigest()
@@ -0,0 +1,20 @@
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+import PIL.Image
+
+from imagecore import instrument
+
+def read_thumbnail(path: Path, size: tuple[int, int]) -> np.ndarray:
+    '''Decode an image file straight to a (h, w, 3) uint8 array of the given (height, width).
+        JPEGs are downscaled in the DCT domain (draft mode) while decoding, and the image stays
+        uint8 until it has been resized, so no full-resolution float copy is ever made.
+    '''
+    h, w = size
+    with instrument.stage('read_thumbnail') as stage, PIL.Image.open(path) as pim:
+        if stage.enabled:
+            stage.add_bytes(Path(path).stat().st_size)
+        pim.draft('RGB', (w, h))
+        pim = pim.convert('RGB')
+        pim = pim.resize((w, h), resample=PIL.Image.Resampling.LANCZOS, reducing_gap=2.0)
+        return np.asarray(pim)
@@ -0,0 +1,195 @@
+from __future__ import annotations
+from pathlib import Path
+import dataclasses
+import typing
+import numpy as np
+
+from imagecore import instrument
+
+from .distances import gradient_stack, as_feature_dtype, distance_dtype, euclid_rows, GradientMode, UINT8_SCALE
+
+if typing.TYPE_CHECKING:
+    from .image_grid import ImageGrid
+
+@dataclasses.dataclass
+class FeatureMatrix:
+    '''Flattened pixel and gradient features, one row per image, with cached squared norms.
+        Features are float64, float32 or uint8 (see distances.as_feature_dtype).
+    '''
+    pixels: np.ndarray
+    gradients: np.ndarray
+    pixel_sqnorms: np.ndarray
+    gradient_sqnorms: np.ndarray
+
+    @classmethod
+    def from_stack(cls, ims: np.ndarray, gradient: GradientMode = 'volume', dtype: np.dtype = np.float64) -> typing.Self:
+        '''Compute features for an (N, h, w, c) stack of images.'''
+        return cls.from_arrays(ims, gradient_stack(ims, mode=gradient, dtype=dtype), dtype=dtype)
+
+    @classmethod
+    def from_arrays(cls, ims: np.ndarray, gradients: np.ndarray, dtype: np.dtype = np.float64) -> typing.Self:
+        '''Build from image and gradient stacks that were already computed.'''
+        pixels = as_feature_dtype(ims.reshape(ims.shape[0], -1), dtype)
+        grads = as_feature_dtype(gradients.reshape(gradients.shape[0], -1), dtype)
+        norm_dtype = np.int64 if pixels.dtype == np.uint8 else None
+        return cls(
+            pixels=pixels,
+            gradients=grads,
+            pixel_sqnorms=np.einsum('ij,ij->i', pixels, pixels, dtype=norm_dtype),
+            gradient_sqnorms=np.einsum('ij,ij->i', grads, grads, dtype=norm_dtype),
+        )
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.pixels.dtype
+
+    def __len__(self) -> int:
+        return self.pixels.shape[0]
+
+
+@dataclasses.dataclass
+class DistanceMatrixEngine:
+    '''Computes the (N candidates x P positions) composite distance matrix with BLAS.
+        Each euclidean term is expanded as |a|^2 + |b|^2 - 2a.b, so a chunk of candidates
+        against every tile is one matrix multiply per feature type. dtype selects float64,
+        float32 (sgemm, float32 output) or uint8 (exact integer kernel, float32 output).
+    '''
+    targets: FeatureMatrix
+    gradient: GradientMode = 'volume'
+    chunk_size: int | None = None
+    cache_bytes: int = 8 * 2**20 # working-set target used when chunk_size is None
+    dtype: np.dtype = np.float64
+
+    @classmethod
+    def from_grid(cls, grid: ImageGrid, **kwargs) -> typing.Self:
+        '''Create an engine whose targets are the tiles of an ImageGrid.'''
+        tiles, tile_gradients = grid.get_tile_features()
+        kwargs.setdefault('dtype', grid.dtype)
+        return cls.from_tiles(tiles, gradient=grid.gradient, tile_gradients=tile_gradients, **kwargs)
+
+    @classmethod
+    def from_tiles(cls,
+        tiles: np.ndarray,
+        gradient: GradientMode = 'volume',
+        tile_gradients: np.ndarray | None = None,
+        **kwargs
+    ) -> typing.Self:
+        '''Create an engine from a (P, h, w, c) stack of target tiles.'''
+        dtype = kwargs.get('dtype', np.float64)
+        if tile_gradients is None:
+            tile_gradients = gradient_stack(tiles, mode=gradient, dtype=dtype)
+        return cls(
+            targets=FeatureMatrix.from_arrays(tiles, tile_gradients, dtype=dtype),
+            gradient=gradient,
+            **kwargs
+        )
+
+    @property
+    def num_positions(self) -> int:
+        return len(self.targets)
+
+    @property
+    def out_dtype(self) -> np.dtype:
+        return distance_dtype(self.dtype)
+
+    def get_chunk_size(self) -> int:
+        '''Rows per chunk: the given chunk_size, or enough to keep one chunk of features near cache_bytes.'''
+        if self.chunk_size is not None:
+            return self.chunk_size
+        row_bytes = np.dtype(self.dtype).itemsize * (self.targets.pixels.shape[1] + self.targets.gradients.shape[1]) + self.out_dtype.itemsize * self.num_positions
+        return max(1, self.cache_bytes // row_bytes)
+
+    ################ Computing ################
+    def calc(self, cands: np.ndarray, out_path: Path | None = None) -> np.ndarray:
+        '''Full distance matrix for an (N, h, w, c) candidate stack.
+            If out_path is given, the result is written to a .npy memory-mapped file instead of RAM.
+        '''
+        shape = (cands.shape[0], self.num_positions)
+        if out_path is None:
+            out = np.empty(shape, dtype=self.out_dtype)
+        else:
+            out = np.lib.format.open_memmap(str(out_path), mode='w+', dtype=self.out_dtype, shape=shape)
+        for start, block in self.iter_chunks(cands):
+            out[start:start+block.shape[0]] = block
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def iter_chunks(self, cands: np.ndarray) -> typing.Generator[tuple[int, np.ndarray]]:
+        '''Yield (start row, distance block) for consecutive chunks of candidates.'''
+        chunk_size = self.get_chunk_size()
+        for start in range(0, cands.shape[0], chunk_size):
+            yield start, self.calc_block(cands[start:start+chunk_size])
+
+    def calc_block(self, cands: np.ndarray, cand_gradients: np.ndarray | None = None) -> np.ndarray:
+        '''Distance block for a small stack of candidates.'''
+        if cand_gradients is None:
+            cand_gradients = gradient_stack(cands, mode=self.gradient, dtype=self.dtype)
+        return self.calc_features(FeatureMatrix.from_arrays(cands, cand_gradients, dtype=self.dtype))
+
+    @instrument.instrumented('engine.calc_block')
+    def calc_features(self, lib: FeatureMatrix) -> np.ndarray:
+        '''Distance block for candidates whose features were already computed.'''
+        if self.targets.dtype == np.uint8:
+            return self.calc_uint8_block(lib)
+        return (
+            euclid_from_products(lib.pixels @ self.targets.pixels.T, lib.pixel_sqnorms, self.targets.pixel_sqnorms) +
+            euclid_from_products(lib.gradients @ self.targets.gradients.T, lib.gradient_sqnorms, self.targets.gradient_sqnorms)
+        )
+
+    def calc_uint8_block(self, lib: FeatureMatrix) -> np.ndarray:
+        '''Integer-kernel distances for a block of uint8 candidates.
+            Features stay uint8 (see uint8_dots); squared distances are exact int64 and are
+            scaled like distances.euclid_rows, so results match it bit for bit.
+        '''
+        t = self.targets
+        return (
+            uint8_euclid(uint8_dots(lib.pixels, t.pixels), lib.pixel_sqnorms, t.pixel_sqnorms) +
+            uint8_euclid(uint8_dots(lib.gradients, t.gradients), lib.gradient_sqnorms, t.gradient_sqnorms)
+        )
+
+    def calc_pairs(self, lib: FeatureMatrix, cand_ids: np.ndarray) -> np.ndarray:
+        '''Exact distances for a (P, k) shortlist of candidate ids per position; -1 ids get inf.'''
+        dists = np.full(cand_ids.shape, np.inf, dtype=self.out_dtype)
+        for p in range(cand_ids.shape[0]):
+            valid = cand_ids[p] >= 0
+            ids = cand_ids[p][valid]
+            t = self.targets
+            if t.dtype == np.uint8:
+                dists[p, valid] = [self.calc_uint8(lib, i, slice(p, p+1))[0] for i in ids.tolist()]
+                continue
+            dists[p, valid] = (
+                euclid_from_products(lib.pixels[ids] @ t.pixels[p:p+1].T, lib.pixel_sqnorms[ids], t.pixel_sqnorms[p:p+1])[:, 0] +
+                euclid_from_products(lib.gradients[ids] @ t.gradients[p:p+1].T, lib.gradient_sqnorms[ids], t.gradient_sqnorms[p:p+1])[:, 0]
+            )
+        return dists
+
+    def calc_uint8(self, lib: FeatureMatrix, i: int, positions: slice) -> np.ndarray:
+        '''Integer-kernel composite distance from candidate i of lib to the targets at positions.'''
+        t = self.targets
+        return euclid_rows(t.pixels[positions], lib.pixels[i]) + euclid_rows(t.gradients[positions], lib.gradients[i])
+
+def euclid_from_products(dots: np.ndarray, a_sqnorms: np.ndarray, b_sqnorms: np.ndarray) -> np.ndarray:
+    '''Pairwise euclidean distances from a matrix of dot products and the squared row norms.'''
+    sq = a_sqnorms[:, np.newaxis] + b_sqnorms[np.newaxis, :] - 2 * dots
+    np.maximum(sq, 0, out=sq) # rounding can make near-identical pairs slightly negative
+    return np.sqrt(sq, out=sq)
+
+UINT8_DOT_SLICE = 256 # 256 * 255**2 < 2**24, so float32 sums over a slice are exact
+
+def uint8_dots(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    '''Exact int64 dot products of the uint8 rows of a and b.
+        Features are summed in slices of UINT8_DOT_SLICE columns, each widened to float32
+        only for its sgemm, so the uint8 arrays are never copied whole to a wider type.
+        numpy's integer matmul gives the same result but does not use BLAS and is ~10x slower.
+    '''
+    dots = np.zeros((a.shape[0], b.shape[0]), dtype=np.int64)
+    for start in range(0, a.shape[1], UINT8_DOT_SLICE):
+        cols = slice(start, start + UINT8_DOT_SLICE)
+        dots += (a[:, cols].astype(np.float32) @ b[:, cols].astype(np.float32).T).astype(np.int64)
+    return dots
+
+def uint8_euclid(dots: np.ndarray, a_sqnorms: np.ndarray, b_sqnorms: np.ndarray) -> np.ndarray:
+    '''float32 distances in the [0, 1] feature scale from exact integer dot products and squared norms.'''
+    sq = a_sqnorms[:, np.newaxis] + b_sqnorms[np.newaxis, :] - 2 * dots
+    return np.sqrt(sq, dtype=np.float32) / np.float32(UINT8_SCALE)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+import typing
+import skimage
+import numpy as np
+import scipy.ndimage
+
+# 'volume' matches skimage.filters.sobel on an (h, w, 3) array, which also differentiates
+# across the colour axis. 'channel' is a 2-D sobel of each colour plane and 'luminance'
+# a 2-D sobel of the grayscale image.
+GradientMode = typing.Literal['volume', 'channel', 'luminance']
+
+SOBEL_SMOOTH = np.array([0.25, 0.5, 0.25])
+SOBEL_EDGE = np.array([1.0, 0.0, -1.0])
+LUMINANCE_WEIGHTS = np.array([0.2125, 0.7154, 0.0721])
+
+# Feature dtypes: float64 (reference), float32 (half the memory bandwidth), or uint8, where
+# pixels and gradient planes are quantized to 0-255 and compared with an integer kernel.
+# Distances are always reported on the float [0, 1] scale.
+FEATURE_DTYPES = (np.float64, np.float32, np.uint8)
+UINT8_SCALE = 255
+
+def as_feature_dtype(arr: np.ndarray, dtype: np.dtype = np.float64) -> np.ndarray:
+    '''Convert images or gradient planes (float in [0, 1], or uint8) to a feature dtype.'''
+    dtype = np.dtype(dtype)
+    if dtype not in FEATURE_DTYPES:
+        raise ValueError(f'unsupported feature dtype: {dtype}')
+    if dtype == np.uint8:
+        if arr.dtype == np.uint8:
+            return arr
+        return np.rint(np.clip(arr, 0, 1) * UINT8_SCALE).astype(np.uint8)
+    if arr.dtype.kind == 'f':
+        return arr.astype(dtype, copy=False)
+    return skimage.img_as_float(arr).astype(dtype, copy=False)
+
+def accumulator_dtype(num_values: int) -> np.dtype:
+    '''Smallest integer type that holds a sum of num_values squared uint8 differences.'''
+    return np.dtype(np.int32) if num_values * UINT8_SCALE**2 < 2**31 else np.dtype(np.int64)
+
+def distance_dtype(dtype: np.dtype) -> np.dtype:
+    '''dtype of distances computed from features of the given dtype.'''
+    return np.dtype(np.float32) if np.dtype(dtype) == np.uint8 else np.dtype(dtype)
+
+def stack_images(ims: typing.Iterable[np.ndarray]) -> np.ndarray:
+    '''Stack equally-sized images into one contiguous (N, h, w, c) array.'''
+    return np.ascontiguousarray(np.stack(list(ims)))
+
+def sobel_stack(ims: np.ndarray) -> np.ndarray:
+    '''Sobel map of each image in a stack, same as calling skimage.filters.sobel on each.'''
+    return gradient_stack(ims, mode='volume')
+
+def gradient_stack(ims: np.ndarray, mode: GradientMode = 'volume', dtype: np.dtype = np.float64) -> np.ndarray:
+    '''Gradient feature planes for a whole (N, h, w, c) stack at once.
+        Output is (N, h, w, c), or (N, h, w) for luminance. Floats are computed in dtype;
+        for uint8 the planes are computed in float32 and quantized.
+    '''
+    if np.dtype(dtype) == np.uint8:
+        return as_feature_dtype(gradient_stack(ims, mode, dtype=np.float32), np.uint8)
+    ims = as_feature_dtype(ims, dtype)
+    if mode == 'volume':
+        return _sobel_magnitude(ims, axes=tuple(range(1, ims.ndim)))
+    elif mode == 'channel':
+        return _sobel_magnitude(ims, axes=(1, 2))
+    elif mode == 'luminance':
+        return _sobel_magnitude(ims @ LUMINANCE_WEIGHTS.astype(ims.dtype), axes=(1, 2))
+    raise ValueError(f'unknown gradient mode: {mode}')
+
+def _sobel_magnitude(ims: np.ndarray, axes: tuple[int, ...]) -> np.ndarray:
+    '''Separable sobel magnitude over the given axes, as in skimage's nd edge filter.'''
+    out = np.zeros_like(ims)
+    for edge_axis in axes:
+        ax_out = scipy.ndimage.convolve1d(ims, SOBEL_EDGE.astype(ims.dtype), axis=edge_axis, mode='reflect')
+        for smooth_axis in axes:
+            if smooth_axis != edge_axis:
+                ax_out = scipy.ndimage.convolve1d(ax_out, SOBEL_SMOOTH.astype(ims.dtype), axis=smooth_axis, mode='reflect')
+        out += ax_out * ax_out
+    return np.sqrt(out) / ims.dtype.type(np.sqrt(len(axes)))
+
+def norm_rows(diff: np.ndarray) -> np.ndarray:
+    '''Frobenius norm of each item along the first axis.'''
+    flat = diff.reshape(diff.shape[0], -1)
+    return np.sqrt(np.einsum('ij,ij->i', flat, flat))
+
+def euclid_rows(stack: np.ndarray, item: np.ndarray) -> np.ndarray:
+    '''Euclidean distance from item to each item of a stack.
+        uint8 features use an integer kernel: differences in int16, squares summed in int32
+        (int64 for very large items), scaled back to the float [0, 1] range at the end.
+    '''
+    if stack.dtype == np.uint8:
+        diff = (stack.astype(np.int16) - item.astype(np.int16)).reshape(stack.shape[0], -1)
+        sq = np.einsum('ij,ij->i', diff, diff, dtype=accumulator_dtype(diff.shape[1]))
+        return np.sqrt(sq, dtype=np.float32) / np.float32(UINT8_SCALE)
+    return norm_rows(stack - item)
+
+def composit_distances(
+    tiles: np.ndarray,
+    tile_gradients: np.ndarray,
+    cand: np.ndarray,
+    cand_gradient: np.ndarray,
+) -> np.ndarray:
+    '''Composite (euclid + gradient) distance from one candidate to every tile in a stack.'''
+    return euclid_rows(tiles, cand) + euclid_rows(tile_gradients, cand_gradient)
@@ -2,8 +2,10 @@ from __future__ import annotations
 from pathlib import Path
 import dataclasses
 import typing
+import numpy as np
 
 import mediatools
+from imagecore import instrument
 
 from .image_grid import ImageGrid, GridIndex
 
@@ -11,6 +13,7 @@ from .image_grid import ImageGrid, GridIndex
 class ImageScore:
     dist: float
     image: mediatools.Image
+    cand_id: int = -1 # index of the candidate in its candidate list (-1 if unknown or empty)
 
     @classmethod
     def empty(cls) -> typing.Self:
@@ -43,14 +46,15 @@ class GridScores:
             y_slices=self.y_slices
         )
     
-    def insert_any_if_best(self, cand_img: mediatools.Image, dists: list[tuple[float,GridIndex]]) -> None:
+    @instrument.instrumented('insert_any_if_best')
+    def insert_any_if_best(self, cand_img: mediatools.Image, dists: list[tuple[float,GridIndex]], cand_id: int = -1) -> None:
         '''Check if an image is the best for a given index.'''
         for dist, grid_index in sorted(dists):
-            if self.insert_if_best(cand_img, grid_index, dist):
+            if self.insert_if_best(cand_img, grid_index, dist, cand_id=cand_id):
                 break
 
     def reduce(self, other: typing.Self) -> typing.Self:
-        '''Reduce two GridScores into one with the best scores.'''
+        '''Reduce two GridScores into one with the best scores (ties keep self's image).'''
         
         # make sure everything is good
         assert(self.x_slices == other.x_slices)
@@ -58,16 +62,22 @@ class GridScores:
         
         new_scores = self.copy()
         for i, img_score in enumerate(other.scores):
-            new_scores.insert_if_best(i, img_score.image, img_score.dist)
+            new_scores.insert_if_best(img_score.image, i, img_score.dist, cand_id=img_score.cand_id)
         return new_scores
 
-    def insert_if_best(self, cand_img: mediatools.Image, grid_index: GridIndex, dist: float) -> bool:
+    def insert_if_best(self, cand_img: mediatools.Image, grid_index: GridIndex, dist: float, cand_id: int = -1) -> bool:
         '''Check if an image is the best for a given index.'''
         if self.scores[grid_index] is None or dist < self.scores[grid_index].dist:
-            self.scores[grid_index] = ImageScore(dist=dist, image=cand_img)
+            self.scores[grid_index] = ImageScore(dist=dist, image=cand_img, cand_id=cand_id)
             return True
         return False
 
+    def to_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        '''Per-position best distance and candidate id as arrays.'''
+        dists = np.array([s.dist for s in self.scores], dtype=np.float64)
+        cand_ids = np.array([s.cand_id for s in self.scores], dtype=np.int64)
+        return dists, cand_ids
+
     def copy(self) -> typing.Self:
         '''Copy the object.'''
         return self.__class__(
@@ -7,6 +7,10 @@ import typing
 import numpy as np
 
 import mediatools
+from imagecore import instrument
+
+from .writer import write_tile_rows
+from .distances import stack_images, gradient_stack, composit_distances, as_feature_dtype, distance_dtype, GradientMode
 
 GridIndex = int
 
@@ -16,9 +20,19 @@ class ImageGrid:
     subimages: list[mediatools.Image|None]
     x_slices: int
     y_slices: int
+    gradient: GradientMode = 'volume'
+    dtype: np.dtype = np.float64 # feature dtype used for scoring: float64, float32 or uint8
+    tiles: np.ndarray | None = dataclasses.field(default=None, repr=False)
+    tile_gradients: np.ndarray | None = dataclasses.field(default=None, repr=False)
     
     @classmethod
-    def from_image(cls, im: mediatools.Image, x_slices: int, y_slices: int) -> typing.Self:
+    def from_image(cls, 
+        im: mediatools.Image, 
+        x_slices: int, 
+        y_slices: int, 
+        gradient: GradientMode = 'volume', 
+        dtype: np.dtype = np.float64,
+    ) -> typing.Self:
         '''From an image, create a grid of subimages.'''
         h, w = im.size
         y_slice_size, x_slice_size = h // y_slices, w // x_slices
@@ -31,18 +45,35 @@ class ImageGrid:
             subimages=subimages,
             x_slices=x_slices,
             y_slices=y_slices,
+            gradient=gradient,
+            dtype=dtype,
         )
     
     def recombine(self) -> mediatools.Image:
-        '''Recombine the subimages into a single image.'''
+        '''Recombine the subimages into a single image (in memory; see write_tiled for large grids).'''
         h, w = self.subimage_size
         im = np.zeros((h*self.y_slices, w*self.x_slices, 3), dtype=np.float64)
         for i, subimage in enumerate(self.subimages):
             if subimage is not None:
                 y, x = i // self.x_slices, i % self.x_slices
-                im[y*h:(y+1)*h, x*w:(x+1)*w] = subimage.im
+                im[y*h:(y+1)*h, x*w:(x+1)*w] = skimage.img_as_float(subimage.im)
         return mediatools.Image(im)
 
+    def iter_rows(self, dtype: np.dtype = np.uint8) -> typing.Iterator[np.ndarray]:
+        '''Yield the recombined image one row of tiles at a time, top to bottom.'''
+        h, w = self.subimage_size
+        for y in range(self.y_slices):
+            row = np.zeros((h, w*self.x_slices, 3), dtype=dtype)
+            for x, subimage in enumerate(self.subimages[y*self.x_slices:(y+1)*self.x_slices]):
+                if subimage is not None:
+                    row[:, x*w:(x+1)*w] = skimage.img_as_ubyte(subimage.im) if dtype == np.uint8 else skimage.img_as_float(subimage.im)
+            yield row
+
+    def write_tiled(self, path: Path) -> None:
+        '''Stream the recombined image to a striped uint8 TIFF, holding one row of tiles at a time.'''
+        h, w = self.subimage_size
+        write_tile_rows(path, self.iter_rows(), shape=(h*self.y_slices, w*self.x_slices), row_height=h)
+
     @property
     def subimage_size(self):
         for si in self.subimages:
@@ -52,7 +83,46 @@ class ImageGrid:
 
     def calc_distances(self, cand_img: mediatools.Image) -> list[tuple[float, GridIndex]]:
         '''Calculate distances between each subimage and a candidate image.'''
-        return [(si.dist.composit(cand_img), i) for i, si in enumerate(self.subimages)]
+        return list(zip(self.calc_distance_array(cand_img).tolist(), range(len(self))))
+
+    def calc_distance_array(self, cand_img: mediatools.Image) -> np.ndarray:
+        '''Composite distance from a candidate to every subimage, indexed by GridIndex.'''
+        return self.calc_distances_batch(cand_img.im[np.newaxis])[0]
+
+    @instrument.instrumented('calc_distances')
+    def calc_distances_batch(self, 
+        cand_imgs: list[mediatools.Image] | np.ndarray, 
+        cand_gradients: np.ndarray | None = None,
+    ) -> np.ndarray:
+        '''Distance matrix of shape (candidates, positions) for a stack of candidates.
+            Pass cand_gradients from candidate_features to reuse them across grids.
+        '''
+        cands = cand_imgs if isinstance(cand_imgs, np.ndarray) else stack_images(ci.im for ci in cand_imgs)
+        if cand_gradients is None:
+            cand_gradients = gradient_stack(cands, mode=self.gradient, dtype=self.dtype)
+        cands, cand_gradients = as_feature_dtype(cands, self.dtype), as_feature_dtype(cand_gradients, self.dtype)
+        tiles, tile_gradients = self.get_tile_features()
+        dists = np.empty((cands.shape[0], len(self)), dtype=distance_dtype(self.dtype))
+        for i in range(cands.shape[0]):
+            dists[i] = composit_distances(tiles, tile_gradients, cands[i], cand_gradients[i])
+        return dists
+
+    def candidate_features(self, cand_imgs: list[mediatools.Image]) -> tuple[np.ndarray, np.ndarray]:
+        '''Stack candidates and compute their gradient planes in one batch, using this grid's gradient mode.'''
+        cands = stack_images(ci.im for ci in cand_imgs)
+        return as_feature_dtype(cands, self.dtype), gradient_stack(cands, mode=self.gradient, dtype=self.dtype)
+
+    def get_tile_features(self) -> tuple[np.ndarray, np.ndarray]:
+        '''Get the (P, h, w, 3) tile stack and its gradient planes in the grid's dtype, computing them once on first use.'''
+        if self.tiles is None:
+            if any(si is None for si in self.subimages):
+                raise ValueError('Cannot stack a grid with empty positions.')
+            tiles = stack_images(si.im for si in self.subimages)
+            self.tile_gradients = gradient_stack(tiles, mode=self.gradient, dtype=self.dtype) if self.tile_gradients is None else self.tile_gradients
+            self.tiles = as_feature_dtype(tiles, self.dtype)
+        if self.tile_gradients is None:
+            self.tile_gradients = gradient_stack(self.tiles, mode=self.gradient, dtype=self.dtype)
+        return self.tiles, self.tile_gradients
 
     def __getitem__(self, i: GridIndex | slice) -> mediatools.Image | list[mediatools.Image]:
         '''Slice into subimage list.'''
@@ -0,0 +1,141 @@
+from __future__ import annotations
+import typing
+import math
+import dataclasses
+import os
+import multiprocessing
+import multiprocessing.pool
+import numpy as np
+
+from imagecore import instrument
+
+from .topk import TopKAccumulator
+
+T = typing.TypeVar('T')
+
+def shard_items(items: typing.Sequence[T], num_shards: int) -> typing.List[typing.Sequence[T]]:
+    '''Split items into num_shards contiguous slices of near-equal size, preserving order.'''
+    size = math.ceil(len(items) / max(1, num_shards))
+    return [items[i:i+size] for i in range(0, len(items), max(1, size))]
+
+def tree_reduce(
+    items: typing.List[T],
+    reduce_func: typing.Callable[[T, T], T],
+    pool: multiprocessing.pool.Pool | None = None,
+) -> T:
+    '''Reduce items pairwise in log2(n) levels, keeping left-to-right order at every level.
+        For an associative reduce_func the result equals a sequential left fold.
+        Each level's pairs are reduced in the pool if one is given.
+    '''
+    if not len(items):
+        raise ValueError('Cannot reduce an empty list.')
+    while len(items) > 1:
+        pairs = [(items[i], items[i+1]) for i in range(0, len(items) - 1, 2)]
+        map_func = pool.starmap if pool is not None else (lambda f, it: [f(*a) for a in it])
+        reduced = list(map_func(reduce_func, pairs))
+        if len(items) % 2:
+            reduced.append(items[-1])
+        items = reduced
+    return items[0]
+
+@dataclasses.dataclass
+class CandidateLists:
+    '''Each candidate's k nearest positions, in the order greedy insertion tries them:
+        ascending distance, ties by position. Rows are candidates in input order.
+    '''
+    dists: np.ndarray # (n, k)
+    positions: np.ndarray # (n, k) int64
+    topk: TopKAccumulator | None = dataclasses.field(default=None, repr=False) # per-position best over these candidates, ids from 0
+
+    @classmethod
+    def from_block(cls, dist_block: np.ndarray, k: int) -> CandidateLists:
+        '''From an (n candidates x P positions) distance block.'''
+        order = np.argsort(dist_block, axis=1, kind='stable')[:, :k]
+        return cls(dists=np.take_along_axis(dist_block, order, axis=1), positions=order.astype(np.int64))
+
+    @classmethod
+    def concat(cls, lists: typing.Sequence[CandidateLists]) -> CandidateLists:
+        return cls(dists=np.concatenate([l.dists for l in lists]), positions=np.concatenate([l.positions for l in lists]))
+
+    def __len__(self) -> int:
+        return self.dists.shape[0]
+
+def replay_greedy(
+    lists: CandidateLists,
+    num_positions: int,
+    row_func: typing.Callable[[int], np.ndarray] | None = None,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Sequential greedy insertion (as GridScores.insert_any_if_best) over candidates in order:
+        each takes the first position in its list it beats, displacing the previous holder for good.
+        A candidate that beats none of its k positions could still beat a position further down
+        its full list if some position's best exceeds its k-th distance; only then is
+        row_func(candidate id) called for its full distance row, so the result is exact.
+        Returns per-position (dists, cand_ids), as GridScores.to_arrays.
+    '''
+    best = [math.inf] * num_positions
+    owner = [-1] * num_positions
+    worst = math.inf # max(best), recomputed only when the worst position improves
+    k = lists.dists.shape[1]
+    for c, (dists, positions) in enumerate(zip(lists.dists.tolist(), lists.positions.tolist())):
+        previous = place(c, zip(dists, positions), best, owner)
+        if previous is None and k < num_positions and dists[-1] < worst:
+            if row_func is None:
+                raise ValueError(f'candidate {c} may place beyond its top {k} positions; pass row_func to score it fully.')
+            row = np.asarray(row_func(c))
+            order = np.argsort(row, kind='stable')[k:]
+            previous = place(c, zip(row[order].tolist(), order.tolist()), best, owner)
+        if previous is not None and previous == worst:
+            worst = max(best)
+    return np.array(best, dtype=np.float64), np.array(owner, dtype=np.int64)
+
+def place(cand_id: int, entries: typing.Iterable[typing.Tuple[float, int]], best: typing.List[float], owner: typing.List[int]) -> float | None:
+    '''Insert at the first (dist, position) entry that beats the current best there.
+        Returns the replaced best distance, or None if the candidate was not placed.
+    '''
+    for dist, pos in entries:
+        if dist < best[pos]:
+            previous = best[pos]
+            best[pos], owner[pos] = dist, cand_id
+            return previous
+    return None
+
+def greedy_optimize_sharded(
+    shard_func: typing.Callable[[int, typing.Sequence[T]], CandidateLists],
+    cand_files: typing.Sequence[T],
+    num_positions: int,
+    row_func: typing.Callable[[int], np.ndarray] | None = None,
+    processes: int = os.cpu_count(),
+    num_shards: int | None = None,
+    topk: TopKAccumulator | None = None,
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Score contiguous shards of cand_files in a process pool, then replay greedy insertion
+        over all candidates in order in this process. shard_func(shard_index, shard) returns the
+        shard's CandidateLists and must be picklable (a module-level function or partial);
+        row_func(cand_id) gives a full distance row for the rare candidate that needs one.
+        Distance computation is the parallel part; the replay moves only (n, k) arrays between
+        processes and gives the same placement as a single-process greedy run over cand_files.
+        If topk is given, every shard must also return its own top-k lists (CandidateLists.topk);
+        they are merged into topk in shard order, so it ends up as if every candidate had been
+        pushed into it in order. Returns per-position (dists, cand_ids) with ids indexing cand_files.
+    '''
+    shards = shard_items(cand_files, num_shards if num_shards is not None else processes)
+    if processes == 1:
+        results = [shard_func(i, s) for i, s in enumerate(shards)]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = list(instrument.map_merged(pool.starmap, shard_func, enumerate(shards)))
+    if topk is not None:
+        merge_shard_topk(topk, results)
+    return replay_greedy(CandidateLists.concat(results), num_positions, row_func=row_func)
+
+def merge_shard_topk(topk: TopKAccumulator, results: typing.Sequence[CandidateLists]) -> None:
+    '''Merge each shard's top-k lists, offset to global candidate ids, into topk in place.'''
+    offset, shard_topks = 0, list()
+    for lists in results:
+        if lists.topk is None:
+            raise ValueError('topk was requested but a shard returned no top-k lists.')
+        cand_ids = np.where(lists.topk.cand_ids >= 0, lists.topk.cand_ids + offset, -1)
+        shard_topks.append(TopKAccumulator(dists=lists.topk.dists, cand_ids=cand_ids))
+        offset += len(lists)
+    merged = tree_reduce([topk] + shard_topks, TopKAccumulator.merge)
+    topk.dists, topk.cand_ids = merged.dists, merged.cand_ids
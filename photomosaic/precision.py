@@ -0,0 +1,60 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import time
+import numpy as np
+
+from .distances import GradientMode
+from .distance_matrix import DistanceMatrixEngine
+from .ann import topk_indices, recall_at_k
+
+@dataclasses.dataclass
+class PrecisionReport:
+    '''How closely distances computed at a lower precision rank candidates like float64 does.'''
+    dtype: str
+    k: int
+    top1_agreement: float # fraction of positions whose best candidate is unchanged
+    topk_recall: float # mean overlap of each position's top-k candidates
+    max_abs_error: float
+    seconds: float
+    reference_seconds: float
+
+    @property
+    def speedup(self) -> float:
+        return self.reference_seconds / self.seconds
+
+    def __str__(self) -> str:
+        return (f'{self.dtype:>8}: top-1 agreement {self.top1_agreement:.4f}, recall@{self.k} {self.topk_recall:.4f}, '
+            f'max error {self.max_abs_error:.2e}, {self.seconds:.3f}s ({self.speedup:.2f}x float64)')
+
+def evaluate_precision(
+    tiles: np.ndarray,
+    cands: np.ndarray,
+    dtypes: typing.Sequence[np.dtype] = (np.float32, np.uint8),
+    k: int = 10,
+    gradient: GradientMode = 'volume',
+) -> typing.List[PrecisionReport]:
+    '''Score cands against tiles at float64 and at each dtype, and compare the per-position rankings.'''
+    def timed_calc(dtype: np.dtype) -> typing.Tuple[np.ndarray, float]:
+        engine = DistanceMatrixEngine.from_tiles(tiles, gradient=gradient, dtype=dtype)
+        start = time.perf_counter()
+        dists = engine.calc(cands)
+        return dists, time.perf_counter() - start
+
+    reference, reference_seconds = timed_calc(np.float64)
+    ref_topk = np.stack([topk_indices(col, k) for col in reference.T])
+
+    reports = list()
+    for dtype in dtypes:
+        dists, seconds = timed_calc(dtype)
+        topk = np.stack([topk_indices(col, k) for col in dists.T])
+        reports.append(PrecisionReport(
+            dtype=np.dtype(dtype).name,
+            k=k,
+            top1_agreement=float(np.mean(topk[:, 0] == ref_topk[:, 0])),
+            topk_recall=recall_at_k(topk, ref_topk),
+            max_abs_error=float(np.abs(dists - reference).max()),
+            seconds=seconds,
+            reference_seconds=reference_seconds,
+        ))
+    return reports
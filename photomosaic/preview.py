@@ -0,0 +1,71 @@
+from __future__ import annotations
+from pathlib import Path
+import dataclasses
+import typing
+import time
+import os
+import numpy as np
+import skimage
+from PIL import Image
+
+import mediatools
+
+from .grid_scores import GridScores
+
+@dataclasses.dataclass
+class PreviewRenderer:
+    '''Keeps a persistent uint8 preview of the current best grid and writes it on a wall-clock interval.
+        Only tiles whose best image changed since the last update are converted and blitted,
+        and the PNG is encoded with a fast (low) compression level.
+    '''
+    path: Path
+    canvas: np.ndarray = dataclasses.field(repr=False)
+    tile_size: typing.Tuple[int, int]
+    x_slices: int
+    interval_seconds: float = 2.0
+    compress_level: int = 1
+    shown: typing.List[mediatools.Image | None] = dataclasses.field(default=None, repr=False)
+    last_write: float = float('-inf')
+    dirty: bool = False
+
+    @classmethod
+    def from_grid_size(cls,
+        path: Path,
+        tile_size: typing.Tuple[int, int],
+        x_slices: int,
+        y_slices: int,
+        **kwargs
+    ) -> typing.Self:
+        h, w = tile_size
+        return cls(
+            path=Path(path),
+            canvas=np.zeros((h*y_slices, w*x_slices, 3), dtype=np.uint8),
+            tile_size=(h, w),
+            x_slices=x_slices,
+            shown=[None] * (x_slices * y_slices),
+            **kwargs
+        )
+
+    def update(self, scores: GridScores, force: bool = False) -> bool:
+        '''Blit changed tiles, then write if the interval has elapsed (or force). Returns True if written.'''
+        h, w = self.tile_size
+        for i, score in enumerate(scores.scores):
+            if score.image is not None and score.image is not self.shown[i]:
+                y, x = i // self.x_slices, i % self.x_slices
+                self.canvas[y*h:(y+1)*h, x*w:(x+1)*w] = skimage.img_as_ubyte(score.image.im)
+                self.shown[i] = score.image
+                self.dirty = True
+
+        now = time.monotonic()
+        if self.dirty and (force or now - self.last_write >= self.interval_seconds):
+            self.write()
+            self.last_write = now
+            return True
+        return False
+
+    def write(self) -> None:
+        '''Encode the canvas and atomically replace the preview file, so viewers never see a partial PNG.'''
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        Image.fromarray(self.canvas).save(tmp_path, format='PNG', compress_level=self.compress_level)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
@@ -0,0 +1,59 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import time
+import collections
+import concurrent.futures
+
+T = typing.TypeVar('T')
+R = typing.TypeVar('R')
+
+@dataclasses.dataclass
+class ReadAheadStats:
+    '''How long the consumer was blocked waiting on loads.'''
+    wait_seconds: float = 0.0
+    loaded: int = 0
+    failed: int = 0
+
+    def __str__(self) -> str:
+        return f'read-ahead: {self.loaded} loaded, {self.failed} failed, consumer waited {self.wait_seconds:.2f}s on I/O'
+
+@dataclasses.dataclass
+class ReadAhead(typing.Generic[T, R]):
+    '''Load (read, decode, resize) upcoming items in a thread pool while the consumer works.
+        At most depth loads are queued ahead of the consumer, and results are yielded in input
+        order. Items whose load raises one of skip_errors are dropped and counted in stats.
+    '''
+    items: typing.Iterable[T]
+    load_func: typing.Callable[[T], R]
+    depth: int = 16
+    threads: int = 4
+    skip_errors: typing.Tuple[typing.Type[BaseException], ...] = (OSError, ValueError)
+    stats: ReadAheadStats = dataclasses.field(default_factory=ReadAheadStats)
+
+    def __iter__(self) -> typing.Iterator[typing.Tuple[T, R]]:
+        '''Yield (item, loaded result) pairs.'''
+        it = iter(self.items)
+        pending: typing.Deque[typing.Tuple[T, concurrent.futures.Future]] = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+            def fill():
+                while len(pending) < self.depth:
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        return
+                    pending.append((item, executor.submit(self.load_func, item)))
+            fill()
+            while len(pending):
+                item, future = pending.popleft()
+                start = time.perf_counter()
+                try:
+                    result = future.result()
+                except self.skip_errors:
+                    self.stats.failed += 1
+                    continue
+                finally:
+                    self.stats.wait_seconds += time.perf_counter() - start
+                    fill()
+                self.stats.loaded += 1
+                yield item, result
@@ -0,0 +1,184 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import random
+import math
+import time
+import numpy as np
+
+from .assignment import Assignment
+from .grid_scores import GridScores
+from .topk import select_topk
+
+@dataclasses.dataclass
+class DistanceLookup:
+    '''Constant-time distance from a candidate to a position, plus each position's shortlist
+        of candidates to propose. With only top-k lists, unlisted pairs are unknown (inf) and
+        moves that need them are rejected; a dense (candidates x positions) matrix knows every pair.
+    '''
+    shortlist: typing.List[typing.List[int]] # candidate ids per position, -1 padding
+    known: typing.List[typing.Dict[int, float]] # cand_id -> distance per position
+    matrix: np.ndarray | None = None
+
+    @classmethod
+    def from_topk(cls, cand_ids: np.ndarray, dists: np.ndarray) -> DistanceLookup:
+        '''From (P, k) top-k arrays, e.g. a TopKAccumulator.'''
+        known = [{c: d for c, d in zip(row_ids, row_dists) if c >= 0} for row_ids, row_dists in zip(cand_ids.tolist(), dists.tolist())]
+        return cls(shortlist=cand_ids.tolist(), known=known)
+
+    @classmethod
+    def from_matrix(cls, dists: np.ndarray, k: int = 10) -> DistanceLookup:
+        '''From a dense (candidates x positions) matrix, e.g. DistanceMatrixEngine.calc output.'''
+        ids = np.broadcast_to(np.arange(dists.shape[0], dtype=np.int64), (dists.shape[1], dists.shape[0]))
+        _, top_ids = select_topk(dists.T, ids, min(k, dists.shape[0]))
+        return cls(shortlist=top_ids.tolist(), known=[dict() for _ in range(dists.shape[1])], matrix=dists)
+
+    def add(self, cand_ids: np.ndarray, dists: np.ndarray) -> None:
+        '''Record known distances of one candidate per position (e.g. the starting assignment).'''
+        for pos, (c, d) in enumerate(zip(cand_ids.tolist(), dists.tolist())):
+            if c >= 0:
+                self.known[pos][c] = d
+
+    def dist(self, cand_id: int, pos: int) -> float:
+        if self.matrix is not None:
+            return float(self.matrix[cand_id, pos])
+        return self.known[pos].get(cand_id, math.inf)
+
+@dataclasses.dataclass
+class TrajectoryPoint:
+    seconds: float
+    iterations: int
+    temperature: float
+    cost: float
+    best_cost: float
+
+@dataclasses.dataclass
+class RefineReport:
+    '''Refined assignment with the cost trajectory of the search that produced it.
+        Every cost (initial, final and trajectory) is the search objective: the summed distance
+        of assigned positions plus empty_cost for each empty one, so filling a position counts
+        as the improvement it is. assignment.total_cost is the assigned-only sum.
+    '''
+    assignment: Assignment
+    initial_cost: float
+    final_cost: float
+    empty_cost: float
+    initial_unassigned: int
+    iterations: int
+    accepted: int
+    seconds: float
+    trajectory: typing.List[TrajectoryPoint]
+
+    @property
+    def improvement(self) -> float:
+        '''Fraction of the starting cost removed by refinement.'''
+        return 1 - self.final_cost / self.initial_cost if self.initial_cost > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f'refined cost {self.initial_cost:.4f} -> {self.final_cost:.4f} ({100*self.improvement:.2f}% lower), '
+            f'empty positions {self.initial_unassigned} -> {self.assignment.num_unassigned}, '
+            f'{self.accepted}/{self.iterations} moves accepted in {self.seconds:.2f}s')
+
+def refine_scores(scores: GridScores, lookup: DistanceLookup, **anneal_kwargs) -> RefineReport:
+    '''Anneal the assignment held in greedy GridScores (candidate ids must be set).'''
+    dists, cand_ids = scores.to_arrays()
+    lookup.add(cand_ids, dists)
+    return anneal(cand_ids, lookup, **anneal_kwargs)
+
+def anneal(
+    cand_ids: np.ndarray,
+    lookup: DistanceLookup,
+    time_budget: float = 5.0,
+    temperature: float | None = None,
+    final_temperature: float | None = None,
+    seed: int = 0,
+    report_seconds: float = 0.1,
+) -> RefineReport:
+    '''Simulated annealing over a one-to-one assignment (cand_ids per position, -1 empty).
+        Each move picks a position and a candidate from its shortlist: an unused candidate
+        replaces the current one, and a placed candidate swaps positions with it (a 2-opt
+        swap). Deltas are two or four lookups, so a move costs O(1) regardless of grid size.
+        The temperature cools geometrically from temperature (default: the median uphill
+        delta of sampled moves) to final_temperature (default 1/1000 of it) over time_budget
+        seconds. temperature=0 accepts only improving moves. Returns the best assignment seen
+        at the 1000-move checkpoints, which is at least as good as the starting one.
+    '''
+    rng = random.Random(seed)
+    assigned = cand_ids.tolist()
+    num_pos = len(assigned)
+    where = {c: p for p, c in enumerate(assigned) if c >= 0}
+    cur = [lookup.dist(c, p) if c >= 0 else math.inf for p, c in enumerate(assigned)]
+    finite = [d for d in cur if d < math.inf]
+    empty_cost = 2 * max(finite) if len(finite) else 1.0 # empty positions are worth filling
+    cur = [d if d < math.inf else empty_cost for d in cur]
+    shortlist, dist = lookup.shortlist, lookup.dist
+
+    def propose() -> typing.Tuple[int, int, int | None, float]:
+        '''Random move as (position, incoming candidate, its current position or None, delta).'''
+        i = rng.randrange(num_pos)
+        c = shortlist[i][rng.randrange(len(shortlist[i]))]
+        if c < 0 or c == assigned[i]:
+            return i, c, None, math.inf
+        j = where.get(c)
+        if j is None:
+            return i, c, None, dist(c, i) - cur[i]
+        if assigned[i] < 0:
+            return i, c, j, math.inf # would only move the empty position to j
+        return i, c, j, dist(c, i) + dist(assigned[i], j) - cur[i] - cur[j]
+
+    if temperature is None:
+        uphill = [d for d in (propose()[3] for _ in range(1000)) if 0 < d < math.inf]
+        temperature = float(np.median(uphill)) if len(uphill) else 0.0
+    final_temperature = temperature / 1000 if final_temperature is None else final_temperature
+
+    initial_unassigned = sum(c < 0 for c in assigned)
+    cost = best_cost = initial_cost = float(sum(cur))
+    best = list(assigned)
+    iterations = accepted = 0
+    trajectory = [TrajectoryPoint(0.0, 0, temperature, cost, best_cost)]
+    start = last_report = time.monotonic()
+    temp = temperature
+    while True:
+        # clock, temperature and the best snapshot only change every 1000 moves
+        if iterations % 1000 == 0:
+            if cost < best_cost:
+                best, best_cost = list(assigned), cost
+            now = time.monotonic()
+            elapsed = now - start
+            if elapsed >= time_budget:
+                break
+            temp = temperature * (final_temperature / temperature) ** (elapsed / time_budget) if temperature > 0 and final_temperature > 0 else 0.0
+            if now - last_report >= report_seconds:
+                trajectory.append(TrajectoryPoint(elapsed, iterations, temp, cost, best_cost))
+                last_report = now
+        iterations += 1
+
+        i, c, j, delta = propose()
+        if not (delta < 0 or (temp > 0 and delta < math.inf and rng.random() < math.exp(-delta / temp))):
+            continue
+        accepted += 1
+        old = assigned[i]
+        if j is None:
+            where.pop(old, None)
+        else:
+            assigned[j], where[old] = old, j
+            cur[j] = dist(old, j)
+        assigned[i], where[c] = c, i
+        cur[i] = dist(c, i)
+        cost += delta
+
+    seconds = time.monotonic() - start
+    trajectory.append(TrajectoryPoint(seconds, iterations, temp, cost, best_cost))
+    best_ids = np.array(best, dtype=np.int64)
+    best_dists = np.array([dist(c, p) if c >= 0 else math.inf for p, c in enumerate(best)])
+    return RefineReport(
+        assignment=Assignment(cand_ids=best_ids, dists=best_dists, method='anneal'),
+        initial_cost=initial_cost,
+        final_cost=float(sum(d if c >= 0 else empty_cost for c, d in zip(best, best_dists.tolist()))),
+        empty_cost=empty_cost,
+        initial_unassigned=initial_unassigned,
+        iterations=iterations,
+        accepted=accepted,
+        seconds=seconds,
+        trajectory=trajectory,
+    )
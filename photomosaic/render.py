@@ -0,0 +1,84 @@
+from __future__ import annotations
+from pathlib import Path
+import typing
+import functools
+import os
+import multiprocessing
+import numpy as np
+
+from imagecore import instrument
+
+from .decode import read_thumbnail
+from .writer import write_tile_rows
+
+
+def read_tile(path: Path | None, tile_size: typing.Tuple[int, int]) -> np.ndarray | None:
+    '''Decode one original at output tile size; None for empty positions.'''
+    if path is None:
+        return None
+    return read_thumbnail(path, tile_size)
+
+def render_tiles(
+    paths: typing.Sequence[Path | None],
+    x_slices: int,
+    y_slices: int,
+    tile_size: typing.Tuple[int, int],
+    processes: int = os.cpu_count(),
+    chunksize: int = 4,
+) -> np.ndarray:
+    '''Render a uint8 mosaic by re-reading the chosen originals at tile_size, independent of the
+        resolution used for matching. paths[i] is the original for grid position i (row-major,
+        None leaves the tile black). Originals are decoded in a process pool with draft-mode
+        downscaling, and each tile is written into the output as soon as it arrives.
+    '''
+    check_paths(paths, x_slices, y_slices)
+    h, w = tile_size
+    out = np.zeros((h*y_slices, w*x_slices, 3), dtype=np.uint8)
+    read_func = functools.partial(read_tile, tile_size=(h, w))
+
+    def place(tiles: typing.Iterable[np.ndarray | None]) -> None:
+        for i, tile in enumerate(tiles):
+            if tile is not None:
+                y, x = i // x_slices, i % x_slices
+                out[y*h:(y+1)*h, x*w:(x+1)*w] = tile
+
+    if processes == 1:
+        place(map(read_func, paths))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            place(instrument.map_merged(functools.partial(pool.imap, chunksize=chunksize), read_func, paths))
+    return out
+
+def render_tiles_to_file(
+    path: Path,
+    paths: typing.Sequence[Path | None],
+    x_slices: int,
+    y_slices: int,
+    tile_size: typing.Tuple[int, int],
+    processes: int = os.cpu_count(),
+) -> None:
+    '''Like render_tiles, but stream the mosaic to a striped TIFF at path. Each row of tiles
+        is decoded in the pool, written, and dropped, so peak memory is one row of tiles
+        however large the mosaic is.
+    '''
+    check_paths(paths, x_slices, y_slices)
+    h, w = tile_size
+    read_func = functools.partial(read_tile, tile_size=(h, w))
+
+    def rows(map_func: typing.Callable) -> typing.Iterator[np.ndarray]:
+        for y in range(y_slices):
+            row = np.zeros((h, w*x_slices, 3), dtype=np.uint8)
+            for x, tile in enumerate(instrument.map_merged(map_func, read_func, paths[y*x_slices:(y+1)*x_slices])):
+                if tile is not None:
+                    row[:, x*w:(x+1)*w] = tile
+            yield row
+
+    if processes == 1:
+        write_tile_rows(path, rows(map), shape=(h*y_slices, w*x_slices), row_height=h)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            write_tile_rows(path, rows(pool.map), shape=(h*y_slices, w*x_slices), row_height=h)
+
+def check_paths(paths: typing.Sequence[Path | None], x_slices: int, y_slices: int) -> None:
+    if len(paths) != x_slices * y_slices:
+        raise ValueError(f'Expected {x_slices * y_slices} paths for a {x_slices}x{y_slices} grid, got {len(paths)}.')
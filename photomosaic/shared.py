@@ -0,0 +1,74 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import contextlib
+import numpy as np
+from multiprocessing import shared_memory
+
+from .distances import GradientMode, as_feature_dtype
+from .distance_matrix import DistanceMatrixEngine, FeatureMatrix
+
+# state installed once per pool worker by init_worker; tasks read from here instead of
+# receiving the target with every call.
+worker_state: typing.Dict[str, typing.Any] = dict()
+
+@dataclasses.dataclass(frozen=True)
+class SharedArray:
+    '''Picklable handle (name, shape, dtype) to an array in multiprocessing shared memory.'''
+    name: str
+    shape: typing.Tuple[int, ...]
+    dtype: str
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> typing.Tuple[SharedArray, shared_memory.SharedMemory]:
+        '''Copy arr into a new shared memory block. The caller owns (and must unlink) the block.'''
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        return cls(name=shm.name, shape=arr.shape, dtype=arr.dtype.str), shm
+
+    def attach(self) -> typing.Tuple[np.ndarray, shared_memory.SharedMemory]:
+        '''Zero-copy view of the shared array; keep the returned block referenced while using it.'''
+        shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf), shm
+
+@dataclasses.dataclass(frozen=True)
+class SharedGrid:
+    '''Target tiles and their gradient planes placed once in shared memory for pool workers.'''
+    tiles: SharedArray
+    tile_gradients: SharedArray
+    gradient: GradientMode
+
+    @classmethod
+    @contextlib.contextmanager
+    def share(cls, 
+        tiles: np.ndarray, 
+        tile_gradients: np.ndarray, 
+        gradient: GradientMode = 'volume', 
+        dtype: np.dtype = np.float64,
+    ) -> typing.Generator[SharedGrid]:
+        '''Copy features (converted to dtype) into shared memory for the duration of the context, then free them.'''
+        tiles_sa, tiles_shm = SharedArray.from_array(np.ascontiguousarray(as_feature_dtype(tiles, dtype)))
+        grads_sa, grads_shm = SharedArray.from_array(np.ascontiguousarray(as_feature_dtype(tile_gradients, dtype)))
+        try:
+            yield cls(tiles=tiles_sa, tile_gradients=grads_sa, gradient=gradient)
+        finally:
+            for shm in (tiles_shm, grads_shm):
+                shm.close()
+                shm.unlink()
+
+    def attach_engine(self, **engine_kwargs) -> DistanceMatrixEngine:
+        '''Build a distance engine on zero-copy views of the shared features, in their shared dtype.'''
+        tiles, tiles_shm = self.tiles.attach()
+        grads, grads_shm = self.tile_gradients.attach()
+        worker_state.setdefault('shared_blocks', list()).extend([tiles_shm, grads_shm])
+        engine_kwargs.setdefault('dtype', tiles.dtype)
+        return DistanceMatrixEngine(
+            targets=FeatureMatrix.from_arrays(tiles, grads, dtype=engine_kwargs['dtype']),
+            gradient=self.gradient,
+            **engine_kwargs
+        )
+
+def init_worker(shared_grid: SharedGrid, **state) -> None:
+    '''Pool initializer: attach to the shared grid once and keep per-worker state resident.'''
+    worker_state['engine'] = shared_grid.attach_engine()
+    worker_state.update(state)
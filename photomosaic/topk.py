@@ -0,0 +1,60 @@
+from __future__ import annotations
+import dataclasses
+import typing
+import numpy as np
+
+from .assignment import Assignment, AssignmentMethod, solve_assignment
+
+@dataclasses.dataclass
+class TopKAccumulator:
+    '''Streaming best-k (distance, candidate id) per grid position, kept in fixed-size arrays.
+        Rows are sorted by ascending distance; unfilled slots hold inf / -1.
+    '''
+    dists: np.ndarray
+    cand_ids: np.ndarray
+
+    @classmethod
+    def empty(cls, num_positions: int, k: int) -> typing.Self:
+        return cls(
+            dists=np.full((num_positions, k), np.inf),
+            cand_ids=np.full((num_positions, k), -1, dtype=np.int64),
+        )
+
+    @property
+    def k(self) -> int:
+        return self.dists.shape[1]
+
+    @property
+    def num_positions(self) -> int:
+        return self.dists.shape[0]
+
+    def push(self, cand_ids: np.ndarray, dist_block: np.ndarray) -> None:
+        '''Add an (n candidates x P positions) distance block for the given candidate ids.'''
+        block_ids = np.broadcast_to(np.asarray(cand_ids, dtype=np.int64), (self.num_positions, dist_block.shape[0]))
+        self.dists, self.cand_ids = select_topk(
+            np.concatenate([self.dists, dist_block.T], axis=1),
+            np.concatenate([self.cand_ids, block_ids], axis=1),
+            self.k,
+        )
+
+    def merge(self, other: TopKAccumulator) -> TopKAccumulator:
+        '''Combine with another accumulator over disjoint candidates (e.g. from another worker).'''
+        dists, cand_ids = select_topk(
+            np.concatenate([self.dists, other.dists], axis=1),
+            np.concatenate([self.cand_ids, other.cand_ids], axis=1),
+            self.k,
+        )
+        return self.__class__(dists=dists, cand_ids=cand_ids)
+
+    def assign(self, method: AssignmentMethod = 'greedy') -> Assignment:
+        '''Unique assignment of candidates to positions from the top-k lists.'''
+        return solve_assignment(self.cand_ids, self.dists, method=method)
+
+def select_topk(dists: np.ndarray, cand_ids: np.ndarray, k: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Keep the k smallest distances (and their ids) of every row, sorted ascending.'''
+    if dists.shape[1] > k:
+        part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        dists = np.take_along_axis(dists, part, axis=1)
+        cand_ids = np.take_along_axis(cand_ids, part, axis=1)
+    order = np.argsort(dists, axis=1, kind='stable')
+    return np.take_along_axis(dists, order, axis=1), np.take_along_axis(cand_ids, order, axis=1)
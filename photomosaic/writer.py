@@ -0,0 +1,44 @@
+from __future__ import annotations
+from pathlib import Path
+import typing
+import numpy as np
+import skimage
+import tifffile
+
+# classic TIFF offsets are 32-bit; leave headroom for the IFD and strip tables.
+BIGTIFF_BYTES = 2**32 - 2**25
+
+def write_tile_rows(
+    path: Path,
+    rows: typing.Iterable[np.ndarray],
+    shape: typing.Tuple[int, int],
+    row_height: int,
+) -> None:
+    '''Stream a mosaic to a striped RGB TIFF one row of tiles at a time.
+        rows yields (row_height, width, 3) arrays top to bottom (float rows are converted to
+        uint8); each becomes one uncompressed strip, so only one row is ever held in memory
+        and outputs larger than 4 GB are written as BigTIFF.
+    '''
+    h, w = shape
+    if h % row_height:
+        raise ValueError(f'Image height {h} is not a multiple of the row height {row_height}.')
+
+    def strips() -> typing.Iterator[bytes]:
+        num_rows = 0
+        for row in rows:
+            if row.shape != (row_height, w, 3):
+                raise ValueError(f'Expected a row of shape {(row_height, w, 3)}, got {row.shape}.')
+            num_rows += 1
+            yield np.ascontiguousarray(row if row.dtype == np.uint8 else skimage.img_as_ubyte(row)).tobytes()
+        if num_rows * row_height != h:
+            raise ValueError(f'Expected {h // row_height} rows, got {num_rows}.')
+
+    tifffile.imwrite(
+        path,
+        data=strips(),
+        shape=(h, w, 3),
+        dtype=np.uint8,
+        photometric='rgb',
+        rowsperstrip=row_height,
+        bigtiff=h * w * 3 >= BIGTIFF_BYTES,
+    )
@@ -12,32 +12,51 @@ random.seed(0)
 
 
 import canvas
+import photomosaic
 
 
-def find_best_chunk_thread(args) -> canvas.SubCanvasScores:
+def find_best_chunk_thread(args) -> photomosaic.TopKAccumulator:
     thread_index: int = args[0]
     width: int = args[1]
     source_images: typing.List[canvas.SourceImage] = args[2]
     target_subcanvases: typing.List[canvas.SubCanvas] = args[3]
     outfolder: pathlib.Path = args[4]
+    first_id: int = args[5] # candidate id of source_images[0]
+    k: int = args[6]
     
-    # compute distances for every source image to every target subcanvas
-    distances: typing.List[typing.Tuple[int,float,canvas.SubCanvas]] = list()
-    for si in tqdm.tqdm(source_images):
+    # keep only the best k candidates for every target subcanvas
+    engine = photomosaic.DistanceMatrixEngine.from_tiles(np.stack([sc.im for sc in target_subcanvases]))
+    topk = photomosaic.TopKAccumulator.empty(len(target_subcanvases), k)
+    for i, si in enumerate(tqdm.tqdm(source_images)):
         try:
-            si_canvas = si.retrieve_canvas()
-            for ind, target_sc in enumerate(target_subcanvases):
-                d = target_sc.dist.composit(si_canvas)
-                distances.append((ind, d, si_canvas))
-        except ValueError as e:
-            print(f'\ncouldn\'t load image {si.source_fpath}')
-        except OSError as e:
-            print(f'\ncouldn\'t load image {si.source_fpath}')
-    scs = canvas.SubCanvasScores.from_distances(distances)
-    best = scs.to_canvas(width)
+            thumb = si.retrieve_thumb()
+        except (ValueError, OSError) as e:
+            print(f'\ncouldn\'t load image {si.image_path}')
+            continue
+        topk.push(np.array([first_id + i]), engine.calc_block(thumb.im[np.newaxis]))
+    
+    assignment = topk.assign()
+    best = assignment_to_canvas(assignment, source_images, first_id, target_subcanvases, width)
     best.write_image(outfolder.joinpath(f'current_{thread_index}.png'))
     print(f'\nfinished {thread_index}')
-    return scs
+    return topk
+
+def assignment_to_canvas(
+    assignment: photomosaic.Assignment, 
+    source_images: typing.List[canvas.SourceImage], 
+    first_id: int, 
+    target_subcanvases: typing.List[canvas.SubCanvas], 
+    width: int,
+) -> canvas.Canvas:
+    '''Build the mosaic from assigned candidate ids, leaving empty positions black.'''
+    tiles = list()
+    for cand_id, sc in zip(assignment.cand_ids, target_subcanvases):
+        if cand_id >= 0:
+            si = source_images[cand_id - first_id]
+            tiles.append(canvas.Canvas(im=si.retrieve_thumb().im, fpath=si.image_path))
+        else:
+            tiles.append(canvas.Canvas(im=np.zeros(sc.im.shape), fpath=None))
+    return canvas.Canvas.from_subcanvases(tiles, width)
 
 def main():
     import coproc
@@ -69,27 +88,27 @@ def main():
             ),
             thumb_folder=pathlib.Path("data/personal_thumbs/"),
             scale_res=subtargets[0].size,
-            extensions=('png','jpg', 'JPG'),
+            extensions=('png', 'jpg'),
         )
         monitor.add_note(f'{len(imman)=}', do_print=True)
         #exit()
-        batches = [(i,width,bi,subtargets, outfolder) for i,bi in enumerate(imman.chunk_source_images(height * width * 2))]
+        chunk_size, k = height * width * 2, 10
+        batches = [(i,width,bi,subtargets, outfolder, i*chunk_size, k) for i,bi in enumerate(imman.chunk_source_images(chunk_size))]
         
         monitor.add_note(f'running {len(batches)} batches against {len(subtargets)} subcanvases')
         with multiprocessing.Pool(12) as pool:
             #monitor.update_child_processes()
             
             map_func = pool.imap_unordered
-            scss: typing.List[canvas.SubCanvasScores] = list()
+            best = photomosaic.TopKAccumulator.empty(len(subtargets), k)
             for i, r in enumerate(map_func(find_best_chunk_thread, batches)):
-                scss.append(r)
+                best = best.merge(r)
                 monitor.add_note(f'finished batch {i}')
                 
         monitor.add_note('finished all batches')
-        best = scss[0]
-        for i in range(1,len(scss)):
-            best = best.reduce_subcanvasscores(scss[i])
-        best.to_canvas(width).write_image(outfolder.joinpath(f'final.png'))
+        source_images = [si for bi in imman.chunk_source_images(chunk_size) for si in bi]
+        assignment = best.assign()
+        assignment_to_canvas(assignment, source_images, 0, subtargets, width).write_image(outfolder.joinpath(f'final.png'))
     
 
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+from __future__ import annotations
+import numpy as np
+import skimage
+
+import photomosaic
+
+def synthetic_images(n: int, size: tuple[int,int], rng: np.random.Generator) -> np.ndarray:
+    '''Smooth random textures in [0, 1], closer to photo statistics than white noise.'''
+    h, w = size
+    ims = rng.random((n, h, w, 3))
+    for i in range(n):
+        ims[i] = skimage.filters.gaussian(ims[i], sigma=rng.uniform(1, 6), channel_axis=-1)
+    mins, maxs = ims.min(axis=(1,2,3), keepdims=True), ims.max(axis=(1,2,3), keepdims=True)
+    return (ims - mins) / (maxs - mins)
+
+def main(num_tiles: int = 720, num_cands: int = 2000, size: tuple[int,int] = (64, 64), k: int = 10):
+    rng = np.random.default_rng(0)
+    tiles = synthetic_images(num_tiles, size, rng)
+    cands = synthetic_images(num_cands, size, rng)
+    print(f'{num_cands} candidates x {num_tiles} positions at {size[0]}x{size[1]}')
+    for report in photomosaic.evaluate_precision(tiles, cands, dtypes=(np.float32, np.uint8), k=k):
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -16,29 +16,71 @@ import coproc
 import doctable
 
 import canvas
+import photomosaic
 
 def new_monitor(outfolder: pathlib.Path) -> coproc.Monitor:
     return coproc.Monitor(
-        fig_path=outfolder.joinpath('best_progress.png'), 
-        log_path=outfolder.joinpath('best_progress.log'), 
-        snapshot_seconds=1, 
+        fig_path=outfolder.joinpath('best_progress.png'),
+        log_path=outfolder.joinpath('best_progress.log'),
+        snapshot_seconds=1,
         save_fig_freq=1
     )
 
-def main(preprocess_thumbs: bool = False):
+def build_mosaic(
+    db: canvas.DistanceDB,
+    target_path: pathlib.Path,
+    x_divisions: int,
+    thumb_res: typing.Tuple[int,int],
+) -> canvas.Canvas:
+    '''Build a mosaic from the stored top-k table, without scanning the full distance table.'''
+    top_ids, top_dists = db.load_top_distances(target_path)
+    assignment = photomosaic.solve_assignment(top_ids, top_dists, method='sparse')
+
+    thumb_paths = db.thumb_paths(assignment.cand_ids[assignment.cand_ids >= 0])
+    tiles, path_it = list(), iter(thumb_paths)
+    for cand_id in assignment.cand_ids:
+        im = canvas.FileImage.read_thumbnail(next(path_it), thumb_res).as_float().im if cand_id >= 0 else np.zeros(thumb_res + (3,))
+        tiles.append(canvas.Canvas(im=im, fpath=None))
+    return canvas.Canvas.from_subcanvases(tiles, x_divisions)
+
+def render_mosaic(
+    db: canvas.DistanceDB,
+    target_path: pathlib.Path,
+    x_divisions: int,
+    tile_size: typing.Tuple[int,int],
+    out_path: pathlib.Path,
+) -> None:
+    '''Same assignment as build_mosaic, rendered from the original photos at tile_size and streamed to a tiff.'''
+    top_ids, top_dists = db.load_top_distances(target_path)
+    assignment = photomosaic.solve_assignment(top_ids, top_dists, method='sparse')
+
+    thumb_paths = iter(db.thumb_paths(assignment.cand_ids[assignment.cand_ids >= 0]))
+    paths = [next(thumb_paths) if cand_id >= 0 else None for cand_id in assignment.cand_ids]
+    photomosaic.render_tiles_to_file(out_path, paths, x_divisions, len(paths) // x_divisions, tile_size)
+
+def main(preprocess_thumbs: bool = False, render_tile_size: typing.Optional[typing.Tuple[int,int]] = (512, 512)):
     outfolder = pathlib.Path("data/experimental/")
-    
+    target_path = pathlib.Path("data/targets/lofi_tiny.jpg")
+    thumb_res = (64, 64)
+    height_images = 10
+
     with new_monitor(outfolder) as monitor:
         db = canvas.DistanceDB.open(outfolder.joinpath('dists/distances.db'))
-        #print(db.q.count_by_target().df())
-        #print(db.q.select_top_distances(10).df().columns)
-        top_pos_distances = dict()
-        for dist in db.q.select_top_distances(10):
-            if dist.position not in top_pos_distances:
-                top_pos_distances[dist.position] = dist
-        
-        
-        
+
+        # same grid layout as main_record_distances
+        h,w = canvas.FileImage.read(target_path).size
+        x_divisions = int(height_images * thumb_res[0] / (h / w)) // thumb_res[1]
+
+        monitor.print(f'building mosaic from top distances')
+        best = build_mosaic(db, target_path, x_divisions, thumb_res)
+        best.write_image(outfolder.joinpath('best_image.png'))
+
+        if render_tile_size is not None:
+            monitor.print(f'rendering full-resolution mosaic')
+            render_mosaic(db, target_path, x_divisions, render_tile_size, outfolder.joinpath('best_image_full.tif'))
+        monitor.print(f'finished.')
+
+
 if __name__ == "__main__":
     main()
 
@@ -13,10 +13,13 @@ import coproc
 random.seed(0)
 
 import canvas
+import imagecore
+import photomosaic
 
 
 import tqdm
 import os
+import functools
 
 
 
@@ -29,50 +32,43 @@ def parallel_batch_and_calc_distances(
     monitor: coproc.MonitorMessengerInterface,
     batch_size: int = 10,
     processes: int = os.cpu_count(),
+    dtype: np.dtype = np.float32,
 ) -> None:
     pickle_path.mkdir(exist_ok=True, parents=True)
     db = canvas.DistanceDB.open(pickle_path.joinpath('distances.db'))
     
     monitor.print(f'batching into sizes of {batch_size}')
-    imman_batches = imman.batch_image_managers(batch_size=batch_size)
-    monitor.print(f'{len(imman_batches)=}')
+    id_ranges = [(i, min(i+batch_size, len(imman))) for i in range(0, len(imman), batch_size)]
+    monitor.print(f'{len(id_ranges)=}')
     
-    with multiprocessing.Pool(processes) as pool:
-        monitor.print(f'started {processes} processes')
-        
-        monitor.update_child_processes()
-        
-        map_func = pool.imap_unordered
-        batch_it = [(imman, grid, target_path) for imman in (imman_batches)]
-        
-        monitor.print('starting main loop')
-        for i, dists in tqdm.tqdm(enumerate(map_func(thread_calc_and_save_distances, batch_it)), total=len(batch_it)):
-            monitor.label(f'finished batch {i}')
+    # target features live in shared memory; workers attach once and keep imman resident
+    tiles = grid.tile_array()
+    with photomosaic.SharedGrid.share(tiles, photomosaic.gradient_stack(tiles, dtype=dtype), dtype=dtype) as shared_grid:
+        initializer = functools.partial(photomosaic.init_worker, shared_grid, imman=imman, dtype=dtype)
+        with multiprocessing.Pool(processes, initializer=initializer) as pool:
+            monitor.print(f'started {processes} processes')
+            
+            monitor.update_child_processes()
             
-            #with pickle_path.joinpath(f'batch_{i}.pkl').open('wb') as f:
-            #    pickle.dump(r, f)
-            with db.tab.query() as q:
-                q.insert_multi(dists, ifnotunique='REPLACE')
+            map_func = pool.imap_unordered
             
-            monitor.label(f'saved pickle {pickle_path}')
+            monitor.print('starting main loop')
+            for i, (thumb_ids, dist_matrix) in tqdm.tqdm(enumerate(imagecore.instrument.map_merged(map_func, thread_calc_distances, id_ranges)), total=len(id_ranges)):
+                monitor.label(f'finished batch {i}')
+                
+                if len(thumb_ids):
+                    thumb_paths = [imman.source_images[ti].image_path for ti in thumb_ids.tolist()]
+                    db.insert_matrix(target_path, thumb_paths, dist_matrix)
+                
+                monitor.label(f'saved pickle {pickle_path}')
     
-import pickle
-def thread_calc_and_save_distances(args):
-    imman: canvas.ImageManager = args[0]
-    grid: canvas.ImageGrid = args[1]
-    target_path: pathlib.Path = args[2]
+def thread_calc_distances(id_range: typing.Tuple[int, int]) -> typing.Tuple[np.ndarray, np.ndarray]:
+    '''Distances (float32) from the thumbs with ids in [start, stop) to every target position.'''
+    imman: canvas.ImageManager = photomosaic.worker_state['imman']
+    engine: photomosaic.DistanceMatrixEngine = photomosaic.worker_state['engine']
     
-    dists = list()
-    for thumb in imman.read_thumbs():
-        for i, si in grid.images():
-            d = thumb.dist.composit(si)
-            dists.append(canvas.Distance(
-                target_path=str(target_path),
-                position=i,
-                thumb=str(thumb.path),
-                distance=d,
-            ))
-    return dists
+    thumb_ids, thumbs = imman.read_thumb_array(*id_range, dtype=photomosaic.worker_state['dtype'])
+    return thumb_ids, engine.calc(thumbs).astype(np.float32)
 
 
 
@@ -87,8 +83,10 @@ def new_monitor(outfolder: pathlib.Path) -> coproc.Monitor:
         save_fig_freq=1
     )
 
-def main():
+def main(profile: bool = False):
     outfolder = pathlib.Path("data/experimental/")
+    if profile:
+        imagecore.instrument.enable()
     #outfolder.mkdir(exist_ok=True, parents=True)
     
     with new_monitor(outfolder) as monitor:
@@ -109,7 +107,7 @@ def main():
         grid = canvas.ImageGrid.from_fixed_subimages(target, thumb_res[0], thumb_res[1])
         monitor.print(f'grid size: {grid.size=}')
         monitor.print(f'subimage: {grid[0,0].size=}, {grid.sub_size=}')
-        monitor.print(f'full image: {grid.to_image().size=}, {grid.full_size=}')
+        monitor.print(f'full image: {grid.full_size=}')
         
                 
         monitor.label('grabbing source images')
@@ -118,11 +116,12 @@ def main():
             #source_folder=pathlib.Path("/StorageDrive/unzipped_photos/Takeout/Google Photos/V_D/"),
             thumb_folder=pathlib.Path("data/personal_thumbs2/"),
             scale_res=thumb_res,
-            extensions=('png','jpg', 'JPG'),
+            extensions=('png', 'jpg'),
         )
         
         monitor.print(f'{len(imman)=}')
-        imman = imman.filter_usable_photo(use_tqdm=True)
+        metadata_index = canvas.MetadataIndex.open(outfolder.joinpath('metadata.db'))
+        imman = imman.filter_usable_photo(metadata_index=metadata_index)
         monitor.print(f'{len(imman)=} (after filtering)')
         
         #imman = imman.clone(source_images=imman.source_images[:100])
@@ -144,6 +143,10 @@ def main():
             processes=4,
         )
         
+        if profile:
+            imagecore.instrument.write_trace(outfolder.joinpath('trace.json'))
+            monitor.print(imagecore.instrument.summary())
+        
         exit()
         batches = [(i,width,bi,subtargets, outfolder) for i,bi in enumerate(imman.chunk_source_images(height * width * 2))]
         
@@ -0,0 +1,23 @@
+from __future__ import annotations
+import pathlib
+import typing
+import numpy as np
+import pytest
+import skimage
+
+@pytest.fixture
+def synthetic_run(tmp_path: pathlib.Path) -> typing.Callable:
+    '''Factory for the inputs of a run: n synthetic library images (under tmp_path/lib) and a
+        12x8 float32 grid of a texture target. Returns (cand_files, sgrid).
+    '''
+    mediatools = pytest.importorskip('mediatools')
+    import photomosaic
+    import benchmarks
+    from benchmarks.synthetic import texture_image
+
+    def make(n: int = 40) -> typing.Tuple[list, photomosaic.ImageGrid]:
+        paths = benchmarks.generate_library(tmp_path / 'lib', n=n, size=(40, 40), sidecars=False)
+        cand_files = [mediatools.ImageFile.from_path(p) for p in paths]
+        target = mediatools.Image(skimage.img_as_float(texture_image(0, (64, 96), seed=7)))
+        return cand_files, photomosaic.ImageGrid.from_image(target, 12, 8, dtype=np.float32)
+    return make
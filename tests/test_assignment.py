@@ -0,0 +1,18 @@
+from __future__ import annotations
+import numpy as np
+import pytest
+
+pytest.importorskip('mediatools')
+
+import photomosaic
+
+def test_report_compares_per_assigned_position_when_counts_differ():
+    # greedy gives candidate 0 to position 0, leaving position 1 with no free candidate
+    cand_ids = np.array([[0, 1], [0, -1]])
+    dists = np.array([[0.1, 0.2], [0.15, np.inf]])
+    report = photomosaic.compare_with_greedy(cand_ids, dists)
+    assert report.greedy.num_assigned == 1
+    assert report.solved.num_assigned == 2
+    assert not report.same_assigned
+    assert np.isclose(report.improvement, 1 - 0.175 / 0.1)
+    assert 'assigned 2 vs 1 of 2 positions' in str(report)
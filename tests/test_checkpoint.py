@@ -0,0 +1,45 @@
+from __future__ import annotations
+import pathlib
+import numpy as np
+import pytest
+
+pytest.importorskip('mediatools')
+
+import photomosaic
+import main
+
+@pytest.fixture
+def run(synthetic_run, tmp_path: pathlib.Path):
+    return *synthetic_run(40), tmp_path
+
+def test_no_checkpoint_by_default(run):
+    cand_files, sgrid, outfolder = run
+    main.greedy_optimize_thread(0, cand_files, sgrid, outfolder)
+    assert not outfolder.joinpath('checkpoint_0.npz').exists()
+
+def test_resume_requires_same_candidates(run):
+    cand_files, sgrid, outfolder = run
+    main.greedy_optimize_thread(0, cand_files, sgrid, outfolder, checkpoint_seconds=0.0)
+    checkpoint = photomosaic.Checkpoint.load(outfolder.joinpath('checkpoint_0.npz'))
+    assert checkpoint.cursor == len(cand_files)
+
+    fingerprint = photomosaic.run_fingerprint((cf.path for cf in cand_files), sgrid.get_tile_features()[0])
+    assert checkpoint.fingerprint == fingerprint
+    load_func = lambda cf: main.read_transform_img(cf, sgrid.subimage_size, sgrid.dtype)
+    path = outfolder.joinpath('checkpoint_0.npz')
+    assert main.restore_checkpoint(path, cand_files, sgrid, load_func, fingerprint)[1] == len(cand_files)
+
+    # same length, different order: checkpointed cand_ids would point at the wrong files
+    shuffled = cand_files[::-1]
+    other = photomosaic.run_fingerprint((cf.path for cf in shuffled), sgrid.get_tile_features()[0])
+    assert main.restore_checkpoint(path, shuffled, sgrid, load_func, other) == (None, 0)
+
+def test_resume_restores_topk(run):
+    cand_files, sgrid, outfolder = run
+    topk = photomosaic.TopKAccumulator.empty(len(sgrid), 4)
+    main.greedy_optimize_thread(0, cand_files, sgrid, outfolder, checkpoint_seconds=0.0, topk=topk)
+
+    resumed = photomosaic.TopKAccumulator.empty(len(sgrid), 4)
+    main.greedy_optimize_thread(0, cand_files, sgrid, outfolder, resume=True, topk=resumed)
+    assert np.array_equal(resumed.cand_ids, topk.cand_ids)
+    assert np.array_equal(resumed.dists, topk.dists)
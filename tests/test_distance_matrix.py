@@ -0,0 +1,18 @@
+from __future__ import annotations
+import numpy as np
+import pytest
+
+pytest.importorskip('mediatools')
+
+import photomosaic
+
+def test_uint8_engine_matches_integer_kernel():
+    rng = np.random.default_rng(0)
+    tiles = photomosaic.as_feature_dtype(rng.random((50, 24, 24, 3)), np.uint8)
+    cands = photomosaic.as_feature_dtype(rng.random((9, 24, 24, 3)), np.uint8)
+    engine = photomosaic.DistanceMatrixEngine.from_tiles(tiles, dtype=np.uint8)
+    lib = photomosaic.FeatureMatrix.from_stack(cands, dtype=np.uint8)
+    block = engine.calc_features(lib)
+    assert block.dtype == np.float32
+    expected = np.stack([engine.calc_uint8(lib, i, slice(None)) for i in range(len(lib))])
+    assert np.array_equal(block, expected)
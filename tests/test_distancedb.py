@@ -0,0 +1,26 @@
+from __future__ import annotations
+import pathlib
+import numpy as np
+import pytest
+
+pytest.importorskip('mediatools')
+
+from canvas.distancedb import DistanceDB
+
+def assert_exact_topk(db: DistanceDB, target: str):
+    _, matrix = db.load_matrix(target)
+    _, top_dists = db.load_top_distances(target)
+    assert np.array_equal(top_dists, np.sort(matrix, axis=0)[:db.top_k].T)
+
+def test_top_distances_stay_exact_when_thumbs_are_stored_again(tmp_path: pathlib.Path):
+    db = DistanceDB.open(tmp_path / 'distances.db', top_k=3)
+    rng = np.random.default_rng(0)
+    for b in range(8):
+        db.insert_matrix('target', [f'{b}_{i}' for i in range(5)], rng.random((5, 20)).astype(np.float32))
+    assert_exact_topk(db, 'target')
+
+    # worse distances for thumbs that were in the top-k: evicted thumbs must come back
+    db.insert_matrix('target', ['0_0', '3_1'], np.full((2, 20), 5.0, dtype=np.float32))
+    assert_exact_topk(db, 'target')
+    db.insert_matrix('target', ['0_0'], np.zeros((1, 20), dtype=np.float32))
+    assert_exact_topk(db, 'target')
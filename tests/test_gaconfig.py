@@ -0,0 +1,35 @@
+from __future__ import annotations
+import numpy as np
+import pytest
+import scipy.optimize
+
+pytest.importorskip('mediatools')
+
+from canvas.gaconfig import AssignmentProblem, GAConfig, run_islands
+
+def random_problem(num_candidates: int, num_positions: int) -> AssignmentProblem:
+    return AssignmentProblem.from_distances(np.random.default_rng(0).random((num_candidates, num_positions)))
+
+def gap_closed(problem: AssignmentProblem, config: GAConfig, generations: int) -> float:
+    '''Fraction of the gap between the greedy and the optimal cost that the GA closes.'''
+    greedy_cost = problem.cost(problem.greedy_genome()[np.newaxis])[0]
+    rows, cols = scipy.optimize.linear_sum_assignment(problem.dists.T)
+    optimal_cost = problem.dists.T[rows, cols].sum()
+
+    result = config.run(problem, generations)
+    assert np.unique(result.genome).shape[0] == problem.num_positions
+    assert np.isclose(result.cost, problem.cost(result.genome[np.newaxis])[0])
+    return (greedy_cost - result.cost) / (greedy_cost - optimal_cost)
+
+def test_vectorised_operators_improve_on_greedy():
+    assert gap_closed(random_problem(200, 60), GAConfig(improve_positions=0), 300) > 0.5
+
+def test_memetic_step_improves_on_greedy():
+    assert gap_closed(random_problem(200, 60), GAConfig(population_size=16, improve_positions=32), 100) > 0.9
+
+def test_islands_do_not_depend_on_processes():
+    problem = random_problem(300, 80)
+    kwargs = dict(num_islands=3, epochs=2, generations_per_epoch=3, seed=1)
+    single = run_islands(GAConfig(), problem, processes=1, **kwargs)
+    pooled = run_islands(GAConfig(), problem, processes=2, **kwargs)
+    assert np.array_equal(single.genome, pooled.genome)
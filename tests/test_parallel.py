@@ -0,0 +1,52 @@
+from __future__ import annotations
+import pathlib
+import numpy as np
+import pytest
+
+pytest.importorskip('mediatools')
+
+import photomosaic
+import main
+
+def sequential_greedy(dists: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Reference: GridScores.insert_any_if_best over candidate rows in order.'''
+    best = [float('inf')] * dists.shape[1]
+    owner = [-1] * dists.shape[1]
+    for c, row in enumerate(dists.tolist()):
+        for dist, pos in sorted(zip(row, range(len(row)))):
+            if dist < best[pos]:
+                best[pos], owner[pos] = dist, c
+                break
+    return np.array(best), np.array(owner)
+
+def test_replay_falls_through_to_next_position():
+    # A=[1, 5], B=[2, 3]: B loses position 0 to A and must fall through to position 1
+    dists = np.array([[1.0, 5.0], [2.0, 3.0]])
+    lists = photomosaic.CandidateLists.from_block(dists, k=1)
+    best, owner = photomosaic.replay_greedy(lists, 2, row_func=lambda c: dists[c])
+    assert owner.tolist() == [0, 1]
+    assert best.tolist() == [1.0, 3.0]
+
+@pytest.mark.parametrize('k', [1, 3, 40])
+def test_replay_matches_sequential(k):
+    rng = np.random.default_rng(k)
+    dists = rng.random((300, 40))
+    dists[rng.random(dists.shape) < 0.05] = 0.5 # ties
+    lists = photomosaic.CandidateLists.from_block(dists, k=k)
+    best, owner = photomosaic.replay_greedy(lists, dists.shape[1], row_func=lambda c: dists[c])
+    ref_best, ref_owner = sequential_greedy(dists)
+    assert np.array_equal(owner, ref_owner)
+    assert np.array_equal(best, ref_best)
+
+def test_sharded_matches_greedy_optimize_thread(synthetic_run, tmp_path: pathlib.Path):
+    cand_files, sgrid = synthetic_run(120)
+
+    seq_topk, par_topk = photomosaic.TopKAccumulator.empty(len(sgrid), 5), photomosaic.TopKAccumulator.empty(len(sgrid), 5)
+    sequential = main.greedy_optimize_thread(0, cand_files, sgrid, tmp_path, checkpoint_seconds=None, topk=seq_topk)
+    sharded = main.greedy_optimize_parallel(cand_files, sgrid, processes=2, num_shards=3, k=2, topk=par_topk)
+    seq_dists, seq_ids = sequential.to_arrays()
+    par_dists, par_ids = sharded.to_arrays()
+    assert np.array_equal(seq_ids, par_ids)
+    assert np.allclose(seq_dists, par_dists)
+    assert np.array_equal(seq_topk.cand_ids, par_topk.cand_ids)
+    assert np.allclose(seq_topk.dists, par_topk.dists)
@@ -0,0 +1,21 @@
+from __future__ import annotations
+import numpy as np
+import pytest
+
+pytest.importorskip('mediatools')
+
+import photomosaic
+
+def test_filling_empty_positions_is_reported_as_improvement():
+    dists = np.random.default_rng(0).random((100, 30))
+    cand_ids = np.full(30, -1, dtype=np.int64)
+    cand_ids[:20] = np.arange(20)
+    report = photomosaic.anneal(cand_ids, photomosaic.DistanceLookup.from_matrix(dists), time_budget=0.2)
+
+    assert report.initial_unassigned == 10
+    assert report.assignment.num_unassigned == 0
+    assert report.improvement > 0
+    # trajectory costs are on the same basis as the initial and final costs
+    assert report.trajectory[0].cost == report.initial_cost
+    assert np.isclose(report.trajectory[-1].best_cost, report.final_cost)
+    assert np.isclose(report.final_cost, report.assignment.total_cost)